@@ -0,0 +1,333 @@
+# admission_control.py
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# github.com/FlyingFathead/TelegramBot-OpenAI-API/
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#
+# Admission control for OpenAI requests: token buckets + fair queuing.
+#
+# Replaces the old fixed one-minute request counter. Two token buckets
+# refill continuously:
+#   - requests per minute (`MaxGlobalRequestsPerMinute`)
+#   - tokens per minute   (`[AdmissionControl] TokensPerMinute`)
+# Both are kept in step with what OpenAI reports in the
+# `x-ratelimit-limit/remaining/reset-*` response headers (the gateway feeds
+# every response's headers in), so a bucket that's configured as unlimited
+# still learns the account's real RPM/TPM limits.
+#
+# A message that doesn't fit in the buckets right now waits in a bounded
+# queue instead of being turned away. The queue is served by weighted fair
+# queuing over users *and* chats, so one noisy user (or one busy group)
+# can't take the whole budget; the bot owner (`BotOwnerID`) always goes
+# first. Only when the queue is full, or a message has waited for longer
+# than `MaxQueueWait`, is the user told that the bot is busy.
+
+import time
+import heapq
+import asyncio
+import logging
+import itertools
+import configparser
+
+import bot_metrics
+from config_paths import CONFIG_PATH
+from modules import history_token_total
+from retry_policy import parse_duration, int_header
+
+logger = logging.getLogger('TelegramBotLogger')
+
+# Load the configuration file
+config = configparser.ConfigParser()
+config.read(CONFIG_PATH)
+
+REQUESTS_PER_MINUTE = config.getint('DEFAULT', 'MaxGlobalRequestsPerMinute', fallback=60)
+TOKENS_PER_MINUTE = config.getint('AdmissionControl', 'TokensPerMinute', fallback=0)
+MAX_QUEUE_SIZE = config.getint('AdmissionControl', 'MaxQueueSize', fallback=100)
+MAX_QUEUE_WAIT = config.getfloat('AdmissionControl', 'MaxQueueWait', fallback=30.0)
+# room reserved for the reply when estimating a request's token cost
+ESTIMATED_COMPLETION_TOKENS = config.getint('AdmissionControl', 'EstimatedCompletionTokens', fallback=800)
+# i.e. "12345:2, 67890:0.5"; users not listed have a weight of 1
+USER_WEIGHTS = config.get('AdmissionControl', 'UserWeights', fallback='')
+
+
+class AdmissionRejected(Exception):
+    """The request can't be admitted (queue full, or it waited too long)."""
+
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+
+def parse_user_weights(text):
+    weights = {}
+    for item in text.split(','):
+        if ':' not in item:
+            continue
+        user_id, weight = item.split(':', 1)
+        try:
+            weights[user_id.strip()] = max(0.01, float(weight))
+        except ValueError:
+            logger.warning(f"Ignoring an invalid user weight in [AdmissionControl] UserWeights: '{item.strip()}'")
+    return weights
+
+def estimate_request_tokens(chat_data, user_message, count_fn, encoding=None, completion_tokens=ESTIMATED_COMPLETION_TOKENS):
+    """Rough token cost of answering `user_message` on top of the chat's history (its running token total is reused)."""
+    history_tokens = history_token_total(chat_data, count_fn, encoding)
+    return history_tokens + count_fn(user_message or '') + completion_tokens
+
+
+class TokenBucket:
+    """
+    A continuously refilling bucket of `per_minute` units (0 = unlimited).
+    The level may go negative when actual use turns out higher than reserved.
+    """
+
+    def __init__(self, per_minute):
+        self.configured_per_minute = per_minute
+        self.per_minute = per_minute
+        self.capacity = float(per_minute)
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    @property
+    def unlimited(self):
+        return not self.per_minute
+
+    def _refill(self):
+        now = time.monotonic()
+        if not self.unlimited:
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.per_minute / 60.0)
+        self.updated = now
+        return now
+
+    def wait_time(self, amount):
+        """Seconds until `amount` units are available (0 if they are now)."""
+        if self.unlimited:
+            return 0.0
+        now = self._refill()
+        blocked = max(0.0, self.blocked_until - now)
+        # a single request bigger than the whole bucket only has to wait for a full bucket
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return blocked
+        return max(blocked, (amount - self.level) * 60.0 / self.per_minute)
+
+    def consume(self, amount):
+        if self.unlimited:
+            return
+        self._refill()
+        self.level = min(self.capacity, self.level - amount)
+
+    def sync(self, limit=None, remaining=None, reset_seconds=None):
+        """Adopt the limits the API reports (never looser than what's configured)."""
+        if limit and limit != self.per_minute and (not self.configured_per_minute or limit < self.configured_per_minute):
+            was_unlimited = self.unlimited
+            self.per_minute = limit
+            self.capacity = float(limit)
+            self.level = self.capacity if was_unlimited else min(self.level, self.capacity)
+        if self.unlimited or remaining is None:
+            return
+        self._refill()
+        self.level = min(self.level, float(remaining))
+        if remaining <= 0 and reset_seconds:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + reset_seconds)
+
+
+class AdmissionTicket:
+    __slots__ = ("user_id", "chat_id", "tokens", "requests", "released")
+
+    def __init__(self, user_id, chat_id, tokens):
+        self.user_id = user_id
+        self.chat_id = chat_id
+        self.tokens = tokens
+        self.requests = 1
+        self.released = False
+
+
+class _Waiter:
+    __slots__ = ("sort_key", "start", "ticket", "future", "enqueued")
+
+    def __init__(self, sort_key, start, ticket, future):
+        self.sort_key = sort_key
+        self.start = start
+        self.ticket = ticket
+        self.future = future
+        self.enqueued = time.monotonic()
+
+    def __lt__(self, other):
+        return self.sort_key < other.sort_key
+
+
+class AdmissionController:
+    """
+    Admits OpenAI requests through the RPM/TPM buckets; what doesn't fit waits
+    in a weighted-fair queue (owner first).
+
+        ticket = await controller.acquire(user_id, chat_id, estimated_tokens)
+        ...
+        controller.release(ticket, tokens_used=..., requests_used=...)
+    """
+
+    def __init__(
+        self,
+        requests_per_minute=REQUESTS_PER_MINUTE,
+        tokens_per_minute=TOKENS_PER_MINUTE,
+        max_queue_size=MAX_QUEUE_SIZE,
+        max_queue_wait=MAX_QUEUE_WAIT,
+        owner_id=None,
+        user_weights=None,
+    ):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.max_queue_size = max_queue_size
+        self.max_queue_wait = max_queue_wait
+        self.owner_id = str(owner_id) if owner_id and str(owner_id) != '0' else None
+        self.user_weights = user_weights if user_weights is not None else parse_user_weights(USER_WEIGHTS)
+
+        self._queue = []                 # heap of _Waiter
+        self._sequence = itertools.count()
+        self._virtual_time = 0.0         # finish tag of the last admitted request
+        self._finish_tags = {}           # ('user', id) / ('chat', id) => latest finish tag
+        self._timer = None
+        self._timer_due = None
+
+    # ~~~~~~~~~
+    # admission
+    # ~~~~~~~~~
+
+    def is_owner(self, user_id):
+        return self.owner_id is not None and str(user_id) == self.owner_id
+
+    async def acquire(self, user_id, chat_id, estimated_tokens):
+        """
+        Wait until the request may go out; returns an `AdmissionTicket`.
+        Raises `AdmissionRejected` if the queue is full or the wait exceeds `max_queue_wait`.
+        """
+        ticket = AdmissionTicket(user_id, chat_id, max(1, int(estimated_tokens)))
+
+        # fast path: nobody waiting and both buckets have room
+        if not self._queue and self._wait_time(ticket) == 0:
+            # still charged to the user's and chat's fair share, so a burst that got
+            # through here doesn't also jump the queue later on
+            start, _ = self._tag(ticket)
+            self._virtual_time = max(self._virtual_time, start)
+            self._admit(ticket, queued_for=0.0)
+            return ticket
+
+        if len(self._queue) >= self.max_queue_size:
+            bot_metrics.increment("admission.rejected.queue_full")
+            logger.warning(f"Admission queue full ({len(self._queue)}); turning away a request from user {user_id}.")
+            raise AdmissionRejected("queue_full")
+
+        future = asyncio.get_running_loop().create_future()
+        start, finish = self._tag(ticket)
+        priority = 0 if self.is_owner(user_id) else 1
+        waiter = _Waiter((priority, finish, next(self._sequence)), start, ticket, future)
+        heapq.heappush(self._queue, waiter)
+        bot_metrics.increment("admission.queued")
+        bot_metrics.set_gauge("admission.queue_depth", len(self._queue))
+        self._dispatch()
+
+        try:
+            return await asyncio.wait_for(future, timeout=self.max_queue_wait)
+        except asyncio.TimeoutError:
+            bot_metrics.increment("admission.rejected.timeout")
+            logger.warning(f"Request from user {user_id} waited over {self.max_queue_wait:g}s for admission; giving up.")
+            raise AdmissionRejected("timeout")
+        finally:
+            if not future.done():
+                future.cancel()
+            self._dispatch()  # drop cancelled waiters, re-arm the timer
+
+    def release(self, ticket, tokens_used=None, requests_used=1):
+        """
+        Settle a ticket: return unused reserved tokens and requests (or charge the overrun).
+        `tokens_used=None` keeps the token reservation as it is; a turn that never sent
+        a request settles with `tokens_used=0, requests_used=0`.
+        """
+        if ticket is None or ticket.released:
+            return
+        ticket.released = True
+        if tokens_used is not None:
+            self.tokens.consume(tokens_used - ticket.tokens)
+        if requests_used != ticket.requests:
+            self.requests.consume(requests_used - ticket.requests)
+        self._dispatch()
+
+    def observe_response(self, response):
+        """Gateway response hook: sync the buckets with OpenAI's `x-ratelimit-*` headers."""
+        headers = response.headers
+        for kind, bucket in (("requests", self.requests), ("tokens", self.tokens)):
+            limit = int_header(headers, f"x-ratelimit-limit-{kind}")
+            remaining = int_header(headers, f"x-ratelimit-remaining-{kind}")
+            if limit is None and remaining is None:
+                continue
+            reset_seconds = parse_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+            bucket.sync(limit=limit, remaining=remaining, reset_seconds=reset_seconds)
+            if remaining is not None:
+                bot_metrics.set_gauge(f"openai.ratelimit.remaining_{kind}", remaining)
+
+    # ~~~~~~~~~~~~~~~~~~~~
+    # fair queue internals
+    # ~~~~~~~~~~~~~~~~~~~~
+
+    def _tag(self, ticket):
+        """
+        WFQ start/finish tags: a flow (user / chat) that has been sending a lot has
+        its tags pushed further out, so other flows' requests get ahead of it.
+        """
+        user_key = ('user', ticket.user_id)
+        chat_key = ('chat', ticket.chat_id)
+        weight = self.user_weights.get(str(ticket.user_id), 1.0)
+        start = max(self._virtual_time, self._finish_tags.get(user_key, 0.0), self._finish_tags.get(chat_key, 0.0))
+        finish = start + ticket.tokens / weight
+        self._finish_tags[user_key] = finish
+        self._finish_tags[chat_key] = finish
+        return start, finish
+
+    def _wait_time(self, ticket):
+        return max(self.requests.wait_time(1), self.tokens.wait_time(ticket.tokens))
+
+    def _admit(self, ticket, queued_for):
+        self.requests.consume(1)
+        self.tokens.consume(ticket.tokens)
+        bot_metrics.increment("admission.admitted")
+        bot_metrics.observe("admission.queue_wait", queued_for)
+        if self.is_owner(ticket.user_id):
+            bot_metrics.increment("admission.owner_admitted")
+
+    def _dispatch(self):
+        while self._queue:
+            waiter = self._queue[0]
+            if waiter.future.done():
+                heapq.heappop(self._queue)  # timed out / cancelled
+                continue
+            wait = self._wait_time(waiter.ticket)
+            if wait > 0:
+                self._arm_timer(wait)
+                break
+            heapq.heappop(self._queue)
+            self._virtual_time = max(self._virtual_time, waiter.start)
+            self._admit(waiter.ticket, queued_for=time.monotonic() - waiter.enqueued)
+            waiter.future.set_result(waiter.ticket)
+
+        bot_metrics.set_gauge("admission.queue_depth", len(self._queue))
+        if not self._queue:
+            # finish tags at or behind the virtual clock no longer affect anything
+            self._finish_tags = {key: tag for key, tag in self._finish_tags.items() if tag > self._virtual_time}
+
+    def _arm_timer(self, delay):
+        loop = asyncio.get_running_loop()
+        due = loop.time() + delay
+        if self._timer is not None:
+            if self._timer_due <= due:
+                return
+            self._timer.cancel()
+        self._timer_due = due
+        self._timer = loop.call_later(delay, self._on_timer)
+
+    def _on_timer(self):
+        self._timer = None
+        self._timer_due = None
+        self._dispatch()
+
@@ -10,6 +10,8 @@ import re
 import openai  # Add the OpenAI module to make the API request
 import configparser  # Add configparser to read from config.ini
 from config_paths import CONFIG_PATH
+from llm_router import get_llm_router
+from retry_policy import CircuitOpenError
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -180,19 +182,10 @@ async def sub_agent_openai_call(user_message, search_terms, search_results, retr
                 "max_tokens": max_tokens  # Use max_tokens from config.ini
             }
 
-            # Make the API request using httpx
-            headers = {
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {openai.api_key}"
-            }
-
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    "https://api.openai.com/v1/chat/completions",
-                    data=json.dumps(payload),
-                    headers=headers,
-                    timeout=timeout
-                )
+            # Make the API request on the backend configured for the search agent (see llm_router.py)
+            # (HTTP-level retries, `Retry-After` etc. are handled by the gateway's retry policy)
+            response = await get_llm_router().chat_completion("search_agent", payload, timeout=timeout)
+            response.raise_for_status()
 
             response_json = response.json()
             logger.info(f"Sub-agent API request completed. Response: {response_json}")
@@ -247,10 +240,15 @@ async def sub_agent_openai_call(user_message, search_terms, search_results, retr
             # ***Return the final reply***
             return format_for_telegram_html(agent_reply)
 
+        except (httpx.HTTPError, CircuitOpenError) as e:
+            # already retried as far as it makes sense; trying again here would only multiply that
+            logger.error(f"Sub-agent API request failed - {str(e)}. Returning DuckDuckGo search results.")
+            return format_for_telegram_html(search_results)
+
         except Exception as e:
             logger.error(f"Attempt {attempt + 1}: Error during sub-agent API request - {str(e)}")
+            await asyncio.sleep(get_llm_router().backend_for("search_agent").gateway.retry_policy.backoff(attempt))
             attempt += 1
-            await asyncio.sleep(2)  # Optional delay between retries
 
     logger.error(f"All {retries} retry attempts failed. Returning DuckDuckGo search results.")
     return format_for_telegram_html(search_results)
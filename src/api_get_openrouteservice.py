@@ -108,25 +108,17 @@ async def format_and_translate_directions(bot, user_request, directions_info):
         "temperature": 0.5
     }
 
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {openai.api_key}"
-    }
-
-    # Make the API request
-    async with httpx.AsyncClient() as client:
-        response = await client.post("https://api.openai.com/v1/chat/completions",
-                                     data=json.dumps(payload),
-                                     headers=headers,
-                                     timeout=bot.timeout)
-        response_json = response.json()
+    # Make the API request (on the backend configured for formatting tasks, see llm_router.py)
+    response = await bot.llm_router.chat_completion("formatting", payload, timeout=bot.timeout)
+    response_json = response.json()
 
     # Extract the formatted and potentially translated response
     if response.status_code == 200 and 'choices' in response_json:
         translated_reply = response_json['choices'][0]['message']['content'].strip()
-        bot_token_count = bot.count_tokens(translated_reply)  # Count the tokens in the translated reply
-        bot.total_token_usage += bot_token_count  # Add to the total token usage
-        bot.write_total_token_usage(bot.total_token_usage)  # Update the total token usage file
+        # only usage on a billable backend counts towards the caps (see llm_router.py)
+        if bot.llm_router.backend_for("formatting").billable:
+            bot_token_count = bot.count_tokens(translated_reply)  # Count the tokens in the translated reply
+            bot.add_token_usage(bot_token_count, 'directions_formatting')  # Add to today's token usage
         logging.info(f"Sent this directions report to user: {translated_reply}")
         return translated_reply
     else:
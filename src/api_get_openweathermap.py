@@ -38,7 +38,8 @@ from api_get_weatherapi import get_moon_phase, get_timezone, get_daily_forecast,
 from api_get_additional_weather_data import get_additional_data_dump
 
 # get the combined weather
-async def get_weather(city_name, country, exclude='', units='metric', lang='fi'):
+# (`coordinates`: an already geocoded `(lat, lon, country_code)` for the city, to skip the lookup)
+async def get_weather(city_name, country, exclude='', units='metric', lang='fi', coordinates=None):
     api_key = os.getenv('OPENWEATHERMAP_API_KEY')
     if not api_key:
         logging.error("[WARNING] OpenWeatherMap API key not set. You need to set the 'OPENWEATHERMAP_API_KEY' environment variable to use OpenWeatherMap API functionalities!")
@@ -51,7 +52,10 @@ async def get_weather(city_name, country, exclude='', units='metric', lang='fi')
 
     base_url = 'http://api.openweathermap.org/data/2.5/'
 
-    lat, lon, resolved_country = await get_coordinates(city_name, country=country)
+    if coordinates is not None:
+        lat, lon, resolved_country = coordinates
+    else:
+        lat, lon, resolved_country = await get_coordinates(city_name, country=country)
     if lat is None or lon is None or resolved_country is None:
         logging.info("Failed to retrieve coordinates or country.")
         return "[Unable to retrieve coordinates or country for the specified location. Ask the user for clarification.]"
@@ -584,25 +588,17 @@ async def format_and_translate_weather(bot, user_request, weather_info):
         "temperature": 0.5
     }
 
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {openai.api_key}"
-    }
-
-    # Make the API request
-    async with httpx.AsyncClient() as client:
-        response = await client.post("https://api.openai.com/v1/chat/completions",
-                                     data=json.dumps(payload),
-                                     headers=headers,
-                                     timeout=bot.timeout)
-        response_json = response.json()
+    # Make the API request (on the backend configured for formatting tasks, see llm_router.py)
+    response = await bot.llm_router.chat_completion("formatting", payload, timeout=bot.timeout)
+    response_json = response.json()
 
     # Extract the formatted and potentially translated response
     if response.status_code == 200 and 'choices' in response_json:
         translated_reply = response_json['choices'][0]['message']['content'].strip()
-        bot_token_count = bot.count_tokens(translated_reply)  # Count the tokens in the translated reply
-        bot.total_token_usage += bot_token_count  # Add to the total token usage
-        bot.write_total_token_usage(bot.total_token_usage)  # Update the total token usage file
+        # only usage on a billable backend counts towards the caps (see llm_router.py)
+        if bot.llm_router.backend_for("formatting").billable:
+            bot_token_count = bot.count_tokens(translated_reply)  # Count the tokens in the translated reply
+            bot.add_token_usage(bot_token_count, 'weather_formatting')  # Add to today's token usage
         logging.info(f"Sent this weather report to user: {translated_reply}")
         return translated_reply
     else:
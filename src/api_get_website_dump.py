@@ -3,7 +3,7 @@
 import urllib.parse
 import subprocess
 import logging
-import tiktoken  # for token counting
+from token_counter import truncate_to_tokens  # for token counting
 import sys
 import asyncio
 import re
@@ -78,20 +78,15 @@ async def get_website_dump(url, max_tokens=10000):
             content = re.sub(r'\s*\n\s*', '\n', content)  # Clean up newlines
             content = re.sub(r'\n{2,}', '\n', content)  # Ensure no multiple consecutive newlines
 
-            # Use the correct encoding for GPT-4o
-            enc = tiktoken.encoding_for_model("gpt-4o")  # Load the appropriate tokenizer for GPT-4o
-            tokens = enc.encode(content)
-
-            # Log the fetched content and token count
+            # Log the fetched content
             logging.info(f"Upon user's request, fetched content from: {url}")
-            logging.info(f"Token count: {len(tokens)}")
 
             # If the token count exceeds the max_tokens, truncate the content
-            if len(tokens) > max_tokens:
-                # Trim tokens to fit within the max_tokens
-                tokens = tokens[:max_tokens]
-                # Decode the trimmed tokens back to text
-                content = enc.decode(tokens)
+            # (the shared, cached encoder; no per-call tokenizer setup)
+            original_length = len(content)
+            content, token_count = truncate_to_tokens(content, max_tokens)
+            logging.info(f"Token count: {token_count}")
+            if len(content) < original_length:
                 logging.info(f"Content truncated to {max_tokens} tokens.")
 
             return content.strip()
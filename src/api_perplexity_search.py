@@ -10,8 +10,8 @@ import logging
 import os
 import asyncio
 import configparser
-import random
 from config_paths import CONFIG_PATH
+from retry_policy import RetryPolicy, CircuitOpenError
 
 # Load the configuration file
 config = configparser.ConfigParser()
@@ -36,6 +36,10 @@ CHUNK_SIZE = config.getint('Perplexity', 'ChunkSize', fallback=DEFAULT_CHUNK_SIZ
 PERPLEXITY_API_KEY = os.getenv("PERPLEXITY_API_KEY")
 MAX_TELEGRAM_MESSAGE_LENGTH = 4000
 
+# backoff with jitter / Retry-After / circuit breaker, same as the OpenAI calls (see retry_policy.py);
+# `RetryDelay` caps the backoff between attempts
+perplexity_retry_policy = RetryPolicy("perplexity", max_attempts=PERPLEXITY_MAX_RETRIES, max_delay=PERPLEXITY_RETRY_DELAY)
+
 async def fact_check_with_perplexity(question: str):
     url = "https://api.perplexity.ai/chat/completions"
     headers = {
@@ -52,23 +56,23 @@ async def fact_check_with_perplexity(question: str):
     }
 
     async with httpx.AsyncClient(timeout=PERPLEXITY_TIMEOUT) as client:
-        for attempt in range(PERPLEXITY_MAX_RETRIES):
-            try:
-                response = await client.post(url, json=data, headers=headers)
-                if response.status_code == 200:
-                    return response.json()
-                elif response.status_code == 500:
-                    logging.error("Perplexity API returned a 500 server error.")
-                    return {"error": "server_error"}
-                else:
-                    logging.error(f"Perplexity API Error: {response.text}")
-            except (httpx.RequestError, httpx.HTTPStatusError) as e:
-                logging.error(f"Error while calling Perplexity API: {e}")
-
-            backoff_delay = min(PERPLEXITY_RETRY_DELAY, (2 ** attempt) + random.uniform(0, 1))
-            await asyncio.sleep(backoff_delay)
-
-    return None
+        try:
+            response = await perplexity_retry_policy.run(lambda: client.post(url, json=data, headers=headers))
+        except CircuitOpenError as e:
+            logging.error(f"Not calling the Perplexity API: {e}")
+            return {"error": "server_error"}
+        except httpx.RequestError as e:
+            logging.error(f"Error while calling Perplexity API: {e}")
+            return None
+
+    if response.status_code == 200:
+        return response.json()
+    elif response.status_code >= 500:
+        logging.error(f"Perplexity API returned a {response.status_code} server error.")
+        return {"error": "server_error"}
+    else:
+        logging.error(f"Perplexity API Error: {response.text}")
+        return None
 
 async def query_perplexity(bot, chat_id, question: str):
     logging.info(f"Querying Perplexity with question: {question}")
@@ -533,18 +537,12 @@ async def detect_language(bot, text):
         "max_tokens": 10
     }
 
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {bot.openai_api_key}"
-    }
-
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post("https://api.openai.com/v1/chat/completions", json=payload, headers=headers)
-            response.raise_for_status()
-            detected_language = response.json()['choices'][0]['message']['content'].strip()
-            logging.info(f"Detected language: {detected_language}")
-            return detected_language
+        response = await bot.llm_router.chat_completion("language_detection", payload)
+        response.raise_for_status()
+        detected_language = response.json()['choices'][0]['message']['content'].strip()
+        logging.info(f"Detected language: {detected_language}")
+        return detected_language
     except httpx.RequestError as e:
         logging.error(f"RequestError while calling OpenAI API: {e}")
     except httpx.HTTPStatusError as e:
@@ -0,0 +1,240 @@
+# async_db.py
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# github.com/FlyingFathead/TelegramBot-OpenAI-API/
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#
+# Non-blocking access to the SQLite databases (db_utils.py) from coroutines.
+#
+# `db_utils` is synchronous; calling it from a handler stalls the event
+# loop (and every other chat) for as long as the disk takes. Here:
+#
+#   - reads run on a reader thread, on db_utils' shared connection
+#   - writes are queued to a single writer thread with its own connection;
+#     it drains the queue and commits whatever has piled up in one
+#     transaction (each write in its own savepoint, so one failing write
+#     doesn't take the others down with it)
+#
+# In WAL mode the reader and the writer don't block each other. `await`ing a
+# write returns once it's committed; `submit()` doesn't wait.
+# Pending writes are flushed on shutdown. Writes, transactions and commit
+# times are recorded as `db.*` metrics (see `/metrics`). See `[Database]`
+# in config.ini.
+
+import time
+import queue
+import atexit
+import asyncio
+import logging
+import threading
+import configparser
+import concurrent.futures
+from collections import defaultdict
+
+import db_utils
+import bot_metrics
+from config_paths import CONFIG_PATH
+
+logger = logging.getLogger('TelegramBotLogger')
+
+# Load the configuration file
+config = configparser.ConfigParser()
+config.read(CONFIG_PATH)
+
+# most writes committed in one transaction
+MAX_WRITE_BATCH = config.getint('Database', 'MaxWriteBatch', fallback=200)
+
+# ends the writer thread
+_STOP = object()
+
+
+class AsyncDatabase:
+    """
+    The reader and writer threads:
+
+        rows = await db.read(db_utils.get_due_reminders, path, now)
+        reminder_id = await db.write(path, db_utils._op_add_reminder, user_id, ...)
+        db.submit(path, db_utils._op_add_daily_usage, ...)   # not waited for
+    """
+
+    def __init__(self, max_batch=MAX_WRITE_BATCH):
+        self.max_batch = max(1, max_batch)
+        self.reader = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='async_db-read')
+        self.queue = queue.Queue()
+        self.writer = None
+        self.lock = threading.Lock()
+        self.closed = False
+
+    # ~~~~~
+    # reads
+    # ~~~~~
+
+    async def read(self, function, *args):
+        """Runs the (blocking) db_utils read `function(*args)` on the reader thread."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.reader, function, *args)
+
+    # ~~~~~~
+    # writes
+    # ~~~~~~
+
+    def submit(self, db_path, operation, *args, failure=False):
+        """
+        Queues `operation(conn, *args)` for the writer thread; returns a `concurrent.futures.Future`
+        with its result (or `failure` if it failed, which is logged).
+        """
+        future = concurrent.futures.Future()
+        if not db_path:
+            logger.error("Database path is not set. Cannot write.")
+            future.set_result(failure)
+            return future
+        with self.lock:
+            if self.closed:
+                # shutting down: write synchronously rather than drop it
+                future.set_result(db_utils._write(db_path, operation, *args, failure=failure))
+                return future
+            if self.writer is None:
+                self.writer = threading.Thread(target=self._writer_loop, name='async_db-write', daemon=True)
+                self.writer.start()
+            self.queue.put((db_path, operation, args, failure, future))
+        return future
+
+    async def write(self, db_path, operation, *args, failure=False):
+        """Queues a write and waits until it's committed; returns its result."""
+        return await asyncio.wrap_future(self.submit(db_path, operation, *args, failure=failure))
+
+    def close(self, timeout=10):
+        """Commits the queued writes and stops the threads."""
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            writer = self.writer
+            if writer is not None:
+                self.queue.put(_STOP)
+        if writer is not None:
+            writer.join(timeout)
+        self.reader.shutdown(wait=False)
+
+    def _writer_loop(self):
+        connections = {}
+        try:
+            while True:
+                batch = [self.queue.get()]
+                while len(batch) < self.max_batch:
+                    try:
+                        batch.append(self.queue.get_nowait())
+                    except queue.Empty:
+                        break
+
+                stop = _STOP in batch
+                batch = [item for item in batch if item is not _STOP]
+                by_database = defaultdict(list)
+                for item in batch:
+                    by_database[str(item[0])].append(item)
+                for key, items in by_database.items():
+                    if key not in connections:
+                        try:
+                            connections[key] = db_utils._connect(items[0][0], isolation_level=None)
+                        except Exception as e:
+                            logger.error(f"async_db: cannot open {key} for writing: {e}")
+                            for item in items:
+                                item[4].set_result(item[3])
+                            continue
+                    self._commit_batch(connections[key], key, items)
+                if stop:
+                    return
+        finally:
+            for conn in connections.values():
+                try:
+                    conn.close()
+                except Exception as e:
+                    logger.error(f"async_db: error closing the writer connection: {e}")
+
+    def _commit_batch(self, conn, db_path, items):
+        started = time.monotonic()
+        results = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for _, operation, args, failure, _ in items:
+                conn.execute("SAVEPOINT single_write")
+                try:
+                    results.append(operation(conn, *args))
+                    conn.execute("RELEASE single_write")
+                except Exception as e:
+                    logger.error(f"async_db: {operation.__name__} failed on {db_path}: {e}")
+                    conn.execute("ROLLBACK TO single_write")
+                    conn.execute("RELEASE single_write")
+                    results.append(failure)
+            conn.execute("COMMIT")
+        except Exception as e:
+            logger.error(f"async_db: committing {len(items)} writes to {db_path} failed: {e}")
+            if conn.in_transaction:
+                conn.rollback()
+            results = [failure for _, _, _, failure, _ in items]
+
+        for item, result in zip(items, results):
+            item[4].set_result(result)
+        bot_metrics.increment("db.writes", len(items))
+        bot_metrics.increment("db.write_transactions")
+        bot_metrics.observe("db.write_transaction", time.monotonic() - started)
+
+
+_db = AsyncDatabase()
+
+async def read(function, *args):
+    """Runs a (blocking) db_utils read on the reader thread."""
+    return await _db.read(function, *args)
+
+def submit(db_path, operation, *args, failure=False):
+    """Queues a write operation for the writer thread, without waiting for it (returns its future)."""
+    return _db.submit(db_path, operation, *args, failure=failure)
+
+def close():
+    _db.close()
+
+# registered after db_utils' own exit handler, so this runs (and flushes) first
+atexit.register(close)
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# reminders (the reminders database)
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+async def count_pending_reminders_for_user(db_path, user_id):
+    return await _db.read(db_utils.count_pending_reminders_for_user, db_path, user_id)
+
+async def get_pending_reminders_for_user(db_path, user_id):
+    return await _db.read(db_utils.get_pending_reminders_for_user, db_path, user_id)
+
+async def get_past_reminders_for_user(db_path, user_id, limit=5):
+    return await _db.read(db_utils.get_past_reminders_for_user, db_path, user_id, limit)
+
+async def get_reminder_by_id(db_path, reminder_id):
+    return await _db.read(db_utils.get_reminder_by_id, db_path, reminder_id)
+
+async def get_due_reminders(db_path, current_utc_time_str):
+    return await _db.read(db_utils.get_due_reminders, db_path, current_utc_time_str)
+
+async def add_reminder_to_db(db_path, user_id, chat_id, reminder_text, due_time_utc_str):
+    """The new reminder's ID, or None on failure."""
+    return await _db.write(db_path, db_utils._op_add_reminder, user_id, chat_id, reminder_text, due_time_utc_str, failure=None)
+
+async def add_reminder_within_limit(db_path, user_id, chat_id, reminder_text, due_time_utc_str, max_pending):
+    """
+    `(reminder_id, pending_count)`: the new reminder's ID, or None if the user already has
+    `max_pending` pending reminders (0 = no limit); `(None, None)` on failure.
+    """
+    return await _db.write(
+        db_path, db_utils._op_add_reminder_within_limit,
+        user_id, chat_id, reminder_text, due_time_utc_str, max_pending, failure=(None, None)
+    )
+
+async def delete_reminder_from_db(db_path, reminder_id, user_id):
+    return await _db.write(db_path, db_utils._op_delete_reminder, reminder_id, user_id)
+
+async def update_reminder(db_path, reminder_id, new_due_time_utc, new_text):
+    return await _db.write(db_path, db_utils._op_update_reminder, reminder_id, new_due_time_utc, new_text)
+
+async def update_reminder_status(db_path, reminder_id, new_status):
+    return await _db.write(db_path, db_utils._op_update_reminder_status, reminder_id, new_status)
+
@@ -6,15 +6,18 @@ from telegram.constants import ParseMode
 from telegram.helpers import escape_markdown
 from functools import partial
 
-import json
 import os
-import datetime
+import html
 import logging
+from datetime import datetime, timedelta
 
 # bot's modules
 from config_paths import CONFIG_PATH
 from token_usage_visualization import generate_usage_chart
-from modules import reset_token_usage_at_midnight 
+import db_utils
+import usage_ledger
+import user_usage
+import bot_metrics
 
 # ~~~~~~~~~~~~~~
 # admin commands
@@ -32,6 +35,8 @@ Admin Commands:
 - <code>/viewconfig</code>: View the bot configuration (from <code>config.ini</code>).
 - <code>/usage</code>: View the bot's daily token usage in plain text.
 - <code>/usagechart</code>: View the bot's daily token usage as a chart.
+- <code>/metrics [prefix]</code>: View runtime metrics (i.e. tool latencies; optionally filtered by name prefix).
+- <code>/topusers [users|chats|models] [days | from to]</code>: View the top token consumers (default: users, last 7 days; dates as YYYY-MM-DD).
 - <code>/reset</code>: Reset the bot's context memory.
 - <code>/resetsystemmessage</code>: Reset the system message from <code>config.ini</code>.
 - <code>/setsystemmessage &lt;system message&gt;</code>: Set a new system message (note: not saved into config).
@@ -67,8 +72,8 @@ async def reset_daily_tokens_command(update: Update, context: CallbackContext, b
         # bot_instance.total_token_usage = 0
         # logging.info("In-memory token usage counter reset.")
 
-        # Pass the reset_total_token_usage method as a callback to reset_token_usage_at_midnight
-        reset_token_usage_at_midnight(bot_instance.token_usage_file, bot_instance.reset_total_token_usage)
+        # Appends a negative entry to the usage ledger, zeroing today's total
+        bot_instance.reset_total_token_usage()
         logging.info(f"User {user_id} has reset the daily token usage, including the in-memory token usage counter.")
         await update.message.reply_text("Daily token usage has been reset, including the in-memory token usage counter.")
         
@@ -130,39 +135,16 @@ async def usage_command(update: Update, context: CallbackContext):
         logging.info(f"User {update.message.from_user.id} does not have permission to use /usage")
         return
 
-    # Correct path to token_usage.json inside logs/ directory
-    # token_usage_file = os.path.join(bot_instance.data_directory, 'logs', 'token_usage.json')
-    token_usage_file = os.path.join(bot_instance.logs_directory, 'token_usage.json')
-
-    logging.info(f"Looking for token usage file at: {token_usage_file}")
-    current_date = datetime.datetime.utcnow()
-
+    # The last `MaxHistoryDays` days' totals from the usage ledger (see usage_ledger.py)
     try:
-        if os.path.exists(token_usage_file):
-            with open(token_usage_file, 'r') as file:
-                token_usage_history = json.load(file)
-            logging.info("Loaded token usage history successfully")
-            
-            # Prune token usage history
-            cutoff_date = current_date - datetime.timedelta(days=bot_instance.max_history_days)
-            token_usage_history = {
-                date: usage for date, usage in token_usage_history.items()
-                if datetime.datetime.strptime(date, '%Y-%m-%d') >= cutoff_date
-            }
-            logging.info("Pruned token usage history based on cutoff date")
-        else:
-            token_usage_history = {}
-            logging.warning(f"Token usage file does not exist at: {token_usage_file}")
-    except json.JSONDecodeError:
-        await update.message.reply_text("Error reading token usage history.")
-        logging.error("JSONDecodeError while reading token_usage.json")
-        return
+        token_usage_history = await usage_ledger.daily_totals(bot_instance.max_history_days)
+        logging.info("Loaded token usage history from the usage ledger")
     except Exception as e:
         await update.message.reply_text(f"An unexpected error occurred: {e}")
         logging.error(f"Unexpected error in usage_command: {e}")
         return
 
-    today_usage = token_usage_history.get(current_date.strftime('%Y-%m-%d'), 0)
+    today_usage = bot_instance.total_token_usage
     token_cap_info = (
         f"Today's usage: {today_usage} tokens\n"
         f"Daily token cap: {'No cap' if bot_instance.max_tokens_config == 0 else f'{bot_instance.max_tokens_config} tokens'}\n\n"
@@ -175,6 +157,92 @@ async def usage_command(update: Update, context: CallbackContext):
     await update.message.reply_text(token_cap_info)
     logging.info("Sent usage information to user")
 
+# /metrics (admin command)
+async def metrics_command(update: Update, context: CallbackContext):
+    bot_instance = context.bot_data.get('bot_instance')  # Retrieve the bot instance from context
+
+    if not bot_instance:
+        await update.message.reply_text("Internal error: Bot instance not found.")
+        logging.error("Bot instance not found in context.bot_data")
+        return
+
+    logging.info(f"User {update.message.from_user.id} invoked /metrics command")
+
+    if bot_instance.bot_owner_id == '0':
+        await update.message.reply_text("The `/metrics` command is disabled.")
+        return
+
+    if str(update.message.from_user.id) != bot_instance.bot_owner_id:
+        await update.message.reply_text("You don't have permission to use this command.")
+        logging.info(f"User {update.message.from_user.id} does not have permission to use /metrics")
+        return
+
+    # optional name prefix filter, i.e. `/metrics tool.get_weather`
+    prefix = context.args[0] if context.args else None
+    report = bot_metrics.format_metrics(prefix)
+
+    # stay under Telegram's message length limit
+    if len(report) > 3900:
+        report = report[:3900] + "\n[...]"
+
+    await update.message.reply_text(f"<pre>{html.escape(report)}</pre>", parse_mode=ParseMode.HTML)
+
+# /topusers (admin command)
+async def top_users_command(update: Update, context: CallbackContext):
+    bot_instance = context.bot_data.get('bot_instance')  # Retrieve the bot instance from context
+
+    if not bot_instance:
+        await update.message.reply_text("Internal error: Bot instance not found.")
+        logging.error("Bot instance not found in context.bot_data")
+        return
+
+    logging.info(f"User {update.message.from_user.id} invoked /topusers command")
+
+    if bot_instance.bot_owner_id == '0':
+        await update.message.reply_text("The `/topusers` command is disabled.")
+        return
+
+    if str(update.message.from_user.id) != bot_instance.bot_owner_id:
+        await update.message.reply_text("You don't have permission to use this command.")
+        logging.info(f"User {update.message.from_user.id} does not have permission to use /topusers")
+        return
+
+    # i.e. `/topusers`, `/topusers 30`, `/topusers chats 2025-01-01 2025-01-31`
+    group_by = 'users'
+    days = 7
+    dates = []
+    try:
+        for arg in context.args or []:
+            if arg.lower() in db_utils.USER_USAGE_GROUPINGS:
+                group_by = arg.lower()
+            elif arg.isdigit():
+                days = max(1, int(arg))
+            else:
+                dates.append(datetime.strptime(arg, '%Y-%m-%d').strftime('%Y-%m-%d'))
+        if len(dates) > 2:
+            raise ValueError("too many dates")
+    except ValueError:
+        await update.message.reply_text("Usage: /topusers [users|chats|models] [days | YYYY-MM-DD [YYYY-MM-DD]]")
+        return
+
+    today = datetime.utcnow().strftime('%Y-%m-%d')
+    if dates:
+        start_date, end_date = min(dates), (max(dates) if len(dates) == 2 else today)
+    else:
+        start_date, end_date = (datetime.utcnow() - timedelta(days=days - 1)).strftime('%Y-%m-%d'), today
+
+    rows = await user_usage.top_consumers(start_date, end_date, group_by)
+    if not rows:
+        await update.message.reply_text(f"No usage recorded from {start_date} to {end_date}.")
+        return
+
+    label = {'users': 'User', 'chats': 'Chat', 'models': 'Model'}[group_by]
+    lines = [f"Top {group_by} by tokens, {start_date} to {end_date} (UTC):", ""]
+    for rank, (key, total, prompt, completion, requests) in enumerate(rows, start=1):
+        lines.append(f"{rank:>2}. {label} {key}: {total} tokens ({prompt} prompt + {completion} completion, {requests} requests)")
+    report = "\n".join(lines)
+    await update.message.reply_text(f"<pre>{html.escape(report)}</pre>", parse_mode=ParseMode.HTML)
+
 # /usagechart (admin command)
 async def usage_chart_command(update: Update, context: CallbackContext):
     bot_instance = context.bot_data.get('bot_instance')  # Retrieve the bot instance from context
@@ -197,10 +265,8 @@ async def usage_chart_command(update: Update, context: CallbackContext):
         return
 
     # Define paths
-    token_usage_file = os.path.join(bot_instance.logs_directory, 'token_usage.json')
     output_image_file = os.path.join(bot_instance.data_directory, 'token_usage_chart.png')
 
-    logging.info(f"Looking for token usage file at: {token_usage_file}")
     logging.info(f"Output image file will be at: {output_image_file}")
 
     # Ensure the data directory exists
@@ -213,9 +279,10 @@ async def usage_chart_command(update: Update, context: CallbackContext):
         await update.message.reply_text(f"Failed to create the data directory for the chart. Please check the bot's permissions.")
         return
 
-    # Generate the usage chart
+    # Generate the usage chart from the usage ledger's daily totals
     try:
-        generate_usage_chart(token_usage_file, output_image_file)
+        token_usage_history = await usage_ledger.daily_totals(bot_instance.max_history_days)
+        generate_usage_chart(token_usage_history, output_image_file)
         bot_instance.logger.info(f"Generated usage chart at {output_image_file}")
     except Exception as e:
         bot_instance.logger.error(f"Failed to generate usage chart: {e}")
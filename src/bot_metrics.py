@@ -0,0 +1,178 @@
+# bot_metrics.py
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# github.com/FlyingFathead/TelegramBot-OpenAI-API/
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#
+# In-process metrics: counters, gauges and latency histograms.
+#
+# Everything lives in memory and resets on restart; the bot owner can view
+# a snapshot with the `/metrics` admin command. Metrics are recorded from
+# both the event loop and worker threads, so access goes through a lock.
+#
+# Usage:
+#   bot_metrics.increment('tool.get_weather.calls')
+#   bot_metrics.observe('tool.get_weather.latency', elapsed_seconds)
+#   with bot_metrics.timer('openai.chat_completion'): ...
+
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+# upper bounds (seconds) of the histogram buckets; the last bucket is open-ended
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# how many recent samples each histogram keeps for percentiles
+RECENT_SAMPLES = 1000
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_histograms = {}
+_started_at = time.time()
+
+
+class LatencyHistogram:
+    """Bucketed latency counts plus a window of recent samples for percentiles."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS, recent_samples=RECENT_SAMPLES):
+        self.buckets = buckets
+        self.bucket_counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent = deque(maxlen=recent_samples)
+
+    def observe(self, value):
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+        self.recent.append(value)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.bucket_counts[i] += 1
+                break
+        else:
+            self.bucket_counts[-1] += 1
+
+    def percentile(self, pct):
+        if not self.recent:
+            return None
+        ordered = sorted(self.recent)
+        index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered))) - 1))
+        return ordered[index]
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "avg": self.total / self.count if self.count else None,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "max": self.max if self.count else None,
+        }
+
+
+# ~~~~~~~~~
+# recording
+# ~~~~~~~~~
+
+def increment(name, amount=1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+def set_gauge(name, value):
+    with _lock:
+        _gauges[name] = value
+
+def observe(name, seconds):
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = LatencyHistogram()
+        histogram.observe(seconds)
+
+@contextmanager
+def timer(name):
+    """Observe the duration of the `with` block into histogram `name`."""
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        observe(name, time.monotonic() - started)
+
+
+# ~~~~~~~
+# reading
+# ~~~~~~~
+
+def get_counter(name):
+    with _lock:
+        return _counters.get(name, 0)
+
+def get_percentile(name, pct):
+    with _lock:
+        histogram = _histograms.get(name)
+        return histogram.percentile(pct) if histogram else None
+
+def snapshot():
+    with _lock:
+        return {
+            "uptime_seconds": time.time() - _started_at,
+            "counters": dict(_counters),
+            "gauges": dict(_gauges),
+            "histograms": {name: histogram.summary() for name, histogram in _histograms.items()},
+        }
+
+def reset():
+    global _started_at
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _histograms.clear()
+        _started_at = time.time()
+
+def _format_seconds(value):
+    if value is None:
+        return "-"
+    if value < 1:
+        return f"{value * 1000:.0f}ms"
+    return f"{value:.2f}s"
+
+def format_metrics(prefix=None):
+    """Plain-text report of all metrics (optionally only names starting with `prefix`)."""
+    data = snapshot()
+    keep = (lambda name: name.startswith(prefix)) if prefix else (lambda name: True)
+
+    lines = [f"Uptime: {data['uptime_seconds'] / 3600:.1f}h"]
+
+    counters = {name: value for name, value in data["counters"].items() if keep(name)}
+    if counters:
+        lines.append("")
+        lines.append("Counters:")
+        for name in sorted(counters):
+            value = counters[name]
+            lines.append(f"  {name} = {value:g}" if isinstance(value, float) else f"  {name} = {value}")
+
+    gauges = {name: value for name, value in data["gauges"].items() if keep(name)}
+    if gauges:
+        lines.append("")
+        lines.append("Gauges:")
+        for name in sorted(gauges):
+            lines.append(f"  {name} = {gauges[name]}")
+
+    histograms = {name: value for name, value in data["histograms"].items() if keep(name)}
+    if histograms:
+        lines.append("")
+        lines.append("Latencies (n / p50 / p95 / max):")
+        for name in sorted(histograms):
+            h = histograms[name]
+            lines.append(
+                f"  {name}: {h['count']} / {_format_seconds(h['p50'])} / "
+                f"{_format_seconds(h['p95'])} / {_format_seconds(h['max'])}"
+            )
+
+    if len(lines) == 1:
+        lines.append("No metrics recorded yet.")
+    return "\n".join(lines)
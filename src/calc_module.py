@@ -92,13 +92,19 @@ def safe_eval(expression: str):
         logger.exception(f"Error parsing or evaluating expression: {expression}")
         raise
 
+def evaluate_expression(expression: str):
+    """
+    Evaluate a (natural-ish) expression such as '12% of 4500' and return the number.
+    Raises ValueError (or a SyntaxError from the parser) if it can't be evaluated.
+    """
+    # Preprocess the expression to handle 'of' and '%'
+    processed_expression = preprocess_expression(expression)
+    return safe_eval(processed_expression)
+
 async def calculate_expression(expression: str):
     logger.info(f"Calculating expression: {expression}")
     try:
-        # Preprocess the expression to handle 'of' and '%'
-        processed_expression = preprocess_expression(expression)
-        
-        result = safe_eval(processed_expression)
+        result = evaluate_expression(expression)
         
         # Check if the result length is within limits
         result_str = str(result)
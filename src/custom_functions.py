@@ -8,6 +8,20 @@ import logging
 import configparser
 from config_paths import CONFIG_PATH
 
+# the tool registry & the handlers behind each function
+from tool_registry import register_tool, get_function_specs, get_tool_specs
+from tool_calls import (
+    tool_calculate_expression,
+    tool_get_weather,
+    tool_get_duckduckgo_search,
+    tool_get_website_dump,
+    tool_get_stock_price,
+    tool_get_map,
+    tool_get_directions_from_addresses,
+    tool_query_perplexity,
+    tool_manage_reminder,
+)
+
 # from api_get_openrouteservice import get_route, get_directions_from_addresses
 # from elasticsearch_handler import search_es  # Import the Elasticsearch search function
 
@@ -34,7 +48,13 @@ async def observe_chat():
     # Call the Elasticsearch search function and return results
     return search_es(query) """
 
-custom_functions = [
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Each tool is registered with its schema, its handler (see `tool_calls.py`)
+# and its limits: max. concurrent runs, a deadline in seconds and a budget for
+# the result size in characters (unset = `[ToolCalls]` defaults in config.ini).
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+register_tool(
     {
         'name': 'get_weather',
         'description': '[Use if the user asks for weather, time, date, sunrise/sunset, moon phase, weather alerts, air quality etc info on a specific location!] Fetches weather data from OpenWeatherMap API and WeatherAPI for a given city, including current and 3-hour forecasts. Translate if needed. USE THIS TO FETCH LOCAL TIMES AT A LOCATION.',
@@ -52,11 +72,12 @@ custom_functions = [
             },
             'required': ['city_name', 'country']  # Specify that both city_name and country are required
         }
-    }
-    # ... other functions ...
-]
+    },
+    handler=tool_get_weather,
+    max_concurrency=8,
+)
 
-custom_functions.append({
+register_tool({
     'name': 'get_duckduckgo_search',
     'description': '[Use when the user requests for internet search results and if Perplexity API is too murky.] Fetches the first page search results from the first place DuckDuckGo for a given query. This function uses the Lynx browser to scrape the DuckDuckGo HTML results page.',
     'parameters': {
@@ -69,10 +90,10 @@ custom_functions.append({
         },
         'required': ['search_query']  # Mark 'search_query' as a required property
     }
-})
+}, handler=tool_get_duckduckgo_search, max_concurrency=3)
 
 # website fetcher and dumper
-custom_functions.append({
+register_tool({
     'name': 'get_website_dump',
     'description': '[Use to fetch information from a specific website.] Fetches the content of a website using the lynx --dump command and returns the plain text output.',
     'parameters': {
@@ -85,10 +106,10 @@ custom_functions.append({
         },
         'required': ['url']
     }
-})
+}, handler=tool_get_website_dump, max_concurrency=2, max_result_chars=40000)
 
 # calculator module
-custom_functions.append({
+register_tool({
     'name': 'calculate_expression',
     'description': '[Use for mathematical calculations, such as basic arithmetic operations.] Evaluates a mathematical expression provided as a string.',
     'parameters': {
@@ -101,10 +122,10 @@ custom_functions.append({
         },
         'required': ['expression']
     }
-})
+}, handler=tool_calculate_expression, max_concurrency=4, deadline=5)
 
 # direction finder (from address to address)
-custom_functions.append({
+register_tool({
         'name': 'get_directions_from_addresses',
         'description': '[Use when user requests for directions] Provides directions between two addresses using the OpenRouteService API.',
         'parameters': {
@@ -126,11 +147,12 @@ custom_functions.append({
             },
             'required': ['start_address', 'end_address']  # Mark required properties
         }
-    }
+    },
+    handler=tool_get_directions_from_addresses, max_concurrency=4
 )
 
 # Update the custom_functions list with the new Perplexity API function
-custom_functions.append({
+register_tool({
     'name': 'query_perplexity',
     'description': '[Use for dynamic inquiries, current real-time events and/or fact-checking. ALWAYS USE TO FACT CHECK WHENEVER UNSURE, i.e. if user asks for something factual or current!] This queries the Perplexity.ai API using the pplx-70b-online model to answer and fact-check up-to-date information. Always form your question in English and as if you were the user! Pass the question directly as if you were asking a person. Use for checking real-time data.',
     'parameters': {
@@ -142,10 +164,10 @@ custom_functions.append({
             }
         }
     }
-})
+}, handler=tool_query_perplexity, max_concurrency=3, deadline=120)
 
 # stock price check
-custom_functions.append({
+register_tool({
     'name': 'get_stock_price',
     'description': '[Use if the user asks for stock prices or financial data.] Fetches real-time stock price data from Yahoo! Finance API using either a direct stock symbol or a search keyword, use caret (^) as a prefix for indeces (VIX, GSPC, DJI, IXIC, FTSE, DAX...).',
     'parameters': {
@@ -162,7 +184,7 @@ custom_functions.append({
         },
         'required': ['symbol', 'search']  # Specify that at least one of symbol or search is required
     }
-})
+}, handler=tool_get_stock_price, max_concurrency=4)
 
 # ~~~~~~~~~~~~~~~~~~~~~~
 # reminders (if enabled)
@@ -205,8 +227,8 @@ if enable_reminders:
             'required': ['action']
         }
     }
-    custom_functions.append(manage_reminder_function) # Directly append if enabled
-    logger.info("Reminder function 'manage_reminder' appended to custom_functions list.")
+    register_tool(manage_reminder_function, handler=tool_manage_reminder, max_concurrency=4, deadline=15)
+    logger.info("Reminder function 'manage_reminder' registered as a tool.")
 else:
     logger.info("Reminders disabled in config.ini => 'manage_reminder' function not added.")
 
@@ -371,7 +393,7 @@ else:
 # > get map image from maptiler (for maptiler's paid plan only)
 #
 """
-custom_functions.append({
+register_tool({
     'name': 'get_map',
     'description': 'Generates a static map image for a given location, identified either by direct coordinates or an address.',
     'parameters': {
@@ -412,7 +434,7 @@ custom_functions.append({
         },
         'required': []  # Note: Either 'address' or both 'latitude' and 'longitude' should be provided, you'll need to handle this logic in your function implementation.
     }
-}) """
+}, handler=tool_get_map, max_concurrency=4) """
 
 #
 # > others; for reference
@@ -463,6 +485,16 @@ custom_functions.append({
     }
 }) """
 
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# function/tool lists, generated from the registry
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# `custom_functions`: the schemas (legacy `functions` format)
+# `custom_tools`: the same in the `tools` format for the chat completions API
+# (the `functions`/`function_call` parameters are deprecated and only allow
+# one call per turn; `tools` lets the model request several calls at once)
+custom_functions = get_function_specs()
+custom_tools = get_tool_specs()
+
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 # Below's a template on what other stuff you might want to add to your bot
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
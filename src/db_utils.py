@@ -3,7 +3,8 @@
 import sqlite3
 import logging
 import os
-import time
+import atexit
+import threading
 from pathlib import Path
 from datetime import datetime, timedelta, timezone
 
@@ -11,6 +12,10 @@ from datetime import datetime, timedelta, timezone
 DB_PATH = None
 REMINDERS_TABLE_NAME = 'reminders'
 USAGE_TABLE_NAME = 'daily_usage'
+# every counted token usage, appended (never rewritten), and its per-day totals
+USAGE_LEDGER_TABLE_NAME = 'usage_ledger'
+USAGE_ROLLUP_TABLE_NAME = 'usage_daily_totals'
+USER_USAGE_TABLE_NAME = 'usage_by_user_daily'
 try:
     # Import DATA_DIR as the reminders DB should logically be in the data directory
     from config_paths import DATA_DIR
@@ -50,22 +55,90 @@ except Exception as e:
      USAGE_DB_PATH = None
 # --- End DB_PATH Definition ---
 
+# --- Connection manager ---
+# One long-lived connection per database file, shared by every caller (async_db's
+# reader thread, the daily reset thread) and serialized with a lock. Opening a
+# connection per statement cost more than the statements themselves, and
+# in WAL mode readers don't block the writer (nor it them), so lock
+# contention is handled by SQLite's busy timeout instead of sleep-and-retry.
+
+BUSY_TIMEOUT_SECONDS = 10
+# prepared statements kept per connection (sqlite3 caches them by SQL text)
+STATEMENT_CACHE_SIZE = 64
+
+def _connect(db_path, isolation_level=''):
+    """A new connection to `db_path` with WAL and `synchronous=NORMAL` (`isolation_level=None` for manual transactions)."""
+    conn = sqlite3.connect(
+        db_path,
+        timeout=BUSY_TIMEOUT_SECONDS,
+        check_same_thread=False,  # shared between threads; callers serialize access
+        cached_statements=STATEMENT_CACHE_SIZE,
+        isolation_level=isolation_level,
+    )
+    journal_mode = conn.execute("PRAGMA journal_mode=WAL").fetchone()[0]
+    if str(journal_mode).lower() != 'wal':
+        logging.warning(f"SQLite: could not enable WAL mode for {db_path} (journal mode: {journal_mode}).")
+    # with WAL, NORMAL is durable across application crashes (only an OS crash/power loss can drop the last commits)
+    conn.execute("PRAGMA synchronous=NORMAL")
+    logging.info(f"SQLite: opened a connection to {db_path} (journal mode: {journal_mode}).")
+    return conn
+
+class _Database:
+    """A database file's shared connection: opened on first use, with WAL and `synchronous=NORMAL`."""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = threading.RLock()
+        self.conn = None
+
+    def connection(self):
+        # callers hold `self.lock`
+        if self.conn is None:
+            self.conn = _connect(self.db_path)
+        return self.conn
+
+    def close(self):
+        with self.lock:
+            if self.conn is not None:
+                try:
+                    self.conn.close()
+                except sqlite3.Error as e:
+                    logging.error(f"SQLite: error closing the connection to {self.db_path}: {e}")
+                self.conn = None
+
+_databases = {}
+_databases_lock = threading.Lock()
+
+def get_database(db_path):
+    """The shared `_Database` for `db_path`."""
+    key = str(db_path)
+    with _databases_lock:
+        database = _databases.get(key)
+        if database is None:
+            database = _databases[key] = _Database(db_path)
+        return database
+
+def close_all_connections():
+    """Closes every open connection (checkpointing the WAL); they're reopened on next use."""
+    with _databases_lock:
+        databases = list(_databases.values())
+    for database in databases:
+        database.close()
+
+atexit.register(close_all_connections)
+
 def _execute_sql(db_path, sql, params=(), fetch_one=False, fetch_all=False, commit=False, get_last_rowid=False):
-    """Helper function to execute SQL commands with retry logic for locks."""
+    """Helper function to execute an SQL command on the database's shared connection."""
     if not db_path:
         logging.error("Database path is not set. Cannot execute SQL.")
         return None if fetch_one or fetch_all or get_last_rowid else False
 
-    conn = None
-    retries = 5
-    delay = 0.2
-    last_exception = None
-
-    for attempt in range(retries):
+    database = get_database(db_path)
+    with database.lock:
+        conn = None
         try:
-            conn = sqlite3.connect(db_path, timeout=10)
-            cursor = conn.cursor()
-            cursor.execute(sql, params)
+            conn = database.connection()
+            cursor = conn.execute(sql, params)
 
             result = None
             if commit:
@@ -82,33 +155,41 @@ def _execute_sql(db_path, sql, params=(), fetch_one=False, fetch_all=False, comm
 
             return result # Success
 
-        except sqlite3.OperationalError as e:
-            last_exception = e
-            if "locked" in str(e).lower() and attempt < retries - 1:
-                 logging.warning(f"SQLite DB locked (Attempt {attempt+1}/{retries}). Retrying in {delay:.2f}s... SQL: {sql[:100]}")
-                 if conn: conn.rollback() # Rollback before retrying
-                 time.sleep(delay)
-                 delay = min(delay * 1.5, 2.0)
-            else:
-                 logging.error(f"SQLite DB locked or error executing SQL after {retries} attempts: {e}\nSQL: {sql}")
-                 if conn: conn.rollback()
-                 break # Failed after retries or non-lock error
+        except sqlite3.Error as e:
+            # "database is locked" here means another process held the lock for longer than the busy timeout
+            logging.error(f"SQLite error executing SQL on {db_path}: {e}\nSQL: {sql}")
+            if conn: conn.rollback()
         except Exception as e:
-            last_exception = e
             logging.error(f"Unexpected error executing SQL: {e}\nSQL: {sql}")
             if conn: conn.rollback()
-            break # Failed due to unexpected error
-        finally:
-            if conn:
-                conn.close()
 
-    # If loop finishes without returning, it means failure
-    logging.error(f"Failed to execute SQL command after {retries} attempts. Last error: {last_exception}")
     return None if fetch_one or fetch_all or get_last_rowid else False
 
+def _write(db_path, operation, *args, failure=False):
+    """
+    Runs a write operation (one of the `_op_*` functions below) in its own transaction
+    on the database's shared connection. Returns its result, or `failure` on error.
+    (async_db.py runs the same operations batched, on its writer thread.)
+    """
+    if not db_path:
+        logging.error("Database path is not set. Cannot write.")
+        return failure
+
+    database = get_database(db_path)
+    with database.lock:
+        try:
+            conn = database.connection()
+            with conn: # one transaction: commits, or rolls back on error
+                return operation(conn, *args)
+        except sqlite3.Error as e:
+            logging.error(f"SQLite error in {operation.__name__} on {db_path}: {e}")
+        except Exception as e:
+            logging.error(f"Unexpected error in {operation.__name__} on {db_path}: {e}")
+    return failure
+
 
 def _create_tables_if_not_exist(db_path):
-    """Creates both the reminders and daily_usage tables if they don't exist."""
+    """Creates the reminders, daily_usage, usage ledger and per-user usage tables if they don't exist."""
     if not db_path: return False
 
     # SQL for reminders table
@@ -131,10 +212,43 @@ def _create_tables_if_not_exist(db_path):
             mini_tokens INTEGER DEFAULT 0
         );
     """
+    # SQL for the usage ledger and its daily rollup (maintained with each appended entry)
+    sql_usage_ledger = f"""
+        CREATE TABLE IF NOT EXISTS {USAGE_LEDGER_TABLE_NAME} (
+            entry_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            recorded_at TEXT NOT NULL,
+            usage_date TEXT NOT NULL,
+            source TEXT NOT NULL,
+            tokens INTEGER NOT NULL
+        );
+    """
+    sql_usage_rollup = f"""
+        CREATE TABLE IF NOT EXISTS {USAGE_ROLLUP_TABLE_NAME} (
+            usage_date TEXT PRIMARY KEY,
+            tokens INTEGER NOT NULL DEFAULT 0,
+            entries INTEGER NOT NULL DEFAULT 0
+        );
+    """
+    # SQL for the per-user/chat/model daily usage (user_usage.py); the primary key leads with the date,
+    # so a date range is an index range scan
+    sql_user_usage = f"""
+        CREATE TABLE IF NOT EXISTS {USER_USAGE_TABLE_NAME} (
+            usage_date TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            chat_id INTEGER NOT NULL,
+            model TEXT NOT NULL,
+            prompt_tokens INTEGER NOT NULL DEFAULT 0,
+            completion_tokens INTEGER NOT NULL DEFAULT 0,
+            total_tokens INTEGER NOT NULL DEFAULT 0,
+            requests INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (usage_date, user_id, chat_id, model)
+        );
+    """
     # SQL for indexes
     sql_reminders_index = f"CREATE INDEX IF NOT EXISTS idx_reminders_user_status ON {REMINDERS_TABLE_NAME} (user_id, status);"
     sql_reminders_due_index = f"CREATE INDEX IF NOT EXISTS idx_reminders_due_status ON {REMINDERS_TABLE_NAME} (due_time_utc, status);"
     sql_usage_index = f"CREATE INDEX IF NOT EXISTS idx_usage_date ON {USAGE_TABLE_NAME} (usage_date);"
+    sql_usage_ledger_index = f"CREATE INDEX IF NOT EXISTS idx_usage_ledger_date ON {USAGE_LEDGER_TABLE_NAME} (usage_date);"
 
     success = True
     success &= _execute_sql(db_path, sql_reminders, commit=True)
@@ -142,13 +256,18 @@ def _create_tables_if_not_exist(db_path):
     success &= _execute_sql(db_path, sql_reminders_index, commit=True)
     success &= _execute_sql(db_path, sql_reminders_due_index, commit=True)
     success &= _execute_sql(db_path, sql_usage_index, commit=True)
+    success &= _execute_sql(db_path, sql_usage_ledger, commit=True)
+    success &= _execute_sql(db_path, sql_usage_rollup, commit=True)
+    success &= _execute_sql(db_path, sql_usage_ledger_index, commit=True)
+    success &= _execute_sql(db_path, sql_user_usage, commit=True)
 
     if success:
-        logging.info(f"Ensured SQLite tables '{REMINDERS_TABLE_NAME}' and '{USAGE_TABLE_NAME}' exist in {db_path}")
+        logging.info(f"Ensured SQLite tables '{REMINDERS_TABLE_NAME}', '{USAGE_TABLE_NAME}', '{USAGE_LEDGER_TABLE_NAME}', '{USAGE_ROLLUP_TABLE_NAME}' and '{USER_USAGE_TABLE_NAME}' exist in {db_path}")
     else:
         logging.error(f"Failed to create or verify SQLite tables in {db_path}")
     return success
 
+# The schema is created once, at startup (the usage functions below no longer check it per call)
 DB_INITIALIZED_SUCCESSFULLY = False
 if REMINDERS_DB_PATH: # Check specifically the reminders DB path for initialization status
     DB_INITIALIZED_SUCCESSFULLY = _create_tables_if_not_exist(REMINDERS_DB_PATH)
@@ -159,6 +278,90 @@ else:
     logging.error("Reminders database path could not be determined. SQLite functions related to reminders will be disabled.")
 
 
+# --- Write Operations ---
+# Each takes an open connection and runs inside the caller's transaction: `_write()`
+# gives it one of its own, async_db's writer thread batches several into one.
+
+def _op_add_reminder(conn, user_id, chat_id, reminder_text, due_time_utc_str):
+    sql = f"""
+        INSERT INTO {REMINDERS_TABLE_NAME} (user_id, chat_id, reminder_text, due_time_utc)
+        VALUES (?, ?, ?, ?)
+    """
+    return conn.execute(sql, (user_id, chat_id, reminder_text, due_time_utc_str)).lastrowid
+
+def _op_add_reminder_within_limit(conn, user_id, chat_id, reminder_text, due_time_utc_str, max_pending):
+    # the count and the insert in the same transaction, so concurrent adds can't both slip under the limit;
+    # returns (the new reminder's ID, or None if the user is at the limit, and their pending count before it)
+    pending = conn.execute(
+        f"SELECT COUNT(*) FROM {REMINDERS_TABLE_NAME} WHERE user_id = ? AND status = 'pending'", (user_id,)
+    ).fetchone()[0]
+    if max_pending > 0 and pending >= max_pending:
+        return None, pending
+    return _op_add_reminder(conn, user_id, chat_id, reminder_text, due_time_utc_str), pending
+
+def _op_delete_reminder(conn, reminder_id, user_id):
+    # First verify ownership - this prevents accidental deletion if API passes wrong ID
+    owner_result = conn.execute(f"SELECT user_id FROM {REMINDERS_TABLE_NAME} WHERE reminder_id = ?", (reminder_id,)).fetchone()
+    if not owner_result or owner_result[0] != user_id:
+        logging.warning(f"Attempt to delete reminder {reminder_id} failed: Not found or ownership mismatch for user {user_id}.")
+        return False
+    # If ownership confirmed, proceed with deletion
+    conn.execute(f"DELETE FROM {REMINDERS_TABLE_NAME} WHERE reminder_id = ? AND user_id = ?", (reminder_id, user_id))
+    return True
+
+def _op_update_reminder(conn, reminder_id, new_due_time_utc, new_text):
+    # Also reset status to 'pending' in case it was failed etc.
+    conn.execute(f"UPDATE {REMINDERS_TABLE_NAME} SET due_time_utc = ?, reminder_text = ?, status = 'pending' WHERE reminder_id = ?", (new_due_time_utc, new_text, reminder_id))
+    return True
+
+def _op_update_reminder_status(conn, reminder_id, new_status):
+    conn.execute(f"UPDATE {REMINDERS_TABLE_NAME} SET status = ? WHERE reminder_id = ?", (new_status, reminder_id))
+    return True
+
+def _op_add_daily_usage(conn, usage_date_str, model_tier, tokens_used):
+    if model_tier == 'premium':
+        column_to_update = 'premium_tokens'
+    elif model_tier == 'mini':
+        column_to_update = 'mini_tokens'
+    else:
+        logging.warning(f"Unknown model tier '{model_tier}' provided for usage update. Cannot log.")
+        return False
+    # Use INSERT OR IGNORE to handle the case where the date doesn't exist yet
+    conn.execute(f"INSERT OR IGNORE INTO {USAGE_TABLE_NAME} (usage_date, premium_tokens, mini_tokens) VALUES (?, 0, 0)", (usage_date_str,))
+    # Use atomic update
+    conn.execute(f"UPDATE {USAGE_TABLE_NAME} SET {column_to_update} = {column_to_update} + ? WHERE usage_date = ?", (tokens_used, usage_date_str))
+    return True
+
+def _op_append_usage(conn, recorded_at, usage_date_str, source, tokens):
+    """Appends a usage ledger entry and adds it to the day's rollup."""
+    conn.execute(
+        f"INSERT INTO {USAGE_LEDGER_TABLE_NAME} (recorded_at, usage_date, source, tokens) VALUES (?, ?, ?, ?)",
+        (recorded_at, usage_date_str, source, tokens)
+    )
+    conn.execute(f"INSERT OR IGNORE INTO {USAGE_ROLLUP_TABLE_NAME} (usage_date, tokens, entries) VALUES (?, 0, 0)", (usage_date_str,))
+    conn.execute(f"UPDATE {USAGE_ROLLUP_TABLE_NAME} SET tokens = tokens + ?, entries = entries + 1 WHERE usage_date = ?", (tokens, usage_date_str))
+    return True
+
+def _op_prune_usage_ledger(conn, cutoff_date_str):
+    """Deletes ledger entries older than the cutoff date; the daily rollups are kept."""
+    return conn.execute(f"DELETE FROM {USAGE_LEDGER_TABLE_NAME} WHERE usage_date < ?", (cutoff_date_str,)).rowcount
+
+def _op_add_user_usage(conn, usage_date_str, user_id, chat_id, model, prompt_tokens, completion_tokens, total_tokens, requests):
+    """Adds to a user's usage of a model in a chat on a date."""
+    conn.execute(
+        f"INSERT OR IGNORE INTO {USER_USAGE_TABLE_NAME} (usage_date, user_id, chat_id, model) VALUES (?, ?, ?, ?)",
+        (usage_date_str, user_id, chat_id, model)
+    )
+    conn.execute(
+        f"""UPDATE {USER_USAGE_TABLE_NAME}
+            SET prompt_tokens = prompt_tokens + ?, completion_tokens = completion_tokens + ?,
+                total_tokens = total_tokens + ?, requests = requests + ?
+            WHERE usage_date = ? AND user_id = ? AND chat_id = ? AND model = ?""",
+        (prompt_tokens, completion_tokens, total_tokens, requests, usage_date_str, user_id, chat_id, model)
+    )
+    return True
+
+
 # --- Reminder Functions ---
 
 def count_pending_reminders_for_user(db_path, user_id):
@@ -177,12 +380,8 @@ def add_reminder_to_db(db_path, user_id, chat_id, reminder_text, due_time_utc_st
     if not DB_INITIALIZED_SUCCESSFULLY:
         logging.error("DB not initialized. Cannot add reminder.")
         return None
-    sql = f"""
-        INSERT INTO {REMINDERS_TABLE_NAME} (user_id, chat_id, reminder_text, due_time_utc)
-        VALUES (?, ?, ?, ?)
-    """
-    last_row_id = _execute_sql(db_path, sql, (user_id, chat_id, reminder_text, due_time_utc_str), commit=True, get_last_rowid=True)
-    return last_row_id # Returns the ID of the inserted row or False/None on failure
+    # Returns the ID of the inserted row or None on failure
+    return _write(db_path, _op_add_reminder, user_id, chat_id, reminder_text, due_time_utc_str, failure=None)
 
 def get_pending_reminders_for_user(db_path, user_id):
     """Gets all pending reminders for a user."""
@@ -198,17 +397,8 @@ def delete_reminder_from_db(db_path, reminder_id, user_id):
     if not DB_INITIALIZED_SUCCESSFULLY:
         logging.error("DB not initialized. Cannot delete reminder.")
         return False
-    # First verify ownership - this prevents accidental deletion if API passes wrong ID
-    owner_check_sql = f"SELECT user_id FROM {REMINDERS_TABLE_NAME} WHERE reminder_id = ?"
-    owner_result = _execute_sql(db_path, owner_check_sql, (reminder_id,), fetch_one=True)
-
-    if not owner_result or owner_result[0] != user_id:
-        logging.warning(f"Attempt to delete reminder {reminder_id} failed: Not found or ownership mismatch for user {user_id}.")
-        return False
-
-    # If ownership confirmed, proceed with deletion
-    sql = f"DELETE FROM {REMINDERS_TABLE_NAME} WHERE reminder_id = ? AND user_id = ?"
-    return _execute_sql(db_path, sql, (reminder_id, user_id), commit=True)
+    # ownership check and deletion in one transaction
+    return _write(db_path, _op_delete_reminder, reminder_id, user_id)
 
 def get_reminder_by_id(db_path, reminder_id):
     """Gets a specific reminder by its ID."""
@@ -224,9 +414,7 @@ def update_reminder(db_path, reminder_id, new_due_time_utc, new_text):
     if not DB_INITIALIZED_SUCCESSFULLY:
         logging.error("DB not initialized. Cannot update reminder.")
         return False
-    sql = f"UPDATE {REMINDERS_TABLE_NAME} SET due_time_utc = ?, reminder_text = ?, status = 'pending' WHERE reminder_id = ?"
-    # Also reset status to 'pending' in case it was failed etc.
-    return _execute_sql(db_path, sql, (new_due_time_utc, new_text, reminder_id), commit=True)
+    return _write(db_path, _op_update_reminder, reminder_id, new_due_time_utc, new_text)
 
 def get_due_reminders(db_path, current_utc_time_str):
     """Gets all pending reminders that are due."""
@@ -274,8 +462,7 @@ def update_reminder_status(db_path, reminder_id, new_status):
     if not DB_INITIALIZED_SUCCESSFULLY:
         logging.error("DB not initialized. Cannot update reminder status.")
         return False
-    sql = f"UPDATE {REMINDERS_TABLE_NAME} SET status = ? WHERE reminder_id = ?"
-    return _execute_sql(db_path, sql, (new_status, reminder_id), commit=True)
+    return _write(db_path, _op_update_reminder_status, reminder_id, new_status)
 
 # --- Usage Functions (Using USAGE_DB_PATH) ---
 
@@ -288,9 +475,6 @@ def _get_daily_usage_sync(db_path, usage_date_str):
         logging.warning("Usage SQLite DB path not set. Cannot get usage.")
         return None
 
-    # Ensure the usage table exists in the correct DB file
-    _create_tables_if_not_exist(USAGE_DB_PATH) # Redundant if called at start, but safe
-
     sql = f"SELECT premium_tokens, mini_tokens FROM {USAGE_TABLE_NAME} WHERE usage_date = ?"
     row = _execute_sql(USAGE_DB_PATH, sql, (usage_date_str,), fetch_one=True)
 
@@ -303,64 +487,59 @@ def _get_daily_usage_sync(db_path, usage_date_str):
 
 def _update_daily_usage_sync(db_path, usage_date_str, model_tier, tokens_used):
     """
-    Adds tokens used to the appropriate counter for the given date in the USAGE database.
-    Handles concurrent access with retries. Does nothing if USAGE_DB_PATH isn't set.
+    Adds tokens used to the appropriate counter for the given date in the USAGE database,
+    in a single transaction. Does nothing if USAGE_DB_PATH isn't set.
     """
     if not USAGE_DB_PATH:
         logging.warning("Usage SQLite DB path not set. Cannot update usage.")
         return
     if tokens_used <= 0: return
 
-    # Ensure the usage table exists
-    _create_tables_if_not_exist(USAGE_DB_PATH)
+    if _write(USAGE_DB_PATH, _op_add_daily_usage, usage_date_str, model_tier, tokens_used):
+        logging.debug(f"Successfully updated usage for {usage_date_str}, tier {model_tier}, tokens {tokens_used}.")
 
-    conn = None
-    retries = 5
-    delay = 0.2
-    last_exception = None
+def get_usage_total(db_path, usage_date_str):
+    """The usage ledger's total tokens for a date (0 if none), or None on error."""
+    sql = f"SELECT tokens FROM {USAGE_ROLLUP_TABLE_NAME} WHERE usage_date = ?"
+    rows = _execute_sql(db_path, sql, (usage_date_str,), fetch_all=True)
+    if rows is None:
+        return None
+    return rows[0][0] if rows else 0
+
+def get_usage_totals(db_path, since_date_str):
+    """`{date: tokens}` from the usage ledger's daily rollups, from `since_date_str` on (oldest first)."""
+    sql = f"SELECT usage_date, tokens FROM {USAGE_ROLLUP_TABLE_NAME} WHERE usage_date >= ? ORDER BY usage_date ASC"
+    rows = _execute_sql(db_path, sql, (since_date_str,), fetch_all=True)
+    return {row[0]: row[1] for row in rows} if rows else {}
+
+def get_user_usage_totals(db_path, usage_date_str):
+    """`{user_id: total_tokens}` for a date, or None on error."""
+    sql = f"SELECT user_id, SUM(total_tokens) FROM {USER_USAGE_TABLE_NAME} WHERE usage_date = ? GROUP BY user_id"
+    rows = _execute_sql(db_path, sql, (usage_date_str,), fetch_all=True)
+    if rows is None:
+        return None
+    return {row[0]: row[1] for row in rows}
 
-    for attempt in range(retries):
-        try:
-            conn = sqlite3.connect(USAGE_DB_PATH, timeout=10) # Connect to USAGE DB
-            cursor = conn.cursor()
-            # Use INSERT OR IGNORE to handle the case where the date doesn't exist yet
-            cursor.execute(f"INSERT OR IGNORE INTO {USAGE_TABLE_NAME} (usage_date, premium_tokens, mini_tokens) VALUES (?, 0, 0)", (usage_date_str,))
-
-            if model_tier == 'premium':
-                column_to_update = 'premium_tokens'
-            elif model_tier == 'mini':
-                column_to_update = 'mini_tokens'
-            else:
-                 logging.warning(f"Unknown model tier '{model_tier}' provided for usage update. Cannot log.")
-                 return
-
-            # Use atomic update
-            sql = f"UPDATE {USAGE_TABLE_NAME} SET {column_to_update} = {column_to_update} + ? WHERE usage_date = ?"
-            cursor.execute(sql, (tokens_used, usage_date_str))
-            conn.commit()
-            logging.debug(f"Successfully updated usage for {usage_date_str}, tier {model_tier}, tokens {tokens_used}.")
-            return # Success
-
-        except sqlite3.OperationalError as e:
-            last_exception = e
-            if "locked" in str(e).lower() and attempt < retries - 1:
-                 logging.warning(f"Usage SQLite DB locked (Attempt {attempt+1}/{retries}). Retrying in {delay:.2f}s...")
-                 if conn: conn.rollback()
-                 time.sleep(delay)
-                 delay = min(delay * 1.5, 2.0)
-            else:
-                 logging.error(f"Usage SQLite DB locked or error during write for {usage_date_str} after {retries} attempts: {e}")
-                 if conn: conn.rollback()
-                 break
-        except Exception as e:
-            last_exception = e
-            logging.error(f"Unexpected error updating daily usage in SQLite ({USAGE_DB_PATH}) for {usage_date_str}: {e}")
-            if conn: conn.rollback()
-            break
-        finally:
-            if conn:
-                conn.close()
-    logging.error(f"Failed to update usage for {usage_date_str}, tier {model_tier}, tokens {tokens_used} after {retries} attempts. Last error: {last_exception}")
+# what `get_top_consumers` can group by
+USER_USAGE_GROUPINGS = {'users': 'user_id', 'chats': 'chat_id', 'models': 'model'}
+
+def get_top_consumers(db_path, start_date_str, end_date_str, group_by='users', limit=10):
+    """
+    The top consumers from `start_date_str` to `end_date_str` (inclusive), most tokens first:
+    `[(user_id / chat_id / model, total_tokens, prompt_tokens, completion_tokens, requests)]`.
+    Only that date range of the primary key is read.
+    """
+    column = USER_USAGE_GROUPINGS[group_by]
+    sql = f"""
+        SELECT {column}, SUM(total_tokens) AS total, SUM(prompt_tokens), SUM(completion_tokens), SUM(requests)
+        FROM {USER_USAGE_TABLE_NAME}
+        WHERE usage_date BETWEEN ? AND ?
+        GROUP BY {column}
+        ORDER BY total DESC
+        LIMIT ?
+    """
+    rows = _execute_sql(db_path, sql, (start_date_str, end_date_str, limit), fetch_all=True)
+    return rows or []
 
 def _cleanup_old_usage_sync(db_path, max_history_days):
     """Deletes usage records older than max_history_days from the USAGE database."""
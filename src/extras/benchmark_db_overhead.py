@@ -0,0 +1,127 @@
+# benchmark_db_overhead.py
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# github.com/FlyingFathead/TelegramBot-OpenAI-API/
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#
+# Per-message SQLite overhead: every message reads today's usage (the
+# model auto-switch) and adds its tokens afterwards; the reminder poller
+# also checks for due reminders. Compares the old way -- a new connection
+# per statement, and the schema DDL re-run on every usage read and write --
+# against `db_utils`' shared per-file connections (WAL, synchronous=NORMAL,
+# cached prepared statements, schema created once).
+#
+#   python src/extras/benchmark_db_overhead.py --messages 2000
+#
+# Runs against temporary database files, not the bot's own.
+
+import sys
+import time
+import sqlite3
+import argparse
+import tempfile
+from pathlib import Path
+
+# make `src/` importable
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import db_utils
+from db_utils import REMINDERS_TABLE_NAME, USAGE_TABLE_NAME
+
+USAGE_DATE = "2026-10-16"
+NOW_UTC = "2026-10-16T12:00:00Z"
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# the previous implementation: connect, execute, close -- each time
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def old_execute(db_path, sql, params=(), fetch=False):
+    conn = sqlite3.connect(db_path, timeout=10)
+    try:
+        cursor = conn.execute(sql, params)
+        if fetch:
+            return cursor.fetchall()
+        conn.commit()
+    finally:
+        conn.close()
+
+def old_create_tables(db_path):
+    old_execute(db_path, f"CREATE TABLE IF NOT EXISTS {REMINDERS_TABLE_NAME} (reminder_id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, chat_id INTEGER NOT NULL, reminder_text TEXT NOT NULL, due_time_utc TEXT NOT NULL, status TEXT DEFAULT 'pending', created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)")
+    old_execute(db_path, f"CREATE TABLE IF NOT EXISTS {USAGE_TABLE_NAME} (usage_date TEXT PRIMARY KEY, premium_tokens INTEGER DEFAULT 0, mini_tokens INTEGER DEFAULT 0)")
+    old_execute(db_path, f"CREATE INDEX IF NOT EXISTS idx_reminders_user_status ON {REMINDERS_TABLE_NAME} (user_id, status)")
+    old_execute(db_path, f"CREATE INDEX IF NOT EXISTS idx_reminders_due_status ON {REMINDERS_TABLE_NAME} (due_time_utc, status)")
+    old_execute(db_path, f"CREATE INDEX IF NOT EXISTS idx_usage_date ON {USAGE_TABLE_NAME} (usage_date)")
+
+def old_get_usage(db_path):
+    old_create_tables(db_path)
+    return old_execute(db_path, f"SELECT premium_tokens, mini_tokens FROM {USAGE_TABLE_NAME} WHERE usage_date = ?", (USAGE_DATE,), fetch=True)
+
+def old_update_usage(db_path, tokens):
+    old_create_tables(db_path)
+    conn = sqlite3.connect(db_path, timeout=10)
+    try:
+        conn.execute(f"INSERT OR IGNORE INTO {USAGE_TABLE_NAME} (usage_date, premium_tokens, mini_tokens) VALUES (?, 0, 0)", (USAGE_DATE,))
+        conn.execute(f"UPDATE {USAGE_TABLE_NAME} SET mini_tokens = mini_tokens + ? WHERE usage_date = ?", (tokens, USAGE_DATE))
+        conn.commit()
+    finally:
+        conn.close()
+
+def old_message(db_path):
+    old_get_usage(db_path)
+    old_update_usage(db_path, 1234)
+
+def old_poll(db_path):
+    old_execute(db_path, f"SELECT reminder_id, user_id, chat_id, reminder_text FROM {REMINDERS_TABLE_NAME} WHERE status = 'pending' AND due_time_utc <= ? ORDER BY due_time_utc ASC", (NOW_UTC,), fetch=True)
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~
+# db_utils, as of now
+# ~~~~~~~~~~~~~~~~~~~~~~~~
+
+def new_message(db_path):
+    db_utils._get_daily_usage_sync(db_path, USAGE_DATE)
+    db_utils._update_daily_usage_sync(db_path, USAGE_DATE, 'mini', 1234)
+
+def new_poll(db_path):
+    db_utils.get_due_reminders(db_path, NOW_UTC)
+
+
+def measure(label, operation, db_path, count):
+    started = time.perf_counter()
+    for _ in range(count):
+        operation(db_path)
+    elapsed = time.perf_counter() - started
+    print(f"{label:<52} {elapsed / count * 1000:8.3f}ms")
+    return elapsed / count
+
+def main(messages):
+    with tempfile.TemporaryDirectory() as directory:
+        old_db = Path(directory) / "old.db"
+        new_db = Path(directory) / "new.db"
+        old_create_tables(old_db)
+        # db_utils keeps the usage table in USAGE_DB_PATH regardless of the path it's given
+        db_utils.USAGE_DB_PATH = new_db
+        db_utils._create_tables_if_not_exist(new_db)
+
+        print(f"{messages} messages, SQLite {sqlite3.sqlite_version}\n")
+        print("per message (read today's usage + add the reply's tokens):")
+        old = measure("  old: connection per statement, DDL on every call", old_message, old_db, messages)
+        new = measure("  new: shared WAL connection, schema created once", new_message, new_db, messages)
+        print(f"  => {old / new:.1f}x less overhead\n")
+
+        print("per reminder poll (due reminders):")
+        old = measure("  old: connection per statement", old_poll, old_db, messages)
+        new = measure("  new: shared WAL connection", new_poll, new_db, messages)
+        print(f"  => {old / new:.1f}x less overhead\n")
+
+        old_total = old_execute(old_db, f"SELECT mini_tokens FROM {USAGE_TABLE_NAME} WHERE usage_date = ?", (USAGE_DATE,), fetch=True)[0][0]
+        new_total = db_utils._get_daily_usage_sync(new_db, USAGE_DATE)[1]
+        assert old_total == new_total == messages * 1234, (old_total, new_total)
+        print("both recorded the same token totals")
+        db_utils.close_all_connections()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark per-message SQLite overhead")
+    parser.add_argument('--messages', type=int, default=2000)
+    args = parser.parse_args()
+    main(args.messages)
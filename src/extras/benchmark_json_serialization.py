@@ -0,0 +1,88 @@
+# benchmark_json_serialization.py
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# github.com/FlyingFathead/TelegramBot-OpenAI-API/
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#
+# Per-turn cost of encoding the completion request body in a long chat:
+# the old `json.dumps()` of the whole payload versus `json_serializer`
+# (orjson if installed, cached per-message encodings and the per-chat
+# encoded history prefix). Each turn appends a user message, swaps the
+# volatile timestamp message and encodes a request with the bot's real
+# tool schemas, plus the tool follow-up every few turns.
+#
+#   python src/extras/benchmark_json_serialization.py --messages 200 --turns 200
+#
+# Also checks that both produce the same JSON document.
+
+import sys
+import json
+import time
+import random
+import argparse
+from pathlib import Path
+
+# make `src/` importable
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import json_serializer
+from json_serializer import encode_payload, public_fields
+from custom_functions import custom_tools
+
+WORDS = (
+    "the weather in helsinki is cloudy with a chance of rain later today "
+    "stock prices moved slightly higher after the report was published "
+    "remind me to call the dentist tomorrow morning at nine o'clock please "
+    "sää on pilvinen ja illalla saattaa sataa lunta ehkä huomenna"
+).split()
+
+SYSTEM_MESSAGE = {"role": "system", "content": "Instructions: You are a helpful Telegram bot. " * 40}
+
+def sentence(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+def old_encode(payload):
+    # the previous implementation: strip `_` keys from the messages, then json.dumps() everything
+    payload = dict(payload, messages=[public_fields(message) for message in payload["messages"]])
+    return json.dumps({key: value for key, value in payload.items() if not key.startswith('_')}).encode("utf-8")
+
+def run(label, encode, messages, turns, seed):
+    rng = random.Random(seed)
+    history = [{"role": "user" if i % 2 == 0 else "assistant", "content": sentence(rng, rng.randint(20, 120))} for i in range(messages)]
+    elapsed = 0.0
+    size = 0
+    for turn in range(turns):
+        history.append({"role": "user", "content": sentence(rng, 30)})
+        timestamp = {"role": "system", "content": f"Friday, October 16th, 2026 | Time (UTC): 12:{turn % 60:02d}:00"}
+        payload = {
+            "model": "gpt-4o-mini",
+            "messages": [SYSTEM_MESSAGE] + history + [timestamp],
+            "temperature": 0.9,
+            "tools": custom_tools,
+            "tool_choice": "auto",
+            "_chat_id": 1,
+        }
+        started = time.perf_counter()
+        body = encode(payload)
+        if turn % 5 == 0:
+            # a tool turn: the follow-up request repeats everything and adds the tool messages
+            follow_up = dict(payload, messages=payload["messages"] + [{"role": "tool", "tool_call_id": "call_1", "content": sentence(rng, 200)}])
+            encode(follow_up)
+        elapsed += time.perf_counter() - started
+        size = len(body)
+        history.append({"role": "assistant", "content": sentence(rng, 80)})
+    print(f"{label:<40} {elapsed / turns * 1000:8.3f}ms/turn   (last request body {size / 1024:.0f} KiB)")
+    return body
+
+def main(messages, turns):
+    print(f"{messages}-message chat, {turns} turns, {len(custom_tools)} tool schemas; orjson available: {json_serializer.ORJSON_AVAILABLE}\n")
+    old_body = run("old: json.dumps() of the whole payload", old_encode, messages, turns, seed=1)
+    new_body = run("new: json_serializer.encode_payload()", encode_payload, messages, turns, seed=1)
+    assert json.loads(old_body) == json.loads(new_body), "the request bodies differ"
+    print("\nboth produce the same JSON document")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark request body serialization")
+    parser.add_argument('--messages', type=int, default=200)
+    parser.add_argument('--turns', type=int, default=200)
+    args = parser.parse_args()
+    main(args.messages, args.turns)
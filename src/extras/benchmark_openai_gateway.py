@@ -0,0 +1,90 @@
+# benchmark_openai_gateway.py
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# github.com/FlyingFathead/TelegramBot-OpenAI-API/
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#
+# Compares the old "new `httpx.AsyncClient` per call" pattern against the
+# shared, pooled `OpenAIGateway`, using the local fake OpenAI server.
+#
+#   python src/extras/benchmark_openai_gateway.py --requests 200 --concurrency 10
+#
+# The fake server counts TCP connections: the per-call client opens one per
+# request, while the gateway reuses a handful of keep-alive connections.
+
+import sys
+import time
+import json
+import asyncio
+import argparse
+from pathlib import Path
+
+# make `src/` importable
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import httpx
+from fake_openai_server import start_fake_openai_server
+from openai_gateway import OpenAIGateway
+
+PAYLOAD = {
+    "model": "gpt-4o-mini",
+    "messages": [{"role": "user", "content": "ping"}],
+    "temperature": 0.7,
+}
+
+async def call_with_new_client(base_url):
+    # the pre-gateway pattern
+    async with httpx.AsyncClient() as client:
+        response = await client.post(
+            f"{base_url}/chat/completions",
+            data=json.dumps(PAYLOAD),
+            headers={"Content-Type": "application/json", "Authorization": "Bearer fake"},
+            timeout=30,
+        )
+        return response.json()
+
+async def run_batch(call, total, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one():
+        async with semaphore:
+            start = time.perf_counter()
+            await call()
+            latencies.append(time.perf_counter() - start)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(total)))
+    return time.perf_counter() - started, sorted(latencies)
+
+def report(label, server, connections_before, elapsed, latencies):
+    connections = server.connections_opened - connections_before
+    p50 = latencies[len(latencies) // 2] * 1000
+    p95 = latencies[int(len(latencies) * 0.95) - 1] * 1000
+    print(f"{label:<28} total={elapsed:6.2f}s  p50={p50:7.2f}ms  p95={p95:7.2f}ms  tcp_connections={connections}")
+
+async def main(total, concurrency, delay):
+    server = start_fake_openai_server(delay=delay)
+    base_url = f"http://127.0.0.1:{server.server_port}/v1"
+    print(f"Fake OpenAI server at {base_url}; {total} requests, concurrency {concurrency}\n")
+
+    try:
+        before = server.connections_opened
+        elapsed, latencies = await run_batch(lambda: call_with_new_client(base_url), total, concurrency)
+        report("new AsyncClient per call", server, before, elapsed, latencies)
+
+        gateway = OpenAIGateway(api_key="fake", base_url=base_url, http2=False)
+        before = server.connections_opened
+        elapsed, latencies = await run_batch(lambda: gateway.chat_completion(PAYLOAD), total, concurrency)
+        report("shared OpenAIGateway", server, before, elapsed, latencies)
+        await gateway.aclose()
+    finally:
+        server.shutdown()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark connection reuse of the OpenAI gateway")
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--delay', type=float, default=0.0, help="Fake server response delay in seconds")
+    args = parser.parse_args()
+    asyncio.run(main(args.requests, args.concurrency, args.delay))
@@ -0,0 +1,112 @@
+# benchmark_trim_chat_history.py
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# github.com/FlyingFathead/TelegramBot-OpenAI-API/
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#
+# Compares the old `trim_chat_history` (re-tokenize the whole history after
+# every `pop(0)`) against the cached per-message token counts and running
+# history total in `modules.trim_history_by_tokens`, on a 200-message history.
+#
+#   python src/extras/benchmark_trim_chat_history.py --messages 200 --max-tokens 10000
+#
+# Counts with the bot's own `token_counter`; the number of tokenizer calls
+# is reported as well.
+
+import sys
+import time
+import random
+import argparse
+from pathlib import Path
+
+# make `src/` importable
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import token_counter
+from modules import trim_history_by_tokens
+
+WORDS = (
+    "the weather in helsinki is cloudy with a chance of rain later today "
+    "stock prices moved slightly higher after the report was published "
+    "remind me to call the dentist tomorrow morning at nine o'clock please"
+).split()
+
+def make_tokenizer():
+    # the bot's own token counter (tiktoken, or an estimate if the encoding isn't available)
+    encoding = token_counter.get_encoding()
+    name = f"tiktoken {encoding.name}" if encoding is not None else "~4 chars/token estimate"
+    return name, token_counter.count_tokens
+
+def make_history(count, rng):
+    history = []
+    for i in range(count):
+        role = "user" if i % 2 == 0 else "assistant"
+        history.append({"role": role, "content": " ".join(rng.choice(WORDS) for _ in range(rng.randint(20, 120)))})
+    return history
+
+def old_trim(chat_data, max_total_tokens, count_fn):
+    # the pre-cache implementation, verbatim
+    chat_history = chat_data['chat_history']
+    total_tokens = sum(count_fn(msg['content']) for msg in chat_history)
+    while total_tokens > max_total_tokens and len(chat_history) > 1:
+        chat_history.pop(0)
+        total_tokens = sum(count_fn(msg['content']) for msg in chat_history)
+
+def counting(count_fn):
+    calls = [0]
+    def wrapped(text):
+        calls[0] += 1
+        return count_fn(text)
+    return wrapped, calls
+
+def bench(label, trim, history, max_tokens, count_fn, rounds):
+    best = float('inf')
+    for _ in range(rounds):
+        # fresh copy each round; the cached variant starts without cached counts
+        copy = [dict(message) for message in history]
+        wrapped, calls = counting(count_fn)
+        started = time.perf_counter()
+        trim({'chat_history': copy}, max_tokens, wrapped)
+        best = min(best, time.perf_counter() - started)
+    print(f"{label:<36} {best * 1000:9.2f}ms  tokenizer_calls={calls[0]:<6} kept={len(copy)} messages")
+    return copy
+
+def bench_steady_state(label, trim, history, max_tokens, count_fn, turns, rng):
+    # per-turn cost in a running chat: append user+assistant, trim (twice per turn, like handle_message)
+    copy = [dict(message) for message in history]
+    # one chat's `chat_data`, kept across turns (it carries the running total)
+    chat_data = {'chat_history': copy}
+    trim(chat_data, max_tokens, count_fn)
+    wrapped, calls = counting(count_fn)
+    started = time.perf_counter()
+    for _ in range(turns):
+        copy.append({"role": "user", "content": " ".join(rng.choice(WORDS) for _ in range(40))})
+        trim(chat_data, max_tokens, wrapped)
+        copy.append({"role": "assistant", "content": " ".join(rng.choice(WORDS) for _ in range(80))})
+        trim(chat_data, max_tokens, wrapped)
+    elapsed = time.perf_counter() - started
+    print(f"{label:<36} {elapsed / turns * 1000:9.3f}ms/turn  tokenizer_calls/turn={calls[0] / turns:.1f}")
+
+def main(messages, max_tokens, rounds, turns):
+    tokenizer_name, count_fn = make_tokenizer()
+    rng = random.Random(42)
+    history = make_history(messages, rng)
+    total = sum(count_fn(message['content']) for message in history)
+    print(f"{messages} messages, {total} tokens ({tokenizer_name}), trimming to {max_tokens}\n")
+
+    print("One trim of the full history:")
+    old_kept = bench("  old: re-tokenize after every pop", old_trim, history, max_tokens, count_fn, rounds)
+    new_kept = bench("  new: cached counts + running total", trim_history_by_tokens, history, max_tokens, count_fn, rounds)
+    assert [m['content'] for m in old_kept] == [m['content'] for m in new_kept], "trim results differ"
+
+    print("\nSteady state (2 appends + 2 trims per turn):")
+    bench_steady_state("  old", old_trim, history, max_tokens, count_fn, turns, random.Random(7))
+    bench_steady_state("  new", trim_history_by_tokens, history, max_tokens, count_fn, turns, random.Random(7))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark chat history trimming")
+    parser.add_argument('--messages', type=int, default=200)
+    parser.add_argument('--max-tokens', type=int, default=10000)
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--turns', type=int, default=50)
+    args = parser.parse_args()
+    main(args.messages, args.max_tokens, args.rounds, args.turns)
@@ -0,0 +1,89 @@
+# check_llm_router.py
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# github.com/FlyingFathead/TelegramBot-OpenAI-API/
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#
+# Runs the LLM router (`src/llm_router.py`) against two local fake OpenAI
+# servers: one standing in for the OpenAI API, the other for a local
+# llama.cpp server. Some task classes are routed to the local one, and the
+# script checks that every task ended up on the right server with the
+# right model, and which backends count towards the usage caps.
+#
+#   python src/extras/check_llm_router.py
+
+import sys
+import asyncio
+import logging
+import configparser
+from pathlib import Path
+
+# make `src/` importable
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from fake_openai_server import start_fake_openai_server
+from openai_gateway import OpenAIGateway
+from llm_router import LLMRouter, TASK_CLASSES
+
+ROUTER_CONFIG = """
+[LLMRouter]
+Backends = local
+Formatting = local
+LanguageDetection = local
+SearchAgent = default
+Summarization = local
+
+[Backend.local]
+BaseURL = http://127.0.0.1:{port}/v1
+Model = local-llama
+MaxConnections = 2
+Timeout = 30
+"""
+
+CALLER_MODEL = "gpt-4o-mini"
+EXPECTED = {
+    "formatting": ("local", "local-llama"),
+    "language_detection": ("local", "local-llama"),
+    "search_agent": ("openai", CALLER_MODEL),
+    "summarization": ("local", "local-llama"),
+}
+
+
+async def main():
+    openai_server = start_fake_openai_server(reply_text="from the OpenAI stand-in")
+    local_server = start_fake_openai_server(reply_text="from the local stand-in")
+
+    config = configparser.ConfigParser(default_section='__no_defaults__')
+    config.read_string(ROUTER_CONFIG.format(port=local_server.server_port))
+    default_gateway = OpenAIGateway(api_key="fake", base_url=f"http://127.0.0.1:{openai_server.server_port}/v1", http2=False)
+    router = LLMRouter.from_config(default_gateway, config)
+
+    failures = 0
+    servers = {"openai": openai_server, "local": local_server}
+    for task in TASK_CLASSES:
+        before = {name: dict(server.models_served) for name, server in servers.items()}
+        response = await router.chat_completion(task, {"model": CALLER_MODEL, "messages": [{"role": "user", "content": "hi"}]})
+        response.raise_for_status()
+
+        served = [
+            (name, model) for name, server in servers.items()
+            for model, count in server.models_served.items() if count != before[name].get(model, 0)
+        ]
+        backend = router.backend_for(task)
+        ok = served == [EXPECTED[task]]
+        failures += not ok
+        print(
+            f"{'ok ' if ok else 'BAD'} {task:<19} -> backend={backend.name:<8} served by {served}  "
+            f"billable={backend.billable}  reply={response.json()['choices'][0]['message']['content']!r}"
+        )
+
+    await router.aclose()
+    await default_gateway.aclose()
+    openai_server.shutdown()
+    local_server.shutdown()
+    print("\nall tasks routed as configured" if not failures else f"\n{failures} task(s) routed wrong")
+    return failures
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    sys.exit(1 if asyncio.run(main()) else 0)
@@ -0,0 +1,174 @@
+# fake_openai_server.py
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# github.com/FlyingFathead/TelegramBot-OpenAI-API/
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#
+# A tiny local stand-in for the OpenAI `/v1/chat/completions` endpoint,
+# for benchmarks and manual testing without touching the real API.
+#
+# It speaks HTTP/1.1 with keep-alive and counts how many TCP connections
+# were opened, which makes connection reuse visible.
+#
+# Run standalone:
+#   python src/extras/fake_openai_server.py --port 8089 --delay 0.05
+# ...or import `start_fake_openai_server()` from a script.
+
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+
+    def setup(self):
+        super().setup()
+        # one handler instance == one TCP connection
+        with self.server.stats_lock:
+            self.server.connections_opened += 1
+
+    def log_message(self, format, *args):
+        # keep the benchmark output clean
+        pass
+
+    def _send_json(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _write_chunk(self, data):
+        # HTTP/1.1 chunked transfer encoding
+        self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+        self.wfile.flush()
+
+    def _send_stream(self, model, reply):
+        # server-sent events, one word per chunk, like `stream: true` on the real API
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        base = {"id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": int(time.time()), "model": model}
+        words = reply.split(' ')
+        for i, word in enumerate(words):
+            delta = {"content": word if i == 0 else ' ' + word}
+            if i == 0:
+                delta["role"] = "assistant"
+            chunk = dict(base, choices=[{"index": 0, "delta": delta, "finish_reason": None}])
+            self._write_chunk(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+            if self.server.stream_chunk_delay:
+                time.sleep(self.server.stream_chunk_delay)
+
+        final = dict(base, choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}])
+        usage = dict(base, choices=[], usage={"prompt_tokens": 10, "completion_tokens": len(words), "total_tokens": 10 + len(words)})
+        self._write_chunk(f"data: {json.dumps(final)}\n\n".encode('utf-8'))
+        self._write_chunk(f"data: {json.dumps(usage)}\n\n".encode('utf-8'))
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._write_chunk(b"")
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        raw_body = self.rfile.read(length) if length else b"{}"
+        try:
+            request = json.loads(raw_body)
+        except json.JSONDecodeError:
+            self._send_json(400, {"error": {"message": "invalid JSON"}})
+            return
+
+        with self.server.stats_lock:
+            self.server.requests_served += 1
+
+        if not self.path.rstrip('/').endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": f"unknown path {self.path}"}})
+            return
+
+        delay = self.server.delay
+        if self.server.tail_probability and random.random() < self.server.tail_probability:
+            delay = self.server.tail_delay  # an occasional very slow reply
+        if delay:
+            time.sleep(delay)
+
+        model = request.get("model", "fake-model")
+        with self.server.stats_lock:
+            self.server.models_served[model] = self.server.models_served.get(model, 0) + 1
+        reply = self.server.reply_text
+        if request.get("stream"):
+            self._send_stream(model, reply)
+            return
+        self._send_json(200, {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": reply},
+                "finish_reason": "stop",
+            }],
+            "usage": {
+                "prompt_tokens": 10,
+                "completion_tokens": 5,
+                "total_tokens": 15,
+            },
+        })
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # clients hanging up mid-reply (i.e. a cancelled hedge) is expected
+        pass
+
+
+def start_fake_openai_server(host="127.0.0.1", port=0, delay=0.0, reply_text="Hello from the fake OpenAI server!", stream_chunk_delay=0.0,
+                             tail_probability=0.0, tail_delay=0.0):
+    """
+    Start the fake server in a daemon thread. Returns the server; its base URL
+    is `f"http://{host}:{server.server_port}/v1"`. Call `server.shutdown()` when done.
+    Requests with `"stream": true` get an SSE reply, one word per chunk, with
+    `stream_chunk_delay` seconds between chunks. With `tail_probability`, that
+    share of the requests waits `tail_delay` seconds instead of `delay`.
+    `server.models_served` counts the requests per requested model.
+    """
+    server = FakeOpenAIServer((host, port), FakeOpenAIHandler)
+    server.delay = delay
+    server.tail_probability = tail_probability
+    server.tail_delay = tail_delay
+    server.reply_text = reply_text
+    server.stream_chunk_delay = stream_chunk_delay
+    server.stats_lock = threading.Lock()
+    server.connections_opened = 0
+    server.requests_served = 0
+    server.models_served = {}
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Local fake OpenAI chat completions server")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--delay', type=float, default=0.0, help="Seconds to wait before each response")
+    parser.add_argument('--tail-probability', type=float, default=0.0, help="Share of requests that get the --tail-delay instead")
+    parser.add_argument('--tail-delay', type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = start_fake_openai_server(args.host, args.port, args.delay,
+                                      tail_probability=args.tail_probability, tail_delay=args.tail_delay)
+    print(f"Fake OpenAI server listening on http://{args.host}:{server.server_port}/v1 (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
+        sys.exit(0)
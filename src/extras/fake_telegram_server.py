@@ -0,0 +1,149 @@
+# fake_telegram_server.py
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# github.com/FlyingFathead/TelegramBot-OpenAI-API/
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#
+# A tiny local stand-in for the Telegram Bot API, for load tests without
+# touching the real Telegram servers.
+#
+# It implements just enough for python-telegram-bot's polling loop:
+# `getMe`, `deleteWebhook`, long-polling `getUpdates`, `sendMessage`,
+# `editMessageText` and `sendChatAction`. Test scripts push incoming user
+# messages with `inject_message()` and read back what the bot sent from
+# `sent_messages` (each with the time it was received).
+#
+# Point python-telegram-bot at it with:
+#   Application.builder().token("123:fake").base_url(f"http://127.0.0.1:{port}/bot")
+
+import json
+import time
+import threading
+from urllib.parse import parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FAKE_BOT_USER = {"id": 1, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot"}
+
+
+class FakeTelegramHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_params(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        if not body:
+            return {}
+        content_type = self.headers.get("Content-Type", "")
+        if "application/json" in content_type:
+            return json.loads(body)
+        # python-telegram-bot sends form-encoded parameters (non-string values JSON-encoded)
+        params = {}
+        for key, values in parse_qs(body.decode("utf-8"), keep_blank_values=True).items():
+            value = values[0]
+            try:
+                params[key] = json.loads(value)
+            except ValueError:
+                params[key] = value
+        return params
+
+    def _reply(self, result):
+        data = json.dumps({"ok": True, "result": result}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self.do_POST()
+
+    def do_POST(self):
+        method = self.path.rstrip("/").rsplit("/", 1)[-1]
+        params = self._read_params()
+        server = self.server
+
+        if method == "getMe":
+            return self._reply(FAKE_BOT_USER)
+        if method in ("deleteWebhook", "sendChatAction", "setMyCommands"):
+            return self._reply(True)
+        if method == "getUpdates":
+            return self._reply(server.wait_for_updates(int(params.get("offset") or 0), float(params.get("timeout") or 0)))
+        if method in ("sendMessage", "editMessageText"):
+            return self._reply(server.record_sent(method, params))
+        return self._reply(True)
+
+
+class FakeTelegramServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address):
+        super().__init__(address, FakeTelegramHandler)
+        self.updates = []
+        self.updates_cond = threading.Condition()
+        self.next_update_id = 1
+        self.next_message_id = 1
+        self.sent_lock = threading.Lock()
+        self.sent_messages = []
+
+    def handle_error(self, request, client_address):
+        # the bot hanging up on a pending long poll when it stops is expected
+        pass
+
+    def inject_message(self, chat_id, text):
+        """Queue an incoming text message from user `chat_id`; returns its update_id."""
+        with self.updates_cond:
+            update_id = self.next_update_id
+            self.next_update_id += 1
+            self.updates.append({
+                "update_id": update_id,
+                "message": {
+                    "message_id": update_id,
+                    "date": int(time.time()),
+                    "chat": {"id": chat_id, "type": "private", "first_name": f"user{chat_id}"},
+                    "from": {"id": chat_id, "is_bot": False, "first_name": f"user{chat_id}"},
+                    "text": text,
+                },
+            })
+            self.updates_cond.notify_all()
+            return update_id
+
+    def wait_for_updates(self, offset, timeout):
+        deadline = time.monotonic() + timeout
+        with self.updates_cond:
+            while True:
+                # everything below `offset` has been confirmed by the bot
+                self.updates = [update for update in self.updates if update["update_id"] >= offset]
+                if self.updates:
+                    return list(self.updates)
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return []
+                self.updates_cond.wait(remaining)
+
+    def record_sent(self, method, params):
+        with self.sent_lock:
+            message_id = self.next_message_id
+            self.next_message_id += 1
+            self.sent_messages.append({
+                "method": method,
+                "chat_id": params.get("chat_id"),
+                "text": params.get("text"),
+                "received_at": time.monotonic(),
+            })
+        return {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": params.get("chat_id"), "type": "private"},
+            "from": FAKE_BOT_USER,
+            "text": params.get("text", ""),
+        }
+
+
+def start_fake_telegram_server(host="127.0.0.1", port=0):
+    """Start the server in a background thread; returns `(server, port)`."""
+    server = FakeTelegramServer((host, port))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, server.server_address[1]
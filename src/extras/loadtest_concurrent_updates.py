@@ -0,0 +1,139 @@
+# loadtest_concurrent_updates.py
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# github.com/FlyingFathead/TelegramBot-OpenAI-API/
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#
+# Load test for update processing: 50 chats talking to the bot at once,
+# against a local fake Telegram Bot API server (`fake_telegram_server.py`).
+#
+#   python src/extras/loadtest_concurrent_updates.py --chats 50 --messages-per-chat 2
+#
+# The handler stands in for `handle_message`: it "thinks" for a short random
+# while (a completion), except in a few chats where the first message hits
+# a slow tool (a long Perplexity query, say). Three modes are compared:
+#
+#   sequential  python-telegram-bot's default, one update at a time
+#   unordered   `concurrent_updates=True`, no per-chat ordering
+#   per-chat    `update_processor.PerChatUpdateProcessor`
+#
+# and for each the time from a message arriving at "Telegram" until the
+# bot's reply is sent back is reported (p50 / p95 / max), along with how
+# often two messages of one chat were handled at the same time or out of order.
+
+import sys
+import time
+import random
+import asyncio
+import argparse
+import logging
+from pathlib import Path
+
+# make `src/` importable
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from telegram.ext import Application, MessageHandler, filters
+
+from fake_telegram_server import start_fake_telegram_server
+from update_processor import PerChatUpdateProcessor
+
+MODES = ("sequential", "unordered", "per-chat")
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[index]
+
+def make_handler(stats, work_min, work_max, slow_chats, slow_seconds):
+    async def handler(update, context):
+        chat_id = update.effective_chat.id
+        seq = int(update.message.text.split(':')[1])
+
+        # what `handle_message` must never see: the same chat being handled twice at once, or out of order
+        if context.chat_data.get('busy'):
+            stats['overlaps'] += 1
+        if seq < context.chat_data.get('last_seq', -1):
+            stats['out_of_order'] += 1
+        context.chat_data['busy'] = True
+        context.chat_data['last_seq'] = seq
+
+        try:
+            if chat_id in slow_chats and seq == 0:
+                await asyncio.sleep(slow_seconds)
+            else:
+                await asyncio.sleep(random.uniform(work_min, work_max))
+            await context.bot.send_message(chat_id=chat_id, text=f"reply {chat_id}:{seq}")
+        finally:
+            context.chat_data['busy'] = False
+    return handler
+
+async def run_mode(mode, args):
+    server, port = start_fake_telegram_server()
+    builder = Application.builder().token("123456:fake-token").base_url(f"http://127.0.0.1:{port}/bot")
+    if mode == "unordered":
+        builder = builder.concurrent_updates(True)
+    elif mode == "per-chat":
+        builder = builder.concurrent_updates(PerChatUpdateProcessor(max_concurrent_chats=args.max_concurrent_chats))
+    application = builder.build()
+
+    rng = random.Random(1)
+    chat_ids = [1000 + i for i in range(args.chats)]
+    slow_chats = set(rng.sample(chat_ids, min(args.slow_chats, len(chat_ids))))
+    stats = {'overlaps': 0, 'out_of_order': 0}
+    application.add_handler(MessageHandler(filters.TEXT, make_handler(stats, args.work_min, args.work_max, slow_chats, args.slow_seconds)))
+
+    await application.initialize()
+    await application.start()
+    await application.updater.start_polling(poll_interval=0.0, timeout=1)
+
+    # every chat sends its messages in a quick burst, all chats at once
+    injected = {}
+    for seq in range(args.messages_per_chat):
+        for chat_id in chat_ids:
+            server.inject_message(chat_id, f"msg:{seq}")
+            injected[f"reply {chat_id}:{seq}"] = time.monotonic()
+
+    expected = len(injected)
+    deadline = time.monotonic() + args.max_runtime
+    while len(server.sent_messages) < expected and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+
+    await application.updater.stop()
+    await application.stop()
+    await application.shutdown()
+    server.shutdown()
+
+    latencies = [message['received_at'] - injected[message['text']] for message in server.sent_messages if message['text'] in injected]
+    slow_replies = {f"reply {chat_id}:0" for chat_id in slow_chats}
+    others = [message['received_at'] - injected[message['text']] for message in server.sent_messages
+              if message['text'] in injected and message['text'] not in slow_replies]
+
+    print(
+        f"{mode:<11} replies={len(latencies)}/{expected:<4} "
+        f"p50={percentile(latencies, 50):6.2f}s  p95={percentile(latencies, 95):6.2f}s  max={max(latencies):6.2f}s  "
+        f"p95 (excl. slow tool calls)={percentile(others, 95):6.2f}s  "
+        f"overlaps={stats['overlaps']}  out_of_order={stats['out_of_order']}"
+    )
+
+async def main(args):
+    print(
+        f"{args.chats} chats x {args.messages_per_chat} messages, {args.work_min:g}-{args.work_max:g}s per reply, "
+        f"{args.slow_chats} chats start with a {args.slow_seconds:g}s tool call\n"
+    )
+    for mode in args.modes:
+        await run_mode(mode, args)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Load test concurrent update processing against a fake Telegram server")
+    parser.add_argument('--chats', type=int, default=50)
+    parser.add_argument('--messages-per-chat', type=int, default=2)
+    parser.add_argument('--work-min', type=float, default=0.05, help="fastest simulated reply (seconds)")
+    parser.add_argument('--work-max', type=float, default=0.25, help="slowest simulated reply (seconds)")
+    parser.add_argument('--slow-chats', type=int, default=5, help="chats whose first message runs a slow tool")
+    parser.add_argument('--slow-seconds', type=float, default=3.0)
+    parser.add_argument('--max-concurrent-chats', type=int, default=16)
+    parser.add_argument('--max-runtime', type=float, default=120.0)
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES))
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(main(args))
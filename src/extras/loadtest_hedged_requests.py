@@ -0,0 +1,139 @@
+# loadtest_hedged_requests.py
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# github.com/FlyingFathead/TelegramBot-OpenAI-API/
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#
+# Hedged requests (`src/hedged_requests.py`) against two local fake
+# OpenAI servers with injected delays:
+#
+#   primary    usually fast, but a few percent of the replies stall (the tail)
+#   secondary  a bit slower, but steady (think: a local llama.cpp server)
+#
+#   python src/extras/loadtest_hedged_requests.py --requests 300 --tail-probability 0.05 --tail-delay 3
+#
+# Reports the latency percentiles with and without hedging, how often the
+# hedge fired and who won, and checks the accounting: every request has
+# exactly one winner, and only the winners' tokens are charged.
+
+import sys
+import time
+import asyncio
+import argparse
+import logging
+from pathlib import Path
+
+# make `src/` importable
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from fake_openai_server import start_fake_openai_server
+from openai_gateway import OpenAIGateway
+from hedged_requests import Hedger
+
+PREMIUM_MODEL = "gpt-4o"
+SECONDARY_MODEL = "local-model"
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[index]
+
+def payload(i, stream):
+    body = {"model": PREMIUM_MODEL, "messages": [{"role": "user", "content": f"question {i}"}]}
+    if stream:
+        body["stream"] = True
+    return body
+
+async def one_request(i, gateway, hedger, stream):
+    started = time.perf_counter()
+    if hedger is None:
+        if stream:
+            async for _ in gateway.stream_chat_completion(payload(i, stream)):
+                pass
+        else:
+            (await gateway.chat_completion(payload(i, stream))).raise_for_status()
+        return time.perf_counter() - started, "primary", 15
+
+    if stream:
+        chunks, target = await hedger.open_stream(payload(i, stream))
+        usage = None
+        async for chunk in chunks:
+            usage = chunk.get("usage") or usage
+        tokens = (usage or {}).get("total_tokens", 0)
+    else:
+        response, target = await hedger.chat_completion(payload(i, stream))
+        tokens = response.json()["usage"]["total_tokens"]
+    return time.perf_counter() - started, target.name, tokens
+
+async def run(args, hedging):
+    primary = start_fake_openai_server(
+        delay=args.primary_delay, tail_probability=args.tail_probability, tail_delay=args.tail_delay
+    )
+    secondary = start_fake_openai_server(delay=args.secondary_delay)
+    gateway = OpenAIGateway(api_key="fake", base_url=f"http://127.0.0.1:{primary.server_port}/v1", http2=False)
+    hedger = None
+    if hedging:
+        hedger = Hedger(
+            gateway,
+            secondary_model=SECONDARY_MODEL,
+            secondary_base_url=f"http://127.0.0.1:{secondary.server_port}/v1",
+            premium_model=PREMIUM_MODEL,
+            initial_delay=args.initial_delay,
+            enabled=True,
+        )
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+    results = []
+
+    async def worker(i):
+        async with semaphore:
+            results.append(await one_request(i, gateway, hedger, args.stream))
+
+    await asyncio.gather(*(worker(i) for i in range(args.requests)))
+    await gateway.aclose()
+    if hedger is not None:
+        await hedger.aclose()
+
+    latencies = [latency for latency, _, _ in results]
+    wins = {name: sum(1 for _, winner, _ in results if winner == name) for name in ("primary", "secondary")}
+    charged = sum(tokens for _, winner, tokens in results if winner == "primary")
+    sent = primary.requests_served + secondary.requests_served
+    primary.shutdown()
+    secondary.shutdown()
+
+    label = "hedged" if hedging else "plain"
+    print(
+        f"{label:<7} p50={percentile(latencies, 50):5.2f}s  p90={percentile(latencies, 90):5.2f}s  "
+        f"p99={percentile(latencies, 99):5.2f}s  max={max(latencies):5.2f}s  "
+        f"requests sent={sent} (primary {primary.requests_served}, secondary {secondary.requests_served})  "
+        f"won by primary={wins['primary']} secondary={wins['secondary']}"
+    )
+    if hedging:
+        # every request has exactly one winner; the primary's tokens are the only ones charged
+        # (the secondary is a non-OpenAI server here)
+        assert wins['primary'] + wins['secondary'] == args.requests
+        print(f"        charged tokens={charged} (from the {wins['primary']} primary wins only), extra requests from hedging={sent - args.requests}")
+
+async def main(args):
+    print(
+        f"{args.requests} requests, {args.concurrency} at a time ({'streamed' if args.stream else 'non-streamed'}); "
+        f"primary {args.primary_delay:g}s ({args.tail_probability:.0%} take {args.tail_delay:g}s), "
+        f"secondary {args.secondary_delay:g}s\n"
+    )
+    await run(args, hedging=False)
+    await run(args, hedging=True)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Hedged requests against two local fake OpenAI servers")
+    parser.add_argument('--requests', type=int, default=300)
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--primary-delay', type=float, default=0.2)
+    parser.add_argument('--tail-probability', type=float, default=0.05)
+    parser.add_argument('--tail-delay', type=float, default=3.0)
+    parser.add_argument('--secondary-delay', type=float, default=0.3)
+    parser.add_argument('--initial-delay', type=float, default=1.0, help="hedge delay until enough samples are in")
+    parser.add_argument('--stream', action='store_true', help="use streamed completions (hedge on the first chunk)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(main(args))
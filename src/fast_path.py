@@ -0,0 +1,252 @@
+# fast_path.py
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# github.com/FlyingFathead/TelegramBot-OpenAI-API/
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#
+# Answers trivial messages locally, without calling the model (opt-in).
+#
+# "What time is it?", "what's 12% of 4500" and "list my reminders" each
+# cost two model round trips: the first completion picks a tool, the
+# second one turns the tool's result into a reply. For messages that
+# unambiguously ask just that, the fast path runs the same local code
+# directly (the clock, `calc_module`, `reminder_handler`) and answers from
+# a template in the user's language (Finnish or English).
+#
+# Only whole-message matches count: "what time is it in Tokyo?" or "is
+# 12% of 4500 a good tip?" still go to the model. Anything that fails
+# locally (i.e. an expression that doesn't evaluate) falls through to the
+# model as well. Hits, misses and latency are recorded as `fast_path.*`
+# metrics (see `/metrics`). See `[FastPath]` in config.ini.
+
+import re
+import html
+import time
+import logging
+import datetime
+import configparser
+
+import pytz
+from telegram.constants import ParseMode
+
+import bot_metrics
+import db_utils
+import async_db
+from config_paths import CONFIG_PATH, REMINDERS_DB_PATH
+from calc_module import evaluate_expression
+from reminder_handler import handle_view_reminders
+from timedate_handler import fi_days, fi_months, get_ordinal_suffix
+
+logger = logging.getLogger('TelegramBotLogger')
+
+# Load the configuration file
+config = configparser.ConfigParser()
+config.read(CONFIG_PATH)
+
+FAST_PATH_ENABLED = config.getboolean('FastPath', 'Enabled', fallback=False)
+# which intents may be answered locally (comma-separated)
+ENABLED_INTENTS = frozenset(
+    name.strip() for name in config.get('FastPath', 'Intents', fallback='time, date, calculate, reminders').split(',') if name.strip()
+)
+# time zone for the time & date answers
+try:
+    FAST_PATH_TIMEZONE = pytz.timezone(config.get('FastPath', 'TimeZone', fallback='Europe/Helsinki').strip())
+except pytz.UnknownTimeZoneError:
+    logger.warning("Unknown [FastPath] TimeZone; using UTC.")
+    FAST_PATH_TIMEZONE = pytz.utc
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# intents (whole-message matches only)
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# intent => [(language, pattern)]; a named `expression` group is what gets calculated
+_EXPRESSION = r"(?P<expression>[\d\s.,+\-*/^%()x×÷]+(\s+of\s+[\d\s.,+\-*/^%()x×÷]+)?)"
+
+def _whole(pattern):
+    """The pattern as a whole-message match (give or take a trailing '?', '!' or '=')."""
+    return re.compile(r"^\s*(?:" + pattern + r")\s*=?\s*[?.!]*\s*$", re.IGNORECASE)
+
+INTENT_PATTERNS = {
+    'time': [
+        ('en', _whole(r"(hey,?\s+)?(what('s| is) the (current )?time( now| right now)?|what time is it( now| right now)?|current time)")),
+        ('fi', _whole(r"(hei,?\s+)?((paljonko|mitä|mikä) (kello|aika) on( nyt)?|(paljonko|mitä) on kello( nyt)?|kellonaika)")),
+    ],
+    'date': [
+        ('en', _whole(r"what('s| is) (the date|today's date|the day)( today)?|what day is (it|today)|today's date")),
+        ('fi', _whole(r"(mikä|monesko) (päivä|päivämäärä) (on )?(tänään|nyt)( on)?|mikä (päivä|päivämäärä) on|mikä on (tämän päivän |päivän )?päivämäärä")),
+    ],
+    'calculate': [
+        ('en', _whole(r"(what('s| is)|calculate|compute|how much is)\s+" + _EXPRESSION)),
+        ('fi', _whole(r"(laske|paljonko on|mitä on|mikä on)\s+" + _EXPRESSION)),
+        # a bare expression: no words, so the language comes from the user's Telegram settings
+        (None, _whole(_EXPRESSION)),
+    ],
+    'reminders': [
+        ('en', _whole(r"((show|list|view|see|check)( me)?|what are)\s+(all\s+)?(of\s+)?(my|the)\s+(pending\s+|current\s+|upcoming\s+|active\s+)?reminders|my reminders")),
+        ('fi', _whole(r"(näytä|listaa|katso)\s+(kaikki\s+)?(minun\s+)?(muistutukseni|muistutukset)|mitä muistutuksia (minulla|mulla) on|muistutukseni")),
+    ],
+}
+
+# an expression needs an operator (so "42" or a phone number isn't one), and a date isn't one
+_OPERATOR = re.compile(r"\d\s*([+\-*/^%x×÷]|\bof\b)", re.IGNORECASE)
+_DATE_LIKE = re.compile(r"^\s*\d{1,4}[-/.]\d{1,2}[-/.]\d{1,4}\s*$")
+
+# ~~~~~~~~~~~~~~~~~~~~~
+# reply templates
+# ~~~~~~~~~~~~~~~~~~~~~
+TEMPLATES = {
+    'en': {
+        'time': "It's {time} ({timezone}), {weekday}, {date}.",
+        'date': "Today is {weekday}, {date}.",
+        'calculate': "{expression} = {result}",
+    },
+    'fi': {
+        'time': "Kello on {time} ({timezone}), {weekday} {date}.",
+        'date': "Tänään on {weekday} {date}.",
+        'calculate': "{expression} = {result}",
+        'no_reminders': "Sinulla ei ole odottavia muistutuksia.",
+        'reminders_header': "<b>Odottavat muistutuksesi:</b>",
+        'reminder_line': "• #{index} (ID {reminder_id}) <i>{due}</i>\n   “{text}”",
+    },
+}
+
+
+def match_intent(message, user_language=None):
+    """Returns `(intent, language, match)` if the whole message is a fast-path request, else None."""
+    if not message or len(message) > 200:
+        return None
+    for intent, patterns in INTENT_PATTERNS.items():
+        if intent not in ENABLED_INTENTS:
+            continue
+        for language, pattern in patterns:
+            match = pattern.match(message)
+            if match is None:
+                continue
+            if intent == 'calculate':
+                expression = match.group('expression')
+                if not _OPERATOR.search(expression) or _DATE_LIKE.match(expression):
+                    continue
+            if language is None:
+                language = 'fi' if (user_language or '').lower().startswith('fi') else 'en'
+            return intent, language, match
+    return None
+
+async def try_fast_path(bot, update, context, user_message):
+    """
+    Answer `user_message` locally if it's a fast-path request; returns True if it
+    was answered (and the reply sent), False if it should go to the model as usual.
+    """
+    if not FAST_PATH_ENABLED:
+        return False
+
+    started = time.monotonic()
+    bot_metrics.increment("fast_path.messages")
+    user = update.effective_user
+    matched = match_intent(user_message, getattr(user, 'language_code', None))
+
+    reply = None
+    if matched is not None:
+        intent, language, match = matched
+        try:
+            reply = await _answer(intent, language, match, user.id)
+        except Exception as e:
+            logger.warning(f"Fast path: '{intent}' failed locally ({e}); handing the message to the model.")
+            reply = None
+
+    if reply is None:
+        bot_metrics.increment("fast_path.misses")
+        _update_hit_rate()
+        bot_metrics.observe("fast_path.check", time.monotonic() - started)
+        return False
+
+    chat_id = update.effective_chat.id
+    await context.bot.send_message(chat_id=chat_id, text=reply, parse_mode=ParseMode.HTML)
+
+    # keep the exchange in the chat history, so the model knows about it on the next turn
+    chat_history = context.chat_data.get('chat_history', [])
+    chat_history.append({"role": "user", "content": user_message})
+    chat_history.append({"role": "assistant", "content": reply})
+    context.chat_data['chat_history'] = chat_history
+    context.chat_data['last_message_time'] = datetime.datetime.utcnow()
+
+    bot.log_message('User', user.id, user_message)
+    bot.log_message('Bot', user.id, reply, source=f"fast_path:{intent}", model_info="model=none (local fast path)")
+
+    elapsed = time.monotonic() - started
+    bot_metrics.increment("fast_path.hits")
+    bot_metrics.increment(f"fast_path.hits.{intent}")
+    _update_hit_rate()
+    bot_metrics.observe("fast_path.latency", elapsed)
+    logger.info(f"Fast path: answered a '{intent}' request ({language}) locally in {elapsed * 1000:.1f} ms.")
+    return True
+
+async def _answer(intent, language, match, user_id):
+    """The reply (HTML) for a matched intent, or None to let the model handle it."""
+    templates = TEMPLATES[language]
+    if intent in ('time', 'date'):
+        now = datetime.datetime.now(FAST_PATH_TIMEZONE)
+        return templates[intent].format(
+            time=now.strftime("%H.%M" if language == 'fi' else "%H:%M"),
+            timezone=html.escape(str(FAST_PATH_TIMEZONE)),
+            **_date_parts(now, language),
+        )
+
+    if intent == 'calculate':
+        expression = " ".join(match.group('expression').split())
+        result = evaluate_expression(_normalize_expression(expression, language))
+        return templates['calculate'].format(expression=html.escape(expression), result=_format_number(result, language))
+
+    if intent == 'reminders':
+        if not db_utils.DB_INITIALIZED_SUCCESSFULLY:
+            return None
+        if language == 'en':
+            return await handle_view_reminders(user_id)
+        return _format_reminders_fi(await async_db.get_pending_reminders_for_user(REMINDERS_DB_PATH, user_id))
+
+    return None
+
+def _date_parts(moment, language):
+    weekday = moment.strftime("%A")
+    month = moment.strftime("%B")
+    if language == 'fi':
+        return {"weekday": fi_days.get(weekday, weekday), "date": f"{moment.day}. {fi_months.get(month, month)} {moment.year}"}
+    return {"weekday": weekday, "date": f"{month} {moment.day}{get_ordinal_suffix(moment.day)}, {moment.year}"}
+
+def _normalize_expression(expression, language):
+    expression = expression.replace('×', '*').replace('÷', '/')
+    expression = re.sub(r"(?<=[\d\s)])x(?=[\d\s(])", "*", expression, flags=re.IGNORECASE)
+    if language == 'fi':
+        # decimal comma: 2,5 => 2.5
+        expression = re.sub(r"(\d),(\d)", r"\1.\2", expression)
+    return expression
+
+def _format_number(value, language):
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        value = int(value)
+    text = str(value) if isinstance(value, int) else f"{value:.10g}"
+    return text.replace('.', ',') if language == 'fi' else text
+
+def _format_reminders_fi(reminders):
+    templates = TEMPLATES['fi']
+    if not reminders:
+        return templates['no_reminders']
+    lines = [templates['reminders_header']]
+    for index, reminder in enumerate(reminders, start=1):
+        lines.append(templates['reminder_line'].format(
+            index=index,
+            reminder_id=reminder['reminder_id'],
+            due=_local_due_time(reminder['due_time_utc']),
+            text=html.escape(reminder['reminder_text']),
+        ))
+    return "\n".join(lines)
+
+def _local_due_time(due_time_utc):
+    try:
+        due = datetime.datetime.strptime(due_time_utc, '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=pytz.utc)
+    except ValueError:
+        return due_time_utc
+    return due.astimezone(FAST_PATH_TIMEZONE).strftime("%d.%m.%Y klo %H.%M")
+
+def _update_hit_rate():
+    hits = bot_metrics.get_counter("fast_path.hits")
+    seen = bot_metrics.get_counter("fast_path.messages")
+    if seen:
+        bot_metrics.set_gauge("fast_path.hit_rate", round(hits / seen, 3))
@@ -0,0 +1,238 @@
+# hedged_requests.py
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# github.com/FlyingFathead/TelegramBot-OpenAI-API/
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#
+# Hedged requests for the main chat completion (opt-in).
+#
+# What users notice is the slow tail: the one reply in twenty that takes
+# half a minute. With hedging on, a request to the premium model that
+# hasn't produced its first byte after the observed p90 delay gets a
+# second copy sent to a secondary target -- the `FallbackModel`, or any
+# OpenAI-compatible server (i.e. a local llama.cpp) at `SecondaryBaseURL`.
+# Whichever starts answering first wins and the other one is cancelled.
+#
+# Only the winner is charged: the response carries the target that served
+# it (`_served_by`), and the usage accounting credits that model's tier
+# (or nothing at all for a non-OpenAI secondary server).
+#
+# "First byte" is the first streamed chunk in streaming mode, and the whole
+# response otherwise (a non-streamed completion arrives all at once).
+# See `[Hedging]` in config.ini, and `extras/loadtest_hedged_requests.py`
+# for a run against two local fake servers.
+
+import os
+import time
+import asyncio
+import logging
+import configparser
+from collections import deque
+
+import bot_metrics
+from config_paths import CONFIG_PATH
+from openai_gateway import OpenAIGateway
+from retry_policy import RetryPolicy
+
+logger = logging.getLogger('TelegramBotLogger')
+
+# Load the configuration file
+config = configparser.ConfigParser()
+config.read(CONFIG_PATH)
+
+HEDGING_ENABLED = config.getboolean('Hedging', 'Enabled', fallback=False)
+PREMIUM_MODEL = config.get('ModelAutoSwitch', 'PremiumModel', fallback='gpt-4o')
+# the secondary target: a model (blank = `FallbackModel`) and optionally another OpenAI-compatible server
+SECONDARY_MODEL = (
+    config.get('Hedging', 'SecondaryModel', fallback='').strip()
+    or config.get('ModelAutoSwitch', 'FallbackModel', fallback='gpt-4o-mini')
+)
+SECONDARY_BASE_URL = config.get('Hedging', 'SecondaryBaseURL', fallback='').strip()
+# name of the environment variable holding the secondary server's API key (if it wants one)
+SECONDARY_API_KEY_ENV = config.get('Hedging', 'SecondaryAPIKeyEnv', fallback='').strip()
+# hedge after this percentile of the primary's recent first-byte delays
+HEDGE_PERCENTILE = config.getfloat('Hedging', 'Percentile', fallback=90.0)
+# delay used until there are `MinSamples` observations
+INITIAL_DELAY = config.getfloat('Hedging', 'InitialDelay', fallback=4.0)
+MIN_DELAY = config.getfloat('Hedging', 'MinDelay', fallback=0.5)
+MIN_SAMPLES = config.getint('Hedging', 'MinSamples', fallback=20)
+SAMPLE_WINDOW = config.getint('Hedging', 'SampleWindow', fallback=200)
+
+
+class HedgeTarget:
+    """Where a request went; `billable` is False for a non-OpenAI (i.e. local) server."""
+
+    __slots__ = ("name", "model", "gateway", "billable")
+
+    def __init__(self, name, model, gateway, billable=True):
+        self.name = name
+        self.model = model
+        self.gateway = gateway
+        self.billable = billable
+
+    def __repr__(self):
+        return f"HedgeTarget({self.name!r}, model={self.model!r})"
+
+
+class Hedger:
+    """
+    Races the primary request against a delayed copy to the secondary target:
+
+        response, target = await hedger.chat_completion(payload, timeout)
+        chunks, target = await hedger.open_stream(payload, timeout)
+    """
+
+    def __init__(
+        self,
+        primary_gateway,
+        secondary_model=SECONDARY_MODEL,
+        secondary_base_url=SECONDARY_BASE_URL,
+        secondary_api_key_env=SECONDARY_API_KEY_ENV,
+        premium_model=PREMIUM_MODEL,
+        percentile=HEDGE_PERCENTILE,
+        initial_delay=INITIAL_DELAY,
+        min_delay=MIN_DELAY,
+        min_samples=MIN_SAMPLES,
+        sample_window=SAMPLE_WINDOW,
+        enabled=HEDGING_ENABLED,
+    ):
+        self.enabled = enabled
+        self.primary_gateway = primary_gateway
+        self.premium_model = premium_model
+        self.percentile = percentile
+        self.initial_delay = initial_delay
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self._first_byte = deque(maxlen=sample_window)  # seconds until the primary's first byte
+
+        self._own_gateway = None
+        if secondary_base_url:
+            # a separate server gets its own pool (and its own circuit breaker)
+            api_key = os.getenv(secondary_api_key_env) if secondary_api_key_env else None
+            self._own_gateway = OpenAIGateway(
+                api_key=api_key or "none",  # never hand the OpenAI key to a third-party server
+                base_url=secondary_base_url,
+                timeout=primary_gateway.timeout.read,
+                retry_policy=RetryPolicy("hedge_secondary"),
+            )
+            self.secondary = HedgeTarget("secondary", secondary_model, self._own_gateway, billable=False)
+        else:
+            self.secondary = HedgeTarget("secondary", secondary_model, primary_gateway)
+
+    def applies(self, payload):
+        """Hedge only requests to the premium model, and only if the secondary is something else."""
+        if not self.enabled or payload.get("model") != self.premium_model:
+            return False
+        return self.secondary.gateway is not self.primary_gateway or self.secondary.model != payload.get("model")
+
+    def hedge_delay(self):
+        if len(self._first_byte) < self.min_samples:
+            return self.initial_delay
+        ordered = sorted(self._first_byte)
+        index = min(len(ordered) - 1, max(0, int(round(self.percentile / 100.0 * len(ordered))) - 1))
+        return max(self.min_delay, ordered[index])
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    # the calls raced against each other
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    async def chat_completion(self, payload, timeout=None):
+        """Returns `(httpx.Response, HedgeTarget)` of the winner."""
+        async def attempt(target):
+            response = await target.gateway.chat_completion(dict(payload, model=target.model), timeout=timeout)
+            response.raise_for_status()
+            return response
+        return await self._race(payload, attempt)
+
+    async def open_stream(self, payload, timeout=None):
+        """
+        Returns `(chunks, HedgeTarget)`, where `chunks` is an async iterator over
+        the winning stream's chunks (starting with the first one, which decided the race).
+        """
+        async def attempt(target):
+            stream = target.gateway.stream_chat_completion(dict(payload, model=target.model), timeout=timeout)
+            try:
+                first_chunk = await stream.__anext__()
+            except StopAsyncIteration:
+                first_chunk = None
+            except BaseException:
+                await stream.aclose()
+                raise
+            return first_chunk, stream
+
+        async def release(result):
+            # a stream that got its first chunk just as it lost the race
+            await result[1].aclose()
+
+        (first_chunk, stream), target = await self._race(payload, attempt, release)
+        return _replay(first_chunk, stream), target
+
+    async def _race(self, payload, attempt, release=None):
+        primary = HedgeTarget("primary", payload.get("model"), self.primary_gateway)
+        started = time.monotonic()
+        tasks = {asyncio.ensure_future(attempt(primary)): primary}
+
+        try:
+            delay = self.hedge_delay()
+            done, _ = await asyncio.wait(set(tasks), timeout=delay)
+            if done:
+                # the common case: no hedge needed (errors are raised to the caller as usual)
+                result = done.pop().result()
+                self._first_byte.append(time.monotonic() - started)
+                bot_metrics.observe("hedging.primary_first_byte", time.monotonic() - started)
+                return result, primary
+
+            bot_metrics.increment("hedging.fired")
+            logger.info(f"Hedging: no first byte from {primary.model} after {delay:.2f}s, also asking {self.secondary.model}.")
+            tasks[asyncio.ensure_future(attempt(self.secondary))] = self.secondary
+
+            errors = {}
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    target = tasks[task]
+                    if task.exception() is not None:
+                        errors[target.name] = task.exception()
+                        logger.warning(f"Hedging: {target.model} ({target.name}) failed: {task.exception()}")
+                        continue
+
+                    elapsed = time.monotonic() - started
+                    # if the secondary won, this is only a lower bound for the primary -- still worth keeping
+                    self._first_byte.append(elapsed)
+                    bot_metrics.increment(f"hedging.won_by_{target.name}")
+                    logger.info(f"Hedging: {target.model} ({target.name}) answered first, after {elapsed:.2f}s.")
+                    await self._discard((pending | done) - {task}, release)
+                    return task.result(), target
+
+            # both failed; raise the primary's error, which is what the caller would have seen without hedging
+            bot_metrics.increment("hedging.both_failed")
+            raise errors["primary"]
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    @staticmethod
+    async def _discard(tasks, release):
+        """Cancel the losing call(s) and wait for them to wind down (closing their connections)."""
+        for task in tasks:
+            task.cancel()
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        if release is not None:
+            for result in results:
+                if not isinstance(result, BaseException):
+                    await release(result)
+
+    async def aclose(self):
+        if self._own_gateway is not None:
+            await self._own_gateway.aclose()
+
+
+async def _replay(first_chunk, stream):
+    try:
+        if first_chunk is not None:
+            yield first_chunk
+        async for chunk in stream:
+            yield chunk
+    finally:
+        await stream.aclose()
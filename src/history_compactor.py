@@ -0,0 +1,216 @@
+# history_compactor.py
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# github.com/FlyingFathead/TelegramBot-OpenAI-API/
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#
+# Rolling summaries for long chats (optional; see `[Compaction]` in config.ini).
+#
+# Normally a chat's history is trimmed by dropping its oldest messages once
+# it exceeds `MaxTokens`, so every request runs right up to the cap and the
+# dropped context is simply lost. With compaction enabled, once a chat
+# crosses the high-water mark, a background task summarizes the oldest block
+# of messages with a cheaper model and swaps that block for one summary
+# message. The reply path never waits for it; if the history has changed
+# under it in the meantime (trimmed, reset, ...) the summary is discarded.
+#
+# Summary messages are tagged with `_summary` and are never summarized
+# again; once enough of them pile up, the regular trim drops the oldest.
+
+import time
+import asyncio
+import logging
+import configparser
+
+import bot_metrics
+from config_paths import CONFIG_PATH
+from modules import message_token_count, history_token_total, replace_history_block
+
+try:
+    from db_utils import DB_INITIALIZED_SUCCESSFULLY
+    import usage_counters
+except ImportError:
+    usage_counters = None
+    DB_INITIALIZED_SUCCESSFULLY = False
+
+logger = logging.getLogger('TelegramBotLogger')
+
+# Load the configuration file
+config = configparser.ConfigParser()
+config.read(CONFIG_PATH)
+
+COMPACTION_ENABLED = config.getboolean('Compaction', 'Enabled', fallback=False)
+# compact once the history reaches this share of `MaxTokens`
+HIGH_WATER_MARK = config.getfloat('Compaction', 'HighWaterMark', fallback=0.75)
+# share of the history's tokens (oldest first) to fold into one summary
+COMPACT_FRACTION = config.getfloat('Compaction', 'CompactFraction', fallback=0.5)
+# never summarize the newest N messages
+KEEP_RECENT_MESSAGES = config.getint('Compaction', 'KeepRecentMessages', fallback=6)
+# don't bother summarizing fewer messages than this
+MIN_BLOCK_MESSAGES = config.getint('Compaction', 'MinBlockMessages', fallback=4)
+SUMMARY_MAX_TOKENS = config.getint('Compaction', 'SummaryMaxTokens', fallback=600)
+# blank = the fallback model from `[ModelAutoSwitch]`
+COMPACTION_MODEL = (
+    config.get('Compaction', 'Model', fallback='').strip()
+    or config.get('ModelAutoSwitch', 'FallbackModel', fallback='gpt-4o-mini')
+)
+
+SUMMARY_KEY = '_summary'
+SUMMARY_PREFIX = "[Summary of the earlier conversation]"
+
+SUMMARIZER_INSTRUCTIONS = (
+    "You compress chat transcripts between a user and an assistant (a Telegram bot). "
+    "Write a concise summary of the transcript that keeps everything the assistant may need later: "
+    "facts about the user, their preferences, names, numbers, dates, decisions, open questions and promises made. "
+    "Leave out small talk. Write in the language the conversation is in. "
+    "Output the summary only, as plain text without any HTML or Markdown."
+)
+
+# chat_id => running compaction task (also keeps a reference so the task isn't garbage collected)
+_compaction_tasks = {}
+
+
+def is_summary(message):
+    return bool(message.get(SUMMARY_KEY))
+
+def select_block(chat_history, count_fn, encoding=None):
+    """
+    The oldest run of regular (non-summary) messages to compact, as a list of
+    the message dicts themselves; empty if there's nothing worth compacting.
+    """
+    start = 0
+    while start < len(chat_history) and is_summary(chat_history[start]):
+        start += 1
+    end_limit = len(chat_history) - KEEP_RECENT_MESSAGES
+
+    candidates = chat_history[start:end_limit]
+    total = sum(message_token_count(message, count_fn, encoding) for message in candidates)
+    budget = total * COMPACT_FRACTION
+
+    block = []
+    block_tokens = 0
+    for message in candidates:
+        if is_summary(message) or block_tokens >= budget:
+            break
+        block.append(message)
+        block_tokens += message_token_count(message, count_fn, encoding)
+
+    # don't cut between a user message and the reply to it
+    while block and block[-1].get('role') == 'user':
+        block.pop()
+
+    return block if len(block) >= MIN_BLOCK_MESSAGES else []
+
+def schedule_compaction(bot, chat_data, chat_id, model=None):
+    """
+    Start a background compaction for the chat if it has crossed the high-water
+    mark and none is running yet. Returns immediately in any case.
+    """
+    if not COMPACTION_ENABLED:
+        return None
+
+    task = _compaction_tasks.get(chat_id)
+    if task is not None and not task.done():
+        return None
+
+    # counted with the turn's model, like the trim before it (see modules.py)
+    count_fn = lambda text: bot.count_tokens(text, model)
+    encoding = bot.token_encoding(model)
+    total_tokens = history_token_total(chat_data, count_fn, encoding)
+    if total_tokens < bot.max_tokens * HIGH_WATER_MARK:
+        return None
+
+    block = select_block(chat_data['chat_history'], count_fn, encoding)
+    if not block:
+        return None
+
+    logger.info(f"Chat {chat_id}: history at {total_tokens} tokens; compacting the oldest {len(block)} messages in the background.")
+    task = asyncio.create_task(_compact(bot, chat_data, chat_id, block, count_fn, encoding))
+    _compaction_tasks[chat_id] = task
+    task.add_done_callback(lambda done: _forget_task(chat_id, done))
+    return task
+
+def _forget_task(chat_id, task):
+    if _compaction_tasks.get(chat_id) is task:
+        del _compaction_tasks[chat_id]
+
+def format_transcript(block):
+    lines = []
+    for message in block:
+        content = message.get('content')
+        if not content:
+            continue
+        lines.append(f"{message.get('role', 'unknown')}: {content}")
+    return "\n\n".join(lines)
+
+async def summarize_block(router, block):
+    payload = {
+        "model": COMPACTION_MODEL,
+        "messages": [
+            {"role": "system", "content": SUMMARIZER_INSTRUCTIONS},
+            {"role": "user", "content": format_transcript(block)},
+        ],
+        "temperature": 0.2,
+        "max_tokens": SUMMARY_MAX_TOKENS,
+    }
+    # on the backend configured for summarization (see llm_router.py)
+    response = await router.chat_completion("summarization", payload)
+    response.raise_for_status()
+    response_json = response.json()
+
+    _record_usage(response_json.get('usage') or {}, router.backend_for("summarization").billable)
+    summary = (response_json['choices'][0]['message'].get('content') or '').strip()
+    return summary
+
+def _record_usage(usage, billable=True):
+    total_tokens = usage.get('total_tokens', 0)
+    bot_metrics.increment("compaction.api_tokens", total_tokens)
+    # the summarizer runs on the fallback model, so it counts against the "mini" tier
+    # (unless it's routed to a backend that isn't billed, i.e. a local server)
+    if billable and total_tokens and DB_INITIALIZED_SUCCESSFULLY and usage_counters:
+        usage_counters.add('mini', total_tokens)
+
+def _find_block(chat_history, block):
+    """Index of `block` in `chat_history`, matched by identity; None if it's no longer there intact."""
+    first = block[0]
+    for index, message in enumerate(chat_history):
+        if message is first:
+            window = chat_history[index:index + len(block)]
+            if len(window) == len(block) and all(a is b for a, b in zip(window, block)):
+                return index
+            return None
+    return None
+
+async def _compact(bot, chat_data, chat_id, block, count_fn, encoding):
+    started = time.monotonic()
+    bot_metrics.increment("compaction.runs")
+    try:
+        summary = await summarize_block(bot.llm_router, block)
+    except Exception as e:
+        logger.error(f"Chat {chat_id}: history compaction failed: {e}")
+        bot_metrics.increment("compaction.errors")
+        return
+    finally:
+        bot_metrics.observe("compaction.latency", time.monotonic() - started)
+
+    if not summary:
+        logger.warning(f"Chat {chat_id}: the summarizer returned nothing; history left as it is.")
+        bot_metrics.increment("compaction.errors")
+        return
+
+    # the history may have been trimmed, reset or replaced while we were waiting
+    chat_history = chat_data.get('chat_history') or []
+    index = _find_block(chat_history, block)
+    if index is None:
+        logger.info(f"Chat {chat_id}: history changed during compaction; summary discarded.")
+        bot_metrics.increment("compaction.discarded")
+        return
+
+    summary_message = {"role": "system", "content": f"{SUMMARY_PREFIX}: {summary}", SUMMARY_KEY: True}
+    # swapped in place, adjusting the history's running token total
+    summary_tokens, block_tokens = replace_history_block(
+        chat_data, index, len(block), [summary_message], count_fn, encoding
+    )
+
+    bot_metrics.increment("compaction.messages_compacted", len(block))
+    bot_metrics.increment("compaction.tokens_saved", max(0, block_tokens - summary_tokens))
+    logger.info(f"Chat {chat_id}: compacted {len(block)} messages ({block_tokens} tokens) into a {summary_tokens}-token summary.")
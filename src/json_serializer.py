@@ -0,0 +1,202 @@
+# json_serializer.py
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# github.com/FlyingFathead/TelegramBot-OpenAI-API/
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#
+# Request body serialization for the OpenAI gateway.
+#
+# Every completion used to `json.dumps()` the whole payload: the full (and
+# growing) chat history plus all the tool schemas, on the event loop, for
+# every attempt. Most of that is identical to the previous request. Here:
+#
+#   - `orjson` is used when installed (several times faster), `json` otherwise
+#   - each tool schema is encoded only once
+#   - per chat (the payload's `_chat_id`), the encoded `messages` array is
+#     kept as a byte buffer; the next request only truncates it to where the
+#     messages start to differ (the volatile tail) and appends the new ones,
+#     slicing the encoding of any message it already had (e.g. the history
+#     after its oldest messages were trimmed) out of the old buffer
+#
+# The encodings are only kept here, never in the message dicts themselves:
+# those live on in the chat history.
+#
+# Keys starting with `_` (in the payload and in its messages) are
+# bot-internal and never sent. Payloads are only logged in full when
+# `LogPayloads` is on, or for a sampled fraction of requests.
+# See `[Serialization]` in config.ini.
+
+import json
+import random
+import logging
+import configparser
+from collections import OrderedDict
+
+import bot_metrics
+from config_paths import CONFIG_PATH
+
+# `orjson` is optional (`pip install orjson`); the standard library works just the same, only slower
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    orjson = None
+    ORJSON_AVAILABLE = False
+
+logger = logging.getLogger('TelegramBotLogger')
+
+# Load the configuration file
+config = configparser.ConfigParser()
+config.read(CONFIG_PATH)
+
+# how many chats' encoded histories are kept around (least recently used ones are dropped)
+PREFIX_CACHE_CHATS = config.getint('Serialization', 'PrefixCacheChats', fallback=256)
+# log every request payload in full (slow on long chats; for debugging)
+LOG_PAYLOADS = config.getboolean('Serialization', 'LogPayloads', fallback=False)
+# ...or only this fraction of them (0.0 - 1.0)
+PAYLOAD_LOG_SAMPLE_RATE = config.getfloat('Serialization', 'PayloadLogSampleRate', fallback=0.0)
+
+
+def dumps(obj):
+    """`obj` as compact JSON bytes (non-ASCII characters as-is, in UTF-8)."""
+    if ORJSON_AVAILABLE:
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            pass  # i.e. a non-string dict key, which `json` converts
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def loads(data):
+    """Parse JSON from `bytes` or `str`; raises `json.JSONDecodeError` (which `orjson`'s error is a subclass of)."""
+    if ORJSON_AVAILABLE:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def public_fields(mapping):
+    return {key: value for key, value in mapping.items() if not key.startswith('_')}
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# message and (cached) tool encodings
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def message_bytes(message):
+    return dumps(public_fields(message))
+
+# id(tool schema) => (the schema, its encoding); the schemas live as long as the bot does
+_tool_bytes = {}
+
+def tool_bytes(tool):
+    cached = _tool_bytes.get(id(tool))
+    if cached is None or cached[0] is not tool:
+        cached = (tool, dumps(tool))
+        _tool_bytes[id(tool)] = cached
+    return cached[1]
+
+def encode_tools(tools):
+    return b"[" + b",".join(tool_bytes(tool) for tool in tools) + b"]"
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# per-chat encoded `messages` prefix
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+class EncodedHistory:
+    """The encoded `messages` array of a chat's previous request, as a growable buffer."""
+
+    __slots__ = ("messages", "contents", "offsets", "buffer")
+
+    def __init__(self):
+        self.messages = []      # the message dicts, in order
+        self.contents = []      # their content at the time they were encoded
+        self.offsets = [0]      # buffer length after each message (offsets[i] = where message i starts, incl. its comma)
+        self.buffer = bytearray()
+
+    def encode(self, messages):
+        # reuse the longest run of the very same (unchanged) messages from the start...
+        common = 0
+        limit = min(len(self.messages), len(messages))
+        while (
+            common < limit
+            and self.messages[common] is messages[common]
+            and self.contents[common] is messages[common].get('content')
+        ):
+            common += 1
+
+        # ...keep the encodings of the later messages that are still there (e.g. once the
+        # oldest history was trimmed, the rest of it follows straight after the system message)...
+        wanted = {id(message) for message in messages[common:]}
+        reusable = {}
+        for i in range(common, len(self.messages)):
+            message = self.messages[i]
+            if id(message) in wanted and self.contents[i] is message.get('content'):
+                reusable[id(message)] = self._encoded(i)
+
+        # ...drop whatever came after it (typically last turn's volatile tail) and append the rest
+        del self.buffer[self.offsets[common]:]
+        del self.messages[common:]
+        del self.contents[common:]
+        del self.offsets[common + 1:]
+        for message in messages[common:]:
+            if self.messages:
+                self.buffer += b","
+            encoded = reusable.get(id(message))
+            self.buffer += encoded if encoded is not None else message_bytes(message)
+            self.messages.append(message)
+            self.contents.append(message.get('content'))
+            self.offsets.append(len(self.buffer))
+
+        bot_metrics.increment("serialization.messages_reused", common + len(reusable))
+        bot_metrics.increment("serialization.messages_appended", len(messages) - common - len(reusable))
+        return b"[" + self.buffer + b"]"
+
+    def _encoded(self, i):
+        # message i's own encoding, without the comma in front of it
+        return bytes(self.buffer[self.offsets[i] + (1 if i else 0):self.offsets[i + 1]])
+
+# chat id => EncodedHistory, least recently used first
+_histories = OrderedDict()
+
+def encode_messages(messages, chat_id=None):
+    if chat_id is None:
+        return b"[" + b",".join(message_bytes(message) for message in messages) + b"]"
+
+    history = _histories.get(chat_id)
+    if history is None:
+        history = _histories[chat_id] = EncodedHistory()
+        while len(_histories) > PREFIX_CACHE_CHATS:
+            _histories.popitem(last=False)
+    else:
+        _histories.move_to_end(chat_id)
+    return history.encode(messages)
+
+
+# ~~~~~~~~~~~~~~~~
+# request payloads
+# ~~~~~~~~~~~~~~~~
+
+def encode_payload(payload):
+    """The request body for `payload`: JSON bytes, without any `_`-prefixed keys."""
+    chat_id = payload.get('_chat_id')
+    fields = []
+    for key, value in payload.items():
+        if key.startswith('_'):
+            continue
+        if key == 'messages':
+            encoded = encode_messages(value, chat_id)
+        elif key == 'tools':
+            encoded = encode_tools(value)
+        else:
+            encoded = dumps(value)
+        fields.append(dumps(key) + b":" + encoded)
+    return b"{" + b",".join(fields) + b"}"
+
+def log_payload(log, payload, label="API Request Payload"):
+    """Log `payload` in full -- only if `LogPayloads` is on, debug logging is, or it's sampled."""
+    if not (
+        LOG_PAYLOADS
+        or log.isEnabledFor(logging.DEBUG)
+        or (PAYLOAD_LOG_SAMPLE_RATE > 0 and random.random() < PAYLOAD_LOG_SAMPLE_RATE)
+    ):
+        return
+    readable = dict(public_fields(payload), messages=[public_fields(message) for message in payload.get('messages', [])])
+    log.info(f"{label}: {readable}")
@@ -0,0 +1,180 @@
+# llm_router.py
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# github.com/FlyingFathead/TelegramBot-OpenAI-API/
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#
+# Routes the bot's side tasks to OpenAI-compatible backends.
+#
+# Not every completion needs the premium model on the OpenAI API: formatting
+# a weather report, detecting a language or summarizing old chat history
+# can just as well run on a cheap model, or on a local llama.cpp / vLLM /
+# Ollama server. Each side task belongs to a task class (see `TASK_CLASSES`),
+# and `[LLMRouter]` in config.ini maps every class to a backend. A backend
+# is a base URL, an API key (read from an environment variable; on the
+# OpenAI API itself, the bot's own key by default), an optional model that
+# replaces the caller's, and its own connection pool; each one is
+# configured in a `[Backend.<name>]` section. The built-in "default" backend
+# is the shared OpenAI gateway, with whatever model the caller asked for.
+#
+# The main chat completion always goes to the default backend with the
+# bot's own model (model auto-switching, hedging and the usage caps apply
+# there). Usage on a non-billable backend isn't counted towards the caps.
+#
+# The router is created in `TelegramBot.run`; modules without a bot
+# reference can fetch it with `get_llm_router()`. `extras/check_llm_router.py`
+# runs the routing against two local fake servers.
+
+import os
+import logging
+import configparser
+
+from config_paths import CONFIG_PATH
+from openai_gateway import OpenAIGateway, OPENAI_API_BASE_URL, get_openai_gateway
+from retry_policy import RetryPolicy
+
+logger = logging.getLogger('TelegramBotLogger')
+
+# Load the configuration file. No `[DEFAULT]` fallbacks here: a backend section
+# that doesn't set i.e. `Model` must not inherit the bot's main model.
+config = configparser.ConfigParser(default_section='__no_defaults__')
+config.read(CONFIG_PATH)
+
+DEFAULT_BACKEND = "default"
+BACKEND_SECTION_PREFIX = "Backend."
+
+# task class => its key under [LLMRouter]
+TASK_CLASSES = {
+    "formatting": "Formatting",                 # weather & directions reports
+    "language_detection": "LanguageDetection",  # Perplexity answer translation
+    "search_agent": "SearchAgent",              # the DuckDuckGo sub-agent
+    "summarization": "Summarization",           # chat history compaction
+}
+
+
+class LLMBackend:
+    """An OpenAI-compatible endpoint with its own connection pool."""
+
+    def __init__(self, name, gateway, model=None, timeout=None, billable=True):
+        self.name = name
+        self.gateway = gateway
+        self.model = model
+        self.timeout = timeout
+        self.billable = billable
+
+    def prepare(self, payload):
+        """The payload as this backend gets it: with the backend's model, if it has one."""
+        return dict(payload, model=self.model) if self.model else payload
+
+    def __repr__(self):
+        return f"LLMBackend({self.name!r}, base_url={self.gateway.base_url!r}, model={self.model!r})"
+
+
+class LLMRouter:
+    """
+    Maps task classes to backends:
+
+        response = await router.chat_completion("formatting", payload, timeout=...)
+    """
+
+    def __init__(self, default_gateway, backends=(), routes=None):
+        self.backends = {DEFAULT_BACKEND: LLMBackend(DEFAULT_BACKEND, default_gateway)}
+        for backend in backends:
+            self.backends[backend.name] = backend
+        self.routes = {}
+        for task, backend_name in (routes or {}).items():
+            if backend_name not in self.backends:
+                logger.error(f"LLM router: task '{task}' is routed to an unknown backend '{backend_name}'; using the default one.")
+                continue
+            self.routes[task] = backend_name
+
+    @classmethod
+    def from_config(cls, default_gateway, config=config):
+        backends = []
+        names = [name.strip() for name in config.get('LLMRouter', 'Backends', fallback='').split(',') if name.strip()]
+        for name in names:
+            section = f"{BACKEND_SECTION_PREFIX}{name}"
+            if not config.has_section(section):
+                logger.error(f"LLM router: backend '{name}' is listed, but there's no [{section}] section; skipped.")
+                continue
+            backends.append(_backend_from_section(name, config[section], default_gateway))
+
+        routes = {}
+        for task, key in TASK_CLASSES.items():
+            backend_name = config.get('LLMRouter', key, fallback=DEFAULT_BACKEND).strip() or DEFAULT_BACKEND
+            if backend_name != DEFAULT_BACKEND:
+                routes[task] = backend_name
+
+        router = cls(default_gateway, backends, routes)
+        for task, backend_name in router.routes.items():
+            logger.info(f"LLM router: '{task}' tasks go to {router.backends[backend_name]}")
+        return router
+
+    def backend_for(self, task):
+        if task not in TASK_CLASSES:
+            raise ValueError(f"Unknown task class: {task}")
+        return self.backends[self.routes.get(task, DEFAULT_BACKEND)]
+
+    async def chat_completion(self, task, payload, timeout=None):
+        """POST the payload to the task's backend; returns the raw `httpx.Response`."""
+        backend = self.backend_for(task)
+        if backend.timeout is not None:
+            timeout = backend.timeout
+        return await backend.gateway.chat_completion(backend.prepare(payload), timeout=timeout)
+
+    async def aclose(self):
+        for backend in self.backends.values():
+            if backend.name != DEFAULT_BACKEND:
+                await backend.gateway.aclose()
+
+
+def _backend_from_section(name, section, default_gateway=None):
+    base_url = section.get('BaseURL', fallback=OPENAI_API_BASE_URL).strip()
+    on_openai = base_url.rstrip('/') == OPENAI_API_BASE_URL
+    api_key_env = section.get('APIKeyEnv', fallback='').strip()
+    api_key = os.getenv(api_key_env) if api_key_env else None
+    if api_key_env and not api_key:
+        logger.warning(f"LLM router: backend '{name}' wants its API key from ${api_key_env}, which isn't set.")
+    if not api_key and on_openai:
+        # another model on the OpenAI API itself: use the bot's own key (None = the gateway's fallback to it)
+        api_key = default_gateway.api_key if default_gateway is not None else None
+    elif not api_key:
+        api_key = "none"  # never hand the OpenAI key to another server
+    timeout = section.getfloat('Timeout', fallback=None)
+    max_connections = section.getint('MaxConnections', fallback=None)
+
+    gateway_options = {"retry_policy": RetryPolicy(f"llm_{name}")}
+    if timeout is not None:
+        gateway_options["timeout"] = timeout
+    if max_connections is not None:
+        gateway_options["max_connections"] = max_connections
+        gateway_options["max_keepalive_connections"] = max_connections
+    gateway = OpenAIGateway(
+        api_key=api_key,
+        base_url=base_url,
+        **gateway_options,
+    )
+    return LLMBackend(
+        name,
+        gateway,
+        model=section.get('Model', fallback='').strip() or None,
+        timeout=timeout,
+        # by default, only usage on the OpenAI API itself counts towards the caps
+        billable=section.getboolean('Billable', fallback=on_openai),
+    )
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Shared (process-wide) router
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~
+_router = None
+
+def set_llm_router(router):
+    global _router
+    _router = router
+
+def get_llm_router():
+    """Return the shared router, creating one from config.ini if `TelegramBot.run` hasn't set it yet."""
+    global _router
+    if _router is None:
+        _router = LLMRouter.from_config(get_openai_gateway())
+    return _router
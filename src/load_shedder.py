@@ -0,0 +1,155 @@
+# load_shedder.py
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# github.com/FlyingFathead/TelegramBot-OpenAI-API/
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#
+# Latency-SLO-driven load shedding in front of the completion calls.
+#
+# When OpenAI slows down, every new message would otherwise start its own
+# typing task and a long-running API call (with retries on top), and the
+# coroutines pile up without bound. The shedder puts a bounded work queue
+# in front of that: at most `MaxInFlight` turns talk to the API at once and
+# at most `MaxQueued` wait for a slot. It also tracks the p95 latency of
+# recent completions; while that is over `LatencySLO`, no new work is
+# queued at all -- a message that can't start right away gets a quick
+# "busy, try again shortly" reply instead. See `[LoadShedding]` in config.ini.
+
+import time
+import asyncio
+import logging
+import configparser
+from collections import deque
+
+import bot_metrics
+from config_paths import CONFIG_PATH
+
+logger = logging.getLogger('TelegramBotLogger')
+
+# Load the configuration file
+config = configparser.ConfigParser()
+config.read(CONFIG_PATH)
+
+LOAD_SHEDDING_ENABLED = config.getboolean('LoadShedding', 'Enabled', fallback=True)
+MAX_IN_FLIGHT = config.getint('LoadShedding', 'MaxInFlight', fallback=32)
+MAX_QUEUED = config.getint('LoadShedding', 'MaxQueued', fallback=64)
+# p95 completion latency (seconds) above which new work is no longer queued
+LATENCY_SLO = config.getfloat('LoadShedding', 'LatencySLO', fallback=20.0)
+# only completions from the last N seconds count towards the p95
+LATENCY_WINDOW = config.getfloat('LoadShedding', 'LatencyWindow', fallback=120.0)
+# don't judge the p95 on fewer samples than this
+MIN_SAMPLES = config.getint('LoadShedding', 'MinSamples', fallback=10)
+
+BUSY_MESSAGE = "I'm a bit overloaded right now. Please try again shortly! 🙏"
+
+
+class LoadShed(Exception):
+    """The request was shed (queue full, or the latency SLO is exceeded)."""
+
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class LoadShedder:
+    """
+    Bounded work queue with SLO-driven shedding:
+
+        await shedder.acquire()     # raises LoadShed
+        try:
+            ...                     # completion call(s); report each with shedder.observe_latency()
+        finally:
+            shedder.release()
+    """
+
+    def __init__(
+        self,
+        max_in_flight=MAX_IN_FLIGHT,
+        max_queued=MAX_QUEUED,
+        latency_slo=LATENCY_SLO,
+        latency_window=LATENCY_WINDOW,
+        min_samples=MIN_SAMPLES,
+        enabled=LOAD_SHEDDING_ENABLED,
+    ):
+        self.enabled = enabled
+        self.max_in_flight = max_in_flight
+        self.max_queued = max_queued
+        self.latency_slo = latency_slo
+        self.latency_window = latency_window
+        self.min_samples = min_samples
+        self.in_flight = 0
+        self.queued = 0
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self._latencies = deque()  # (monotonic time, seconds)
+
+    # ~~~~~~~
+    # latency
+    # ~~~~~~~
+
+    def observe_latency(self, seconds):
+        now = time.monotonic()
+        self._latencies.append((now, seconds))
+        self._expire(now)
+
+    def _expire(self, now):
+        cutoff = now - self.latency_window
+        while self._latencies and self._latencies[0][0] < cutoff:
+            self._latencies.popleft()
+
+    def recent_p95(self):
+        """p95 of the completion latencies in the window; None if there are too few samples."""
+        self._expire(time.monotonic())
+        if len(self._latencies) < self.min_samples:
+            return None
+        ordered = sorted(latency for _, latency in self._latencies)
+        return ordered[min(len(ordered) - 1, int(round(0.95 * len(ordered))) - 1)]
+
+    # ~~~~~~~~~~~~~~
+    # the work queue
+    # ~~~~~~~~~~~~~~
+
+    def shed_reason(self):
+        """Why a new request would be shed right now, or None if it may go ahead / queue up."""
+        slot_free = self.in_flight < self.max_in_flight
+        if slot_free:
+            return None
+        if self.queued >= self.max_queued:
+            return "queue_full"
+        p95 = self.recent_p95()
+        if p95 is not None and p95 > self.latency_slo:
+            # the API is already slower than we promise; don't pile more work behind it
+            return "slo"
+        return None
+
+    async def acquire(self):
+        if not self.enabled:
+            return
+
+        reason = self.shed_reason()
+        if reason:
+            bot_metrics.increment("loadshed.shed")
+            bot_metrics.increment(f"loadshed.shed.{reason}")
+            logger.warning(f"Load shedding ({reason}): in_flight={self.in_flight}, queued={self.queued}, p95={self.recent_p95()}")
+            raise LoadShed(reason)
+
+        self.queued += 1
+        bot_metrics.set_gauge("loadshed.queue_depth", self.queued)
+        started = time.monotonic()
+        try:
+            await self._slots.acquire()
+        finally:
+            self.queued -= 1
+            bot_metrics.set_gauge("loadshed.queue_depth", self.queued)
+
+        bot_metrics.observe("loadshed.queue_wait", time.monotonic() - started)
+        self.in_flight += 1
+        bot_metrics.set_gauge("loadshed.in_flight", self.in_flight)
+        p95 = self.recent_p95()
+        if p95 is not None:
+            bot_metrics.set_gauge("loadshed.completion_p95", round(p95, 2))
+
+    def release(self):
+        if not self.enabled:
+            return
+        self.in_flight -= 1
+        bot_metrics.set_gauge("loadshed.in_flight", self.in_flight)
+        self._slots.release()
@@ -33,9 +33,6 @@ import httpx
 import asyncio
 import re
 
-# for token counting
-from transformers import GPT2Tokenizer
-
 # import reminder poller status
 from reminder_poller import reminder_poller
 
@@ -58,15 +55,26 @@ from config_paths import (
 )
 
 import db_utils
+import usage_counters
+import usage_ledger
+import user_usage
 from bot_token import get_bot_token
 from api_key import get_api_key
 import bot_commands
 import utils
-from modules import count_tokens, read_total_token_usage, write_total_token_usage
-from modules import reset_token_usage_at_midnight
-from modules import markdown_to_html, check_global_rate_limit
+from modules import count_tokens, trim_history_by_tokens
+from token_counter import encoding_name_for_model
+from modules import markdown_to_html
 from modules import log_message, rotate_log_file
 from text_message_handler import handle_message
+from openai_gateway import OpenAIGateway, set_openai_gateway
+from message_coalescer import MessageCoalescer, COALESCING_ENABLED
+from update_processor import PerChatUpdateProcessor, CONCURRENT_UPDATES_ENABLED
+from admission_control import AdmissionController
+from load_shedder import LoadShedder
+from hedged_requests import Hedger
+from response_cache import ResponseCache
+from llm_router import LLMRouter, set_llm_router
 from voice_message_handler import handle_voice_message
 from token_usage_visualization import generate_usage_chart
 
@@ -132,9 +140,6 @@ def setup_logging(chat_logging_enabled: bool):
         chat_console_handler.setFormatter(file_formatter)  # reuse the same format
         chat_logger.addHandler(chat_console_handler)
 
-# Initialize the tokenizer globally
-tokenizer = GPT2Tokenizer.from_pretrained("gpt2")
-
 class TelegramBot:
     # version of this program
     version_number = version_number
@@ -176,23 +181,26 @@ class TelegramBot:
             self.logger.error(f"Required configuration not found: {e}")
             sys.exit(1)
 
-        # Explicitly set the initial token usage to 0
-        self.total_token_usage = 0
+        # Token usage is kept in the usage ledger (see usage_ledger.py);
+        # the old token_usage.json is imported into it on the first start
         self.token_usage_file = TOKEN_USAGE_FILE_PATH
-
-        # Log the initial token count
-        self.logger.info(f"Initial token usage set to: {self.total_token_usage}")
-
-        # Now load it from file
-        self.total_token_usage = self.read_total_token_usage()
-        self.logger.info(f"Token usage after reading from file: {self.total_token_usage}")
+        usage_ledger.start(self.token_usage_file)
+        self.logger.info(f"Token usage today so far: {self.total_token_usage}")
 
         self.max_tokens_config = self.config.getint('GlobalMaxTokenUsagePerDay', 100000)
 
-        self.global_request_count = 0
-        self.rate_limit_reset_time = datetime.datetime.now()
         self.max_global_requests_per_minute = self.config.getint('MaxGlobalRequestsPerMinute', 60)
 
+        # RPM/TPM token buckets with a fair queue in front of the OpenAI API (see admission_control.py)
+        self.admission_controller = AdmissionController(
+            requests_per_minute=self.max_global_requests_per_minute,
+            owner_id=self.bot_owner_id
+        )
+        # bounded work queue in front of the completion calls, shedding load when the latency SLO is blown
+        self.load_shedder = LoadShedder()
+        # exact-match cache for repeated questions (opt-in, see response_cache.py)
+        self.response_cache = ResponseCache()
+
     def load_config(self):
         # Read entire config
         self._parser = configparser.ConfigParser()
@@ -209,6 +217,13 @@ class TelegramBot:
         self.max_retries = self.config.getint('MaxRetries', 3)
         self.retry_delay = self.config.getint('RetryDelay', 25)
 
+        # Streamed replies (progressive Telegram message edits)
+        self.stream_responses = self.config.getboolean('StreamResponses', False)
+        self.stream_edit_interval = self.config.getfloat('StreamEditInterval', 1.5)
+
+        # Per-chat merging of rapid-fire messages into one turn (`[MessageCoalescing]`)
+        self.message_coalescer = MessageCoalescer(self.handle_coalesced_message) if COALESCING_ENABLED else None
+
         default_system_msg = self.config.get(
             'SystemInstructions',
             'You are an OpenAI API-based chatbot on Telegram.'
@@ -337,26 +352,27 @@ class TelegramBot:
                 chat_console_handler.setFormatter(console_formatter) # Apply the consistent format
                 chat_logger.addHandler(chat_console_handler)
 
-    def check_global_rate_limit(self):
-        result, self.global_request_count, self.rate_limit_reset_time = check_global_rate_limit(
-            self.max_global_requests_per_minute,
-            self.global_request_count,
-            self.rate_limit_reset_time
-        )
-        return result
+    # `model`: the turn's model (see `pick_model_auto_switch`); the configured one if not given
+    def count_tokens(self, text, model=None):
+        # model-aware tiktoken encoding, loaded lazily once (see token_counter.py)
+        return count_tokens(text, model or self.model)
 
-    def count_tokens(self, text):
-        return count_tokens(text, tokenizer)
+    def token_encoding(self, model=None):
+        # the name of the tiktoken encoding `count_tokens` uses (cached token counts are tagged with it)
+        return encoding_name_for_model(model or self.model)
 
-    def read_total_token_usage(self):
-        return read_total_token_usage(self.token_usage_file)
+    # today's token usage (an in-memory read)
+    @property
+    def total_token_usage(self):
+        return usage_ledger.today_total()
 
-    def write_total_token_usage(self, usage):
-        write_total_token_usage(self.token_usage_file, usage)
+    # count tokens towards today's usage; `source` says what they were for in the ledger
+    def add_token_usage(self, tokens, source):
+        usage_ledger.record(tokens, source)
 
     def reset_total_token_usage(self):
-        self.total_token_usage = 0
-        logging.info("In-memory token usage counter reset.")
+        usage_ledger.reset_today()
+        logging.info("Today's token usage reset.")
 
     async def schedule_daily_reset(self):
         while True:
@@ -370,7 +386,8 @@ class TelegramBot:
             )
             wait_seconds = (midnight - now).total_seconds()
             await asyncio.sleep(wait_seconds)
-            reset_token_usage_at_midnight(self.token_usage_file, self.reset_total_token_usage)
+            # today's usage starts from zero by itself; drop ledger entries past their retention
+            usage_ledger.prune()
             self.logger.info("Daily token usage counter reset.")
 
     def run_asyncio_loop(self):
@@ -386,11 +403,11 @@ class TelegramBot:
             model_info=model_info
         )
 
-    def trim_chat_history(self, chat_history, max_total_tokens):
-        total_tokens = sum(self.count_tokens(msg['content']) for msg in chat_history)
-        while total_tokens > max_total_tokens and len(chat_history) > 1:
-            removed_message = chat_history.pop(0)
-            total_tokens = sum(self.count_tokens(msg['content']) for msg in chat_history)
+    def trim_chat_history(self, chat_data, max_total_tokens, model=None):
+        # token counts are cached per message and the history's total is a running total (see modules.py)
+        return trim_history_by_tokens(
+            chat_data, max_total_tokens, lambda text: self.count_tokens(text, model), self.token_encoding(model)
+        )
 
     def estimate_max_tokens(self, input_text, max_allowed_tokens):
         input_tokens = len(input_text.split())
@@ -417,16 +434,57 @@ class TelegramBot:
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     # text message handler - see: text_message_handler.py
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-    async def handle_message(self, update: Update, context: CallbackContext) -> None:
-        await handle_message(self, update, context, self.logger)
+    # `user_message_override`: the text to answer instead of the update's own (i.e. a voice message's transcription)
+    async def handle_message(self, update: Update, context: CallbackContext, user_message_override=None) -> None:
+        if self.message_coalescer is None:
+            await handle_message(self, update, context, self.logger, user_message_override=user_message_override)
+            return
+
+        # rapid-fire messages are merged per chat and answered with one completion (see message_coalescer.py)
+        text = user_message_override if user_message_override is not None else update.message.text
+        await self.message_coalescer.submit(update, context, text)
+
+    async def handle_coalesced_message(self, update: Update, context: CallbackContext, text) -> None:
+        await handle_message(self, update, context, self.logger, user_message_override=text)
 
     # ~~~~~~~~~~~~~~~~~~~~
-    # Function to handle errors
-    def error(self, update: Update, context: CallbackContext) -> None:
+    # Function to handle errors (PTB awaits error handlers, so this has to be a coroutine)
+    async def error(self, update: Update, context: CallbackContext) -> None:
         self.logger.warning('Update "%s" caused error "%s"', update, context.error)
 
+    # close the shared OpenAI connection pool on shutdown
+    async def post_shutdown(self, application: Application) -> None:
+        # coalesced turns still waiting or running are cancelled first; they need the pool
+        if self.message_coalescer is not None:
+            await self.message_coalescer.close()
+        await self.hedger.aclose()
+        await self.llm_router.aclose()
+        await self.openai_gateway.aclose()
+        # write the in-memory usage counters to the DB
+        usage_counters.close()
+        user_usage.close()
+
     def run(self):
-        application = Application.builder().token(self.telegram_bot_token).build()
+        # One long-lived, pooled OpenAI client for all API round trips
+        self.openai_gateway = OpenAIGateway(api_key=self.openai_api_key, timeout=self.timeout)
+        set_openai_gateway(self.openai_gateway)
+        # keep the admission buckets in step with OpenAI's x-ratelimit-* headers
+        self.openai_gateway.add_response_hook(self.admission_controller.observe_response)
+        # optional hedging of slow premium-model requests (see hedged_requests.py)
+        self.hedger = Hedger(self.openai_gateway)
+        # side tasks (formatting, language detection, ...) may go to other backends (see llm_router.py)
+        self.llm_router = LLMRouter.from_config(self.openai_gateway)
+        set_llm_router(self.llm_router)
+
+        builder = (
+            Application.builder()
+            .token(self.telegram_bot_token)
+            .post_shutdown(self.post_shutdown)
+        )
+        # Different chats are handled in parallel, each chat's updates strictly in order (see update_processor.py)
+        if CONCURRENT_UPDATES_ENABLED:
+            builder = builder.concurrent_updates(PerChatUpdateProcessor())
+        application = builder.build()
         application.get_updates_read_timeout = self.timeout
 
         # Store bot_instance in bot_data for access in handlers
@@ -480,6 +538,8 @@ class TelegramBot:
 
         application.add_handler(CommandHandler("usagechart", bot_commands.usage_chart_command))
         application.add_handler(CommandHandler("usage", bot_commands.usage_command))
+        application.add_handler(CommandHandler("metrics", bot_commands.metrics_command))
+        application.add_handler(CommandHandler("topusers", bot_commands.top_users_command))
 
         application.add_handler(
             CommandHandler(
@@ -530,6 +590,11 @@ class TelegramBot:
         if not db_utils.DB_INITIALIZED_SUCCESSFULLY:
             db_utils._create_tables_if_not_exist(db_utils.REMINDERS_DB_PATH)
 
+        # today's token usage: seeded from the DB, then counted in memory (see usage_counters.py)
+        usage_counters.start()
+        # ...and per user/chat/model, for the user quotas & /topusers (see user_usage.py)
+        user_usage.start()
+
         # If reminders are enabled in config, launch reminder poller
         if self.reminders_enabled:
             loop.create_task(reminder_poller(application))
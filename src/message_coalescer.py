@@ -0,0 +1,137 @@
+# message_coalescer.py
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# github.com/FlyingFathead/TelegramBot-OpenAI-API/
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#
+# Per-chat coalescing of rapid-fire user messages (see `[MessageCoalescing]`
+# in config.ini).
+#
+# People often type one thought as three or four short Telegram messages.
+# Without coalescing every one of them gets its own full completion, so we
+# pay for overlapping requests and the answers come back in a confusing
+# order. With coalescing on, incoming text is buffered per chat and handed
+# over as one user turn once the chat has been quiet for `DebounceMs`
+# (or after `MaxWaitMs` at the latest). Messages that arrive while that
+# chat's request is still running are buffered too, and answered together
+# by the next completion. Each chat has at most one request in flight.
+#
+# The merged turn is run through the application's update processor like
+# any other update, so it takes the chat's lock (and a `MaxConcurrentChats`
+# slot) and can't race `/reset` & co. over the chat history; its errors go
+# to the application's error handlers. The per-chat workers are tracked and
+# cancelled on shutdown (`close()`).
+
+import time
+import asyncio
+import logging
+import configparser
+
+import bot_metrics
+from config_paths import CONFIG_PATH
+
+logger = logging.getLogger('TelegramBotLogger')
+
+# Load the configuration file
+config = configparser.ConfigParser()
+config.read(CONFIG_PATH)
+
+COALESCING_ENABLED = config.getboolean('MessageCoalescing', 'Enabled', fallback=False)
+DEBOUNCE_MS = config.getint('MessageCoalescing', 'DebounceMs', fallback=1200)
+MAX_WAIT_MS = config.getint('MessageCoalescing', 'MaxWaitMs', fallback=4000)
+
+# what goes between the merged messages in the combined user turn
+MESSAGE_SEPARATOR = "\n"
+
+
+class _ChatBuffer:
+    def __init__(self):
+        self.messages = []          # buffered message texts, oldest first
+        self.update = None          # the latest update / context; replies go to the newest message
+        self.context = None
+        self.first_arrival = None
+        self.last_arrival = None
+        self.worker = None          # the chat's running worker task, if any
+
+
+class MessageCoalescer:
+    """
+    Buffers text per chat and calls `process(update, context, text)` with the
+    merged text, one call at a time per chat.
+    """
+
+    def __init__(self, process, debounce_ms=DEBOUNCE_MS, max_wait_ms=MAX_WAIT_MS):
+        self.process = process
+        self.debounce = debounce_ms / 1000.0
+        self.max_wait = max(max_wait_ms, debounce_ms) / 1000.0
+        self._chats = {}
+        self._workers = set()  # running worker tasks, for `close()`
+
+    async def submit(self, update, context, text):
+        """Buffer `text` for the update's chat; returns right away."""
+        chat_id = update.effective_chat.id
+        buffer = self._chats.get(chat_id)
+        if buffer is None:
+            buffer = self._chats[chat_id] = _ChatBuffer()
+
+        now = time.monotonic()
+        if not buffer.messages:
+            buffer.first_arrival = now
+        buffer.messages.append(text)
+        buffer.last_arrival = now
+        buffer.update = update
+        buffer.context = context
+        bot_metrics.increment("coalescing.messages")
+
+        if buffer.worker is None or buffer.worker.done():
+            buffer.worker = asyncio.create_task(self._run(chat_id, buffer))
+            self._workers.add(buffer.worker)
+            buffer.worker.add_done_callback(self._workers.discard)
+
+    async def close(self):
+        """Cancels the workers (and whatever they still had buffered); for shutdown."""
+        workers = list(self._workers)
+        for worker in workers:
+            worker.cancel()
+        if workers:
+            await asyncio.gather(*workers, return_exceptions=True)
+            logger.info(f"Message coalescing: cancelled {len(workers)} pending chat turn(s) on shutdown.")
+        self._chats.clear()
+
+    async def _wait_for_quiet(self, buffer):
+        # slide the window while messages keep coming, but never past `max_wait`
+        while True:
+            now = time.monotonic()
+            deadline = min(buffer.last_arrival + self.debounce, buffer.first_arrival + self.max_wait)
+            if now >= deadline:
+                return
+            await asyncio.sleep(deadline - now)
+
+    async def _run(self, chat_id, buffer):
+        try:
+            while buffer.messages:
+                await self._wait_for_quiet(buffer)
+
+                messages, update, context = buffer.messages, buffer.update, buffer.context
+                buffer.messages = []
+                waited = time.monotonic() - buffer.first_arrival
+
+                bot_metrics.increment("coalescing.turns")
+                bot_metrics.observe("coalescing.wait", waited)
+                if len(messages) > 1:
+                    bot_metrics.increment("coalescing.merged_turns")
+                    bot_metrics.increment("coalescing.api_calls_saved", len(messages) - 1)
+                    logger.info(f"Chat {chat_id}: merged {len(messages)} messages into one turn.")
+
+                # queued like any other update: under the chat's lock when updates run concurrently
+                # (see update_processor.py), one update at a time otherwise
+                try:
+                    await context.application.update_processor.process_update(
+                        update, self.process(update, context, MESSAGE_SEPARATOR.join(messages))
+                    )
+                except Exception as e:
+                    logger.error(f"Chat {chat_id}: error while handling a coalesced message: {e}", exc_info=e)
+                    await context.application.process_error(update, e)
+        finally:
+            # nothing left to do for this chat; a new message starts a new worker
+            if not buffer.messages and self._chats.get(chat_id) is buffer:
+                del self._chats[chat_id]
@@ -1,13 +1,13 @@
 # modules.py
 import os
-import json
 import asyncio
 import datetime
 import logging
-from transformers import GPT2Tokenizer
 import re
 import html
 
+import token_counter
+
 logger = logging.getLogger('TelegramBotLogger')
 
 # Logger for general bot operations
@@ -16,64 +16,91 @@ general_logger = logging.getLogger('TelegramBotLogger')
 # Logger for chat-specific operations
 chat_logger = logging.getLogger('ChatLogger')
 
-# count tokens (w/ check)
-def count_tokens(text, tokenizer):
+# count tokens (w/ check); uses the tiktoken encoding of `model` (see token_counter.py)
+def count_tokens(text, model=None):
     if text is None:
         return 0
-    token_count = len(tokenizer.encode(text))
+    token_count = token_counter.count_tokens(text, model)
     general_logger.debug(f"Counting tokens for text: '{text[:30]}...' Results in token count: {token_count}")
     return token_count
 
-# read total token usage
-def read_total_token_usage(token_usage_file):
-    try:
-        with open(token_usage_file, 'r') as file:
-            data = json.load(file)
-        current_date = datetime.datetime.utcnow().strftime('%Y-%m-%d')
-        
-        # If the current date is not in data, reset the token count
-        if current_date not in data:
-            data[current_date] = 0
-
-        # Return the usage for the current date
-        return data[current_date]
-    except (FileNotFoundError, json.JSONDecodeError):
-        # If the file doesn't exist or is invalid, return 0 and reset the count
-        return 0
-
-# write latest token count data
-def write_total_token_usage(token_usage_file, usage):
-    try:
-        with open(token_usage_file, 'r') as file:
-            data = json.load(file)
-    except (FileNotFoundError, json.JSONDecodeError):
-        data = {}  # Initialize a new dictionary if the file doesn't exist or is invalid
-
-    current_date = datetime.datetime.utcnow().strftime('%Y-%m-%d')
-    data[current_date] = usage  # Update the current date's usage
-
-    with open(token_usage_file, 'w') as file:
-        json.dump(data, file)
-
-# reset token count at midnight
-def reset_token_usage_at_midnight(token_usage_file, reset_in_memory_counter_callback=None):
-    try:
-        current_date = datetime.datetime.utcnow().strftime('%Y-%m-%d')
-        if os.path.exists(token_usage_file):
-            with open(token_usage_file, 'r+') as file:
-                data = json.load(file)
-                data[current_date] = 0  # Reset the token usage for the current date
-                file.seek(0)
-                json.dump(data, file)
-                file.truncate()
-            logging.info(f"Token usage reset for {current_date}.")
-            if reset_in_memory_counter_callback:
-                reset_in_memory_counter_callback()  # Reset the in-memory counter if callback is provided
-        else:
-            logging.error("Token usage file does not exist. No reset performed.")
-    except Exception as e:
-        logging.error(f"Failed to reset token usage: {e}")
-
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# cached per-message token counts
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Each chat history entry caches its own token count under `_tokens`, as
+# `(encoding, count)`, so a message is only tokenized once per tiktoken
+# encoding instead of on every trim (and is counted again after a switch to
+# a model with another encoding). Keys starting with `_` are bot-internal;
+# the OpenAI gateway strips them before sending.
+#
+# The history's total is kept as a running total in `chat_data` (under
+# `history_tokens`): messages appended since the last look are counted
+# once, trimming and compaction adjust it, so getting the total is O(1)
+# amortized instead of a sum over the whole history.
+TOKEN_COUNT_KEY = '_tokens'
+HISTORY_TOKENS_KEY = 'history_tokens'
+
+def message_token_count(message, count_fn, encoding=None):
+    cached = message.get(TOKEN_COUNT_KEY)
+    if isinstance(cached, tuple) and cached[0] == encoding:
+        return cached[1]
+    content = message.get('content') or ''  # None for i.e. assistant tool call turns
+    count = count_fn(content if isinstance(content, str) else str(content))
+    message[TOKEN_COUNT_KEY] = (encoding, count)
+    return count
+
+def _history_token_state(chat_data, count_fn, encoding=None):
+    chat_history = chat_data.setdefault('chat_history', [])
+    state = chat_data.get(HISTORY_TOKENS_KEY)
+    # start over if the history was replaced (/reset, session timeout, ...) or shrunk behind our
+    # back, or the model's encoding changed
+    if (
+        state is None
+        or state['history'] is not chat_history
+        or state['encoding'] != encoding
+        or state['counted'] > len(chat_history)
+    ):
+        state = {'history': chat_history, 'encoding': encoding, 'counted': 0, 'total': 0}
+        chat_data[HISTORY_TOKENS_KEY] = state
+    # count what's been appended since
+    for index in range(state['counted'], len(chat_history)):
+        state['total'] += message_token_count(chat_history[index], count_fn, encoding)
+    state['counted'] = len(chat_history)
+    return state
+
+def history_token_total(chat_data, count_fn, encoding=None):
+    """Total tokens in `chat_data['chat_history']` (a running total, see above)."""
+    return _history_token_state(chat_data, count_fn, encoding)['total']
+
+def replace_history_block(chat_data, index, length, new_messages, count_fn, encoding=None):
+    """Replaces `length` messages of the history at `index` with `new_messages`, keeping the running total."""
+    state = _history_token_state(chat_data, count_fn, encoding)
+    chat_history = state['history']
+    removed = sum(message_token_count(message, count_fn, encoding) for message in chat_history[index:index + length])
+    added = sum(message_token_count(message, count_fn, encoding) for message in new_messages)
+    chat_history[index:index + length] = new_messages
+    state['total'] += added - removed
+    state['counted'] = len(chat_history)
+    return added, removed
+
+# trim the oldest messages until the history fits in `max_total_tokens` (in place)
+def trim_history_by_tokens(chat_data, max_total_tokens, count_fn, encoding=None):
+    state = _history_token_state(chat_data, count_fn, encoding)
+    chat_history = state['history']
+    total_tokens = state['total']
+
+    # subtract the oldest messages' (cached) counts until we're under the limit
+    drop = 0
+    while total_tokens > max_total_tokens and len(chat_history) - drop > 1:
+        total_tokens -= message_token_count(chat_history[drop], count_fn, encoding)
+        drop += 1
+
+    if drop:
+        del chat_history[:drop]
+        state['total'] = total_tokens
+        state['counted'] = len(chat_history)
+        general_logger.debug(f"Trimmed {drop} message(s) from chat history; {total_tokens} tokens remain.")
+    return total_tokens
 
 def escape_html(text):
     # Escape only the necessary HTML characters, avoiding double-escaping
@@ -223,27 +250,6 @@ def markdown_to_html(text):
 #     except Exception as e:
 #         return str(e)
 
-# Check and update the global rate limit.
-def check_global_rate_limit(max_requests_per_minute, global_request_count, rate_limit_reset_time):
-    # Bypass rate limit check if max_requests_per_minute is set to 0
-    if max_requests_per_minute == 0:
-        return False, global_request_count, rate_limit_reset_time
-
-    current_time = datetime.datetime.now()
-
-    # Reset the rate limit counter if a minute has passed
-    if current_time >= rate_limit_reset_time:
-        global_request_count = 0
-        rate_limit_reset_time = current_time + datetime.timedelta(minutes=1)
-
-    # Check if the global request count exceeds the limit
-    if global_request_count >= max_requests_per_minute:
-        return True, global_request_count, rate_limit_reset_time  # Rate limit exceeded
-
-    # Increment the request count as the rate limit has not been exceeded
-    global_request_count += 1
-    return False, global_request_count, rate_limit_reset_time
-
 # msg logging
 # Logging functionalities
 def log_message(
@@ -0,0 +1,241 @@
+# openai_gateway.py
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# github.com/FlyingFathead/TelegramBot-OpenAI-API/
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#
+# A single, long-lived gateway for all OpenAI API round trips.
+#
+# Every call site used to open its own `httpx.AsyncClient`, which meant a
+# fresh TCP+TLS handshake (and a fresh ephemeral port) per request. The
+# gateway keeps one pooled client with keep-alive (and HTTP/2 if the `h2`
+# package is installed), and is the one place where pool limits and
+# timeouts are configured. See `[OpenAIGateway]` in `config.ini`.
+#
+# The gateway is created in `TelegramBot.run` and registered with
+# `set_openai_gateway()`; modules without a bot reference can fetch it
+# with `get_openai_gateway()`.
+#
+# Every request goes through the gateway's `RetryPolicy` (backoff with
+# jitter, `Retry-After`, circuit breaker; see retry_policy.py), so call
+# sites don't need retry loops of their own.
+
+import json
+import logging
+import configparser
+
+import httpx
+import openai
+
+from config_paths import CONFIG_PATH
+from retry_policy import RetryPolicy
+from json_serializer import encode_payload, loads
+
+logger = logging.getLogger('TelegramBotLogger')
+
+# Load the configuration file
+config = configparser.ConfigParser()
+config.read(CONFIG_PATH)
+
+OPENAI_API_BASE_URL = "https://api.openai.com/v1"
+CHAT_COMPLETIONS_PATH = "/chat/completions"
+TRANSCRIPTIONS_PATH = "/audio/transcriptions"
+# any OpenAI-compatible endpoint (a proxy, Azure-style gateway, local server, ...)
+BASE_URL = config.get('OpenAIGateway', 'BaseURL', fallback='').strip() or OPENAI_API_BASE_URL
+
+# Pool & timeout settings (see `[OpenAIGateway]` in config.ini)
+DEFAULT_TIMEOUT = config.getfloat('DEFAULT', 'Timeout', fallback=60.0)
+CONNECT_TIMEOUT = config.getfloat('OpenAIGateway', 'ConnectTimeout', fallback=10.0)
+MAX_CONNECTIONS = config.getint('OpenAIGateway', 'MaxConnections', fallback=20)
+MAX_KEEPALIVE_CONNECTIONS = config.getint('OpenAIGateway', 'MaxKeepaliveConnections', fallback=10)
+KEEPALIVE_EXPIRY = config.getfloat('OpenAIGateway', 'KeepaliveExpiry', fallback=30.0)
+CONNECT_RETRIES = config.getint('OpenAIGateway', 'ConnectRetries', fallback=2)
+HTTP2_ENABLED = config.getboolean('OpenAIGateway', 'HTTP2', fallback=True)
+
+# HTTP/2 support in httpx needs the optional `h2` package (`pip install httpx[http2]`)
+try:
+    import h2  # noqa: F401
+    H2_AVAILABLE = True
+except ImportError:
+    H2_AVAILABLE = False
+
+
+class OpenAIGateway:
+    """
+    Pooled, keep-alive HTTP client for the OpenAI API.
+
+    The underlying `httpx.AsyncClient` is created lazily on first use, so the
+    gateway can be constructed before the event loop is running.
+    """
+
+    def __init__(
+        self,
+        api_key=None,
+        base_url=BASE_URL,
+        timeout=DEFAULT_TIMEOUT,
+        connect_timeout=CONNECT_TIMEOUT,
+        max_connections=MAX_CONNECTIONS,
+        max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=KEEPALIVE_EXPIRY,
+        connect_retries=CONNECT_RETRIES,
+        http2=HTTP2_ENABLED,
+        retry_policy=None,
+    ):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip('/')
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.connect_retries = connect_retries
+
+        if http2 and not H2_AVAILABLE:
+            logger.warning("HTTP/2 requested for the OpenAI gateway, but the 'h2' package is not installed. Using HTTP/1.1.")
+            http2 = False
+        self.http2 = http2
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy("openai")
+
+        self._client = None
+        self._response_hooks = []
+
+    def add_response_hook(self, hook):
+        """Call `hook(response)` for every API response (streamed or not), i.e. to read rate limit headers."""
+        self._response_hooks.append(hook)
+
+    async def _run_response_hooks(self, response):
+        for hook in self._response_hooks:
+            try:
+                hook(response)
+            except Exception as e:
+                logger.error(f"OpenAI gateway response hook failed: {e}")
+
+    @property
+    def client(self):
+        """The shared `httpx.AsyncClient` (created on first access)."""
+        if self._client is None or self._client.is_closed:
+            # `retries` on the transport only covers connection failures (connect errors/timeouts);
+            # it never re-sends a request the server has already seen.
+            transport = httpx.AsyncHTTPTransport(
+                retries=self.connect_retries,
+                http2=self.http2,
+                limits=self.limits,
+            )
+            self._client = httpx.AsyncClient(
+                transport=transport,
+                timeout=self.timeout,
+                event_hooks={"response": [self._run_response_hooks]},
+            )
+            logger.info(
+                f"OpenAI gateway client created: base_url={self.base_url}, http2={self.http2}, "
+                f"max_connections={self.limits.max_connections}, "
+                f"max_keepalive={self.limits.max_keepalive_connections}"
+            )
+        return self._client
+
+    def _api_key(self):
+        # Fall back to the module-level key set in `TelegramBot.__init__`
+        return self.api_key or openai.api_key
+
+    def _headers(self):
+        return {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {self._api_key()}",
+        }
+
+    def _build_request(self, path, payload, timeout=None):
+        return self.client.build_request(
+            "POST",
+            f"{self.base_url}{path}",
+            # bot-internal `_` keys (i.e. the cached `_tokens` count) are left out; the API rejects unknown fields
+            content=encode_payload(payload),
+            headers=self._headers(),
+            timeout=timeout if timeout is not None else httpx.USE_CLIENT_DEFAULT,
+        )
+
+    async def post(self, path, payload, timeout=None):
+        """
+        POST a JSON payload to `base_url + path` (retried per the retry policy)
+        and return the raw `httpx.Response` of the last attempt.
+        """
+        return await self.retry_policy.run(
+            lambda: self.client.send(self._build_request(path, payload, timeout))
+        )
+
+    async def chat_completion(self, payload, timeout=None):
+        """POST to `/chat/completions` and return the raw `httpx.Response`."""
+        return await self.post(CHAT_COMPLETIONS_PATH, payload, timeout=timeout)
+
+    async def transcribe(self, audio, filename, model="whisper-1", timeout=None):
+        """
+        POST `audio` (bytes) to `/audio/transcriptions` as a multipart upload and
+        return the raw `httpx.Response` (JSON with a `text` field on success).
+        """
+        def send():
+            request = self.client.build_request(
+                "POST",
+                f"{self.base_url}{TRANSCRIPTIONS_PATH}",
+                files={"file": (filename, audio)},
+                data={"model": model, "response_format": "json"},
+                headers={"Authorization": f"Bearer {self._api_key()}"},
+                timeout=timeout if timeout is not None else httpx.USE_CLIENT_DEFAULT,
+            )
+            return self.client.send(request)
+        return await self.retry_policy.run(send)
+
+    async def stream_chat_completion(self, payload, timeout=None):
+        """
+        POST a `stream: true` request to `/chat/completions` and yield each
+        server-sent event chunk as a parsed dict, until `data: [DONE]`.
+        Raises `httpx.HTTPStatusError` on a non-2xx response.
+
+        Retries only happen before the first chunk; once the reply has started
+        coming in, an error mid-stream is raised to the caller.
+        """
+        payload = dict(payload, stream=True)
+        payload.setdefault("stream_options", {"include_usage": True})
+
+        response = await self.retry_policy.run(
+            lambda: self.client.send(self._build_request(CHAT_COMPLETIONS_PATH, payload, timeout), stream=True)
+        )
+        try:
+            if response.status_code >= 400:
+                await response.aread()
+                response.raise_for_status()
+
+            async for line in response.aiter_lines():
+                line = line.strip()
+                if not line or not line.startswith("data:"):
+                    continue  # blank keep-alive lines, SSE comments, `event:` fields
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                try:
+                    yield loads(data)
+                except json.JSONDecodeError:
+                    logger.warning(f"Skipping malformed stream chunk: {data[:200]}")
+        finally:
+            await response.aclose()
+
+    async def aclose(self):
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+            logger.info("OpenAI gateway client closed.")
+        self._client = None
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Shared (process-wide) gateway
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+_gateway = None
+
+def set_openai_gateway(gateway):
+    global _gateway
+    _gateway = gateway
+
+def get_openai_gateway():
+    """Return the shared gateway, creating a default one if `TelegramBot.run` hasn't set it yet."""
+    global _gateway
+    if _gateway is None:
+        _gateway = OpenAIGateway()
+    return _gateway
@@ -48,13 +48,13 @@
 #         return True
 
 #     # Flag for translation in progress
-#     context.user_data['active_translation'] = True
+#     context.chat_data['active_translation'] = True
 
 #     # Translate or process the response as necessary
 #     bot_reply_formatted = await translate_response_chunked(bot, user_message, perplexity_response, context, update)
 
 #     # After translation or processing is completed, clear the active translation flag
-#     context.user_data.pop('active_translation', None)
+#     context.chat_data.pop('active_translation', None)
 
 #     if isinstance(bot_reply_formatted, bool) and bot_reply_formatted:  # Check if translation function returned successfully
 #         return True  # Ensure function exits after handling success
@@ -0,0 +1,97 @@
+# prompt_assembler.py
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# github.com/FlyingFathead/TelegramBot-OpenAI-API/
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#
+# Builds the `messages` list for a chat completion in a cache-friendly order.
+#
+# OpenAI caches prompts by their longest common prefix (in 128-token steps,
+# from 1024 tokens up), so anything that changes on every request has to
+# come *after* everything that doesn't:
+#
+#   1. the static system instructions  (tool schemas are sent separately,
+#      but are equally static and are cached as part of the same prefix)
+#   2. the chat history, which only grows at the end (until it is trimmed)
+#   3. the per-turn "volatile" context: timestamp, holiday note, YouTube
+#      context, Elasticsearch RAG data
+#
+# The volatile messages are never stored in the persistent chat history.
+# Cached-token hit rates (`usage.prompt_tokens_details.cached_tokens`) are
+# recorded into `bot_metrics` together with the completion latency of
+# cache hits vs. misses; see `/metrics openai.`.
+
+import logging
+
+import bot_metrics
+
+logger = logging.getLogger('TelegramBotLogger')
+
+
+def system_message(content):
+    return {"role": "system", "content": content}
+
+# (instructions, message) of the last static system message; reusing the very same
+# dict lets the serializer reuse its encoding (see json_serializer.py)
+_static_system_message = (None, None)
+
+def static_system_message(system_instructions):
+    global _static_system_message
+    instructions, message = _static_system_message
+    if message is None or instructions != system_instructions:
+        message = system_message(f"Instructions: {system_instructions}")
+        _static_system_message = (system_instructions, message)
+    return message
+
+def assemble_messages(system_instructions, chat_history, volatile_messages=()):
+    """
+    `[static system message] + chat_history + volatile_messages`, as a new list;
+    `chat_history` itself is not modified.
+    """
+    messages = [static_system_message(system_instructions)]
+    messages.extend(chat_history)
+    messages.extend(volatile_messages)
+    return messages
+
+async def collect_action_messages(function, context, update):
+    """
+    Run an Elasticsearch action token function (see `elasticsearch_functions.py`)
+    and return only the messages it adds.
+
+    Those functions take a message list and return it with their own messages
+    added; given an empty list, what comes back is just the additions, which
+    then go to the volatile tail instead of in front of the history.
+    """
+    added = await function(context, update, [])
+    return list(added or [])
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~
+# prompt cache reporting
+# ~~~~~~~~~~~~~~~~~~~~~~
+
+def record_prompt_cache_usage(usage, elapsed=None):
+    """
+    Record prompt/cached token counts from a completion's `usage` object and,
+    if given, the request's latency split by cache hit / miss.
+    Returns the number of cached prompt tokens.
+    """
+    prompt_tokens = usage.get("prompt_tokens") or 0
+    details = usage.get("prompt_tokens_details") or {}
+    cached_tokens = details.get("cached_tokens") or 0
+
+    bot_metrics.increment("openai.prompt_tokens", prompt_tokens)
+    bot_metrics.increment("openai.prompt_cached_tokens", cached_tokens)
+    bot_metrics.increment("openai.prompt_requests")
+    if cached_tokens:
+        bot_metrics.increment("openai.prompt_cache_hits")
+    if elapsed is not None:
+        bot_metrics.observe("openai.completion_latency." + ("cache_hit" if cached_tokens else "cache_miss"), elapsed)
+
+    total_prompt = bot_metrics.get_counter("openai.prompt_tokens")
+    if total_prompt:
+        total_cached = bot_metrics.get_counter("openai.prompt_cached_tokens")
+        bot_metrics.set_gauge("openai.prompt_cache_hit_rate", f"{total_cached / total_prompt:.1%}")
+
+    if prompt_tokens:
+        logger.info(f"Prompt cache: {cached_tokens}/{prompt_tokens} prompt tokens cached ({cached_tokens / prompt_tokens:.0%}).")
+    return cached_tokens
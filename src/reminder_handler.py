@@ -5,7 +5,7 @@ import configparser
 from datetime import datetime, timezone
 from config_paths import CONFIG_PATH, REMINDERS_DB_PATH
 import db_utils
-from db_utils import get_past_reminders_for_user
+import async_db
 
 # Load config to get MaxAlertsPerUser
 config = configparser.ConfigParser()
@@ -48,18 +48,14 @@ async def handle_add_reminder(user_id, chat_id, reminder_text, due_time_utc_str)
             "or convert user-friendly times to UTC first."
         )
 
-    # 3) Check user's current reminder count
-    current_count = db_utils.count_pending_reminders_for_user(REMINDERS_DB_PATH, user_id)
-
-    # Only enforce the limit if it's > 0
-    if MAX_ALERTS_PER_USER > 0 and current_count >= MAX_ALERTS_PER_USER:
+    # 3) Add to DB, unless the user is at the limit (checked in the same transaction; only if it's > 0)
+    reminder_id, current_count = await async_db.add_reminder_within_limit(
+        REMINDERS_DB_PATH, user_id, chat_id, reminder_text, due_time_utc_str, MAX_ALERTS_PER_USER
+    )
+    if reminder_id is None and current_count is not None:
         logger.info(f"User {user_id} has {current_count} reminders; reached max of {MAX_ALERTS_PER_USER}.")
         return f"You already have {current_count} pending reminders. The maximum is {MAX_ALERTS_PER_USER}."
 
-    # 4) Add to DB
-    reminder_id = db_utils.add_reminder_to_db(
-        REMINDERS_DB_PATH, user_id, chat_id, reminder_text, due_time_utc_str
-    )
     if reminder_id:
         logger.info(
             f"User {user_id} created reminder #{reminder_id}: "
@@ -84,7 +80,7 @@ async def handle_view_reminders(user_id):
         return "Error: DB not available. Cannot view reminders."
 
     # 1) Get the pending
-    pending_reminders = db_utils.get_pending_reminders_for_user(REMINDERS_DB_PATH, user_id)
+    pending_reminders = await async_db.get_pending_reminders_for_user(REMINDERS_DB_PATH, user_id)
     if pending_reminders:
         lines = ["<b>Your current (pending) reminders:</b>"]
         for idx, r in enumerate(pending_reminders, start=1):
@@ -98,7 +94,7 @@ async def handle_view_reminders(user_id):
 
     # 2) Optionally get the past ones
     if SHOW_PAST_REMINDERS_COUNT > 0:
-        past = get_past_reminders_for_user(REMINDERS_DB_PATH, user_id, SHOW_PAST_REMINDERS_COUNT)
+        past = await async_db.get_past_reminders_for_user(REMINDERS_DB_PATH, user_id, SHOW_PAST_REMINDERS_COUNT)
         if past:
             lines = [f"<b>Up to {SHOW_PAST_REMINDERS_COUNT} most recent past reminders:</b>"]
             for idx, r in enumerate(past, start=1):
@@ -142,7 +138,7 @@ async def handle_delete_reminder(user_id, reminder_id):
         logger.error("Attempt to delete reminder but DB not available!")
         return "Error: DB not available. Cannot delete reminders."
 
-    success = db_utils.delete_reminder_from_db(REMINDERS_DB_PATH, reminder_id, user_id)
+    success = await async_db.delete_reminder_from_db(REMINDERS_DB_PATH, reminder_id, user_id)
     if success:
         logger.info(f"User {user_id} deleted reminder #{reminder_id}.")
         return f"Reminder #{reminder_id} has been deleted."
@@ -167,7 +163,7 @@ async def handle_edit_reminder(user_id, reminder_id, new_due_time_utc=None, new_
         return "Error: DB not available. Cannot edit reminders."
 
     # 1) Fetch existing to ensure user owns it
-    reminder = db_utils.get_reminder_by_id(REMINDERS_DB_PATH, reminder_id)
+    reminder = await async_db.get_reminder_by_id(REMINDERS_DB_PATH, reminder_id)
     if not reminder:
         logger.warning(f"User {user_id} tried to edit reminder #{reminder_id} which doesn't exist.")
         return f"No such reminder #{reminder_id} found."
@@ -192,7 +188,7 @@ async def handle_edit_reminder(user_id, reminder_id, new_due_time_utc=None, new_
         new_text = reminder['reminder_text']
 
     # 4) Update in DB
-    updated_ok = db_utils.update_reminder(REMINDERS_DB_PATH, reminder_id, new_due_time_utc, new_text)
+    updated_ok = await async_db.update_reminder(REMINDERS_DB_PATH, reminder_id, new_due_time_utc, new_text)
     if updated_ok:
         logger.info(
             f"User {user_id} edited reminder #{reminder_id} -> new time: "
@@ -8,6 +8,7 @@ from datetime import datetime, timezone # Import timezone
 # --- Corrected Imports ---
 from config_paths import CONFIG_PATH, REMINDERS_DB_PATH
 import db_utils
+import async_db
 from telegram.ext import Application
 from telegram.error import Forbidden, BadRequest
 from telegram.constants import ParseMode
@@ -72,10 +73,18 @@ async def reminder_poller(application: Application):
             now_utc_str = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
 
             # --- Fetch due reminders using the correct DB path and time ---
-            due_reminders = db_utils.get_due_reminders(REMINDERS_DB_PATH, now_utc_str)
+            due_reminders = await async_db.get_due_reminders(REMINDERS_DB_PATH, now_utc_str)
 
             if due_reminders:
                 logger.info(f"Found {len(due_reminders)} due reminders.")
+                # status updates are queued as they come and committed together (see async_db.py)
+                status_updates = []
+
+                def mark(reminder_id, status):
+                    status_updates.append(asyncio.ensure_future(
+                        async_db.update_reminder_status(REMINDERS_DB_PATH, reminder_id, status)
+                    ))
+
                 for r in due_reminders:
                     reminder_id = r['reminder_id']
                     user_id = r['user_id']
@@ -98,21 +107,24 @@ async def reminder_poller(application: Application):
                             )
 
                         # 3) Mark the reminder as sent
-                        db_utils.update_reminder_status(REMINDERS_DB_PATH, reminder_id, 'sent')
+                        mark(reminder_id, 'sent')
                         logger.info(f"Sent reminder {reminder_id} to chat {chat_id} for user {user_id}.")
 
                     # --- Specific Error Handling ---
                     except Forbidden:
                         logger.warning(f"Failed sending reminder {reminder_id} to chat {chat_id}. Bot forbidden (blocked?).")
-                        db_utils.update_reminder_status(REMINDERS_DB_PATH, reminder_id, 'failed_forbidden')
+                        mark(reminder_id, 'failed_forbidden')
                     except BadRequest as e:
                         logger.error(f"Failed sending reminder {reminder_id} to chat {chat_id}. Bad request (chat not found?): {e}")
-                        db_utils.update_reminder_status(REMINDERS_DB_PATH, reminder_id, 'failed_bad_request')
+                        mark(reminder_id, 'failed_bad_request')
                     except Exception as e:
                         logger.error(f"Unexpected error sending reminder {reminder_id} to chat {chat_id}: {e}")
                         # Decide: update status to 'failed_unknown' or leave 'pending' to retry?
                         # Let's mark as failed for now to avoid potential spamming if the error persists.
-                        db_utils.update_reminder_status(REMINDERS_DB_PATH, reminder_id, 'failed_unknown')
+                        mark(reminder_id, 'failed_unknown')
+
+                # make sure they're in before the next poll looks for due reminders again
+                await asyncio.gather(*status_updates)
             else:
                 logger.debug("No reminders due.")
 
@@ -0,0 +1,181 @@
+# response_cache.py
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# github.com/FlyingFathead/TelegramBot-OpenAI-API/
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#
+# Exact-match cache for the bot's replies (opt-in).
+#
+# A lot of traffic is exact repeats: the same FAQ question pulling in the
+# same Elasticsearch RAG context, or the same greeting at the start of a
+# chat. With the cache on, such a turn gets the stored reply instead of a
+# new completion. The key is a hash of the model, the (whitespace-normalized)
+# system prompt, the last `HistoryMessages` messages of the chat -- the
+# user's message, earlier replies and tool results -- and the per-turn
+# context (RAG data, holiday notes; not the timestamp).
+#
+# Entries expire after `TTLSeconds`, and the least recently used ones are
+# evicted once the cache grows over `MaxSizeMB`. The cache is bypassed when
+# the temperature is over `MaxTemperature` (the replies aren't meant to be
+# repeatable then), and a reply that used a live-data tool (weather, stock
+# prices, search, ...) is never stored. Hits, misses and the cache size are
+# recorded as `response_cache.*` metrics (see `/metrics`).
+# See `[ResponseCache]` in config.ini.
+
+import re
+import time
+import json
+import hashlib
+import logging
+import configparser
+from collections import OrderedDict
+
+import bot_metrics
+from config_paths import CONFIG_PATH
+
+logger = logging.getLogger('TelegramBotLogger')
+
+# Load the configuration file
+config = configparser.ConfigParser()
+config.read(CONFIG_PATH)
+
+RESPONSE_CACHE_ENABLED = config.getboolean('ResponseCache', 'Enabled', fallback=False)
+TTL_SECONDS = config.getfloat('ResponseCache', 'TTLSeconds', fallback=3600.0)
+MAX_SIZE_MB = config.getfloat('ResponseCache', 'MaxSizeMB', fallback=16.0)
+# how many of the latest chat messages (the user's message included) go into the key
+HISTORY_MESSAGES = config.getint('ResponseCache', 'HistoryMessages', fallback=3)
+# no caching above this temperature
+MAX_TEMPERATURE = config.getfloat('ResponseCache', 'MaxTemperature', fallback=0.3)
+# "chat": a reply is only served within the same chat; "global": also to other chats with the same
+# context, as long as the whole chat so far is in the key (i.e. at the start of a chat)
+CACHE_SCOPE = config.get('ResponseCache', 'Scope', fallback='chat').strip().lower()
+# replies that used any of these tools are never cached (their data goes stale)
+LIVE_DATA_TOOLS = frozenset(
+    name.strip() for name in config.get(
+        'ResponseCache', 'LiveDataTools',
+        fallback='get_weather, get_duckduckgo_search, get_website_dump, get_directions_from_addresses, '
+                 'get_stock_price, query_perplexity, manage_reminder'
+    ).split(',') if name.strip()
+)
+
+# rough per-entry bookkeeping overhead (key, timestamps, dict slots), in bytes
+ENTRY_OVERHEAD = 200
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text):
+    return _WHITESPACE.sub(" ", text or "").strip()
+
+
+class ResponseCache:
+    """
+    LRU + TTL cache of replies, bounded by size:
+
+        key = cache.key_for(model, temperature, system_prompt, chat_history, context_messages, chat_id)
+        cached = cache.get(key)             # a response dict, or None
+        ...
+        cache.put(key, reply, tools_used)
+    """
+
+    def __init__(
+        self,
+        ttl=TTL_SECONDS,
+        max_size_mb=MAX_SIZE_MB,
+        history_messages=HISTORY_MESSAGES,
+        max_temperature=MAX_TEMPERATURE,
+        scope=CACHE_SCOPE,
+        live_data_tools=LIVE_DATA_TOOLS,
+        enabled=RESPONSE_CACHE_ENABLED,
+    ):
+        self.enabled = enabled
+        self.ttl = ttl
+        self.max_bytes = int(max_size_mb * 1024 * 1024)
+        self.history_messages = max(1, history_messages)
+        self.max_temperature = max_temperature
+        self.scope = scope
+        self.live_data_tools = live_data_tools
+        self.size = 0
+        self._entries = OrderedDict()  # key => (expires_at, model, reply, size)
+
+    def key_for(self, model, temperature, system_prompt, chat_history, context_messages=(), chat_id=None):
+        """The cache key for a turn, or None if this turn shouldn't use the cache at all."""
+        if not self.enabled:
+            return None
+        if temperature > self.max_temperature:
+            bot_metrics.increment("response_cache.bypassed")
+            return None
+
+        recent = chat_history[-self.history_messages:]
+        material = {
+            "model": model,
+            "system": normalize_text(system_prompt),
+            # the user's wording is matched case- and whitespace-insensitively
+            "history": [
+                [message.get("role"), normalize_text(message.get("content")).casefold() if message.get("role") == "user"
+                 else normalize_text(message.get("content"))]
+                for message in recent
+            ],
+            "context": [normalize_text(message.get("content")) for message in context_messages],
+        }
+        # the reply was written with the whole chat in view, not just the messages in the key: it's
+        # only shared between chats (with the "global" scope) when there's no earlier history
+        if self.scope == "chat" or len(chat_history) > self.history_messages:
+            material["chat_id"] = chat_id
+        encoded = json.dumps(material, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        return hashlib.sha256(encoded).hexdigest()
+
+    def get(self, key):
+        """A chat-completion-shaped response for a cached reply (no usage charged), or None."""
+        if key is None:
+            return None
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] < time.monotonic():
+            self._remove(key)
+            bot_metrics.increment("response_cache.expired")
+            entry = None
+        if entry is None:
+            bot_metrics.increment("response_cache.misses")
+            return None
+
+        self._entries.move_to_end(key)
+        bot_metrics.increment("response_cache.hits")
+        _, model, reply, _ = entry
+        logger.info(f"Response cache: hit ({len(reply)} chars, originally from {model}).")
+        return {
+            "choices": [{"message": {"role": "assistant", "content": reply}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+            "_served_by": {"model": "response cache", "billable": False},
+        }
+
+    def put(self, key, reply, model, tools_used=()):
+        if key is None or not reply:
+            return
+        live_tools = self.live_data_tools.intersection(tools_used)
+        if live_tools:
+            bot_metrics.increment("response_cache.not_stored_live_data")
+            logger.info(f"Response cache: not storing a reply that used live data ({', '.join(sorted(live_tools))}).")
+            return
+
+        size = len(reply.encode("utf-8")) + len(key) + ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (time.monotonic() + self.ttl, model, reply, size)
+        self.size += size
+        bot_metrics.increment("response_cache.stores")
+
+        while self.size > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            bot_metrics.increment("response_cache.evictions")
+        self._update_gauges()
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self.size -= entry[3]
+        self._update_gauges()
+
+    def _update_gauges(self):
+        bot_metrics.set_gauge("response_cache.entries", len(self._entries))
+        bot_metrics.set_gauge("response_cache.size_mb", round(self.size / (1024 * 1024), 3))
@@ -0,0 +1,260 @@
+# retry_policy.py
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# github.com/FlyingFathead/TelegramBot-OpenAI-API/
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#
+# One retry policy for the OpenAI (and Perplexity) API calls.
+#
+# Each call site used to roll its own retries: a flat sleep on read
+# timeouts in `handle_message`, a flat 2 seconds on *any* exception
+# elsewhere (a 400 included), and nothing ever looked at `Retry-After`.
+# `RetryPolicy.run()` replaces all of that:
+#
+#   - exponential backoff with full jitter between attempts
+#   - a 429/503 waits as long as the server asks (`Retry-After`, or the
+#     `x-ratelimit-reset-*` header of the exhausted budget) instead
+#   - timeouts, connection errors, 408/409/429 and 5xx are retried;
+#     any other 4xx is returned to the caller right away
+#   - a circuit breaker: after `CircuitFailureThreshold` 5xx responses /
+#     timeouts in a row, calls fail fast with `CircuitOpenError` for
+#     `CircuitResetSeconds`, after which one trial call is let through.
+#
+# The OpenAI gateway runs every request through its policy; see
+# `[RetryPolicy]` in config.ini.
+
+import re
+import time
+import random
+import asyncio
+import logging
+import configparser
+from email.utils import parsedate_to_datetime
+
+import httpx
+
+import bot_metrics
+from config_paths import CONFIG_PATH
+
+logger = logging.getLogger('TelegramBotLogger')
+
+# Load the configuration file
+config = configparser.ConfigParser()
+config.read(CONFIG_PATH)
+
+# total attempts per request (the first try included); defaults to the old `MaxRetries`
+MAX_ATTEMPTS = config.getint('RetryPolicy', 'MaxAttempts', fallback=config.getint('DEFAULT', 'MaxRetries', fallback=3))
+BASE_DELAY = config.getfloat('RetryPolicy', 'BaseDelay', fallback=1.0)
+MAX_DELAY = config.getfloat('RetryPolicy', 'MaxDelay', fallback=20.0)
+# if the server asks us to come back later than this (in seconds), give up instead of waiting
+MAX_RETRY_AFTER = config.getfloat('RetryPolicy', 'MaxRetryAfter', fallback=60.0)
+CIRCUIT_FAILURE_THRESHOLD = config.getint('RetryPolicy', 'CircuitFailureThreshold', fallback=5)
+CIRCUIT_RESET_SECONDS = config.getfloat('RetryPolicy', 'CircuitResetSeconds', fallback=30.0)
+
+# 408 Request Timeout, 409 Conflict (OpenAI: "try again"), 429 Too Many Requests; plus any 5xx
+RETRYABLE_STATUS_CODES = frozenset({408, 409, 429})
+RETRYABLE_EXCEPTIONS = (httpx.TimeoutException, httpx.NetworkError, httpx.RemoteProtocolError)
+
+UNAVAILABLE_MESSAGE = "The AI service seems to be having trouble right now. Please try again in a little while. 🛠️"
+
+# "6m0s", "1.5s", "20ms", "1h2m3s", ...
+_DURATION_PART = re.compile(r'(\d+(?:\.\d+)?)(ms|h|m|s)')
+_DURATION_UNITS = {'h': 3600.0, 'm': 60.0, 's': 1.0, 'ms': 0.001}
+
+
+def parse_duration(value):
+    """Seconds in an OpenAI-style duration like "6m0s" or "20ms"; None if unparseable."""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return float(value)  # plain seconds
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if not parts or ''.join(number + unit for number, unit in parts) != value:
+        return None
+    return sum(float(number) * _DURATION_UNITS[unit] for number, unit in parts)
+
+def int_header(headers, name):
+    value = headers.get(name)
+    if value is None:
+        return None
+    try:
+        return int(float(value))
+    except ValueError:
+        return None
+
+def retry_after_seconds(response):
+    """
+    How long the server asked us to wait before trying again, in seconds;
+    None if the response doesn't say.
+    """
+    headers = response.headers
+
+    # `retry-after-ms` is OpenAI's finer-grained variant of the standard header
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return max(0.0, float(retry_after_ms) / 1000.0)
+        except ValueError:
+            pass
+
+    retry_after = headers.get("retry-after")
+    if retry_after:
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            # the HTTP-date form
+            try:
+                return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+
+    # OpenAI's rate limit headers: wait for the budget that has run out to reset
+    resets = []
+    for kind in ("requests", "tokens"):
+        if int_header(headers, f"x-ratelimit-remaining-{kind}") == 0:
+            reset = parse_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+            if reset is not None:
+                resets.append(reset)
+    return max(resets) if resets else None
+
+def is_retryable_status(status_code):
+    return status_code in RETRYABLE_STATUS_CODES or status_code >= 500
+
+
+class CircuitOpenError(Exception):
+    """The API has been failing; the call was not even attempted."""
+
+    def __init__(self, name, retry_in):
+        super().__init__(f"{name} circuit is open; not calling the API for another {retry_in:.0f}s")
+        self.name = name
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures (5xx / timeouts);
+    while open, `before_call()` raises `CircuitOpenError`. Once
+    `reset_timeout` has passed, one trial call goes through: success closes
+    the circuit, another failure opens it again. (If the trial never reports
+    back, the next one is allowed after another `reset_timeout`.)
+    """
+
+    def __init__(self, name, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_timeout=CIRCUIT_RESET_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self._opened_at = None
+        self._trial = False
+
+    @property
+    def is_open(self):
+        return self._opened_at is not None
+
+    def before_call(self):
+        if self._opened_at is None:
+            return
+        remaining = self._opened_at + self.reset_timeout - time.monotonic()
+        if remaining > 0:
+            bot_metrics.increment(f"circuit.{self.name}.fast_fails")
+            raise CircuitOpenError(self.name, remaining)
+        # let this one through as a trial; everyone else keeps failing fast meanwhile
+        logger.info(f"Circuit '{self.name}': trying the API again.")
+        self._opened_at = time.monotonic()
+        self._trial = True
+
+    def record_success(self):
+        if self._opened_at is not None:
+            logger.info(f"Circuit '{self.name}' closed; the API is responding again.")
+            bot_metrics.set_gauge(f"circuit.{self.name}.open", 0)
+        self.failures = 0
+        self._opened_at = None
+        self._trial = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self._trial or (self._opened_at is None and self.failures >= self.failure_threshold):
+            logger.warning(
+                f"Circuit '{self.name}' opened after {self.failures} consecutive failures; "
+                f"failing fast for {self.reset_timeout:g}s."
+            )
+            bot_metrics.increment(f"circuit.{self.name}.opened")
+            bot_metrics.set_gauge(f"circuit.{self.name}.open", 1)
+            self._opened_at = time.monotonic()
+            self._trial = False
+
+
+class RetryPolicy:
+    """
+    Runs a request with retries:
+
+        response = await policy.run(lambda: client.post(url, ...))
+
+    `send` must start a fresh request each time it's called and return an
+    `httpx.Response`. The response of the last attempt is returned even if
+    its status is an error (callers keep doing their own `raise_for_status()`);
+    exceptions from the last attempt are re-raised. Raises `CircuitOpenError`
+    when the circuit breaker is open.
+    """
+
+    def __init__(
+        self,
+        name,
+        max_attempts=MAX_ATTEMPTS,
+        base_delay=BASE_DELAY,
+        max_delay=MAX_DELAY,
+        max_retry_after=MAX_RETRY_AFTER,
+        breaker=None,
+    ):
+        self.name = name
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retry_after = max_retry_after
+        self.breaker = breaker if breaker is not None else CircuitBreaker(name)
+
+    def backoff(self, attempt):
+        """Full-jitter exponential backoff before retry number `attempt + 1`."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    async def run(self, send):
+        for attempt in range(self.max_attempts):
+            self.breaker.before_call()
+            last_attempt = attempt == self.max_attempts - 1
+
+            try:
+                response = await send()
+            except RETRYABLE_EXCEPTIONS as e:
+                self.breaker.record_failure()
+                if last_attempt:
+                    bot_metrics.increment(f"retry.{self.name}.gave_up")
+                    raise
+                delay = self.backoff(attempt)
+                reason = type(e).__name__
+            else:
+                if not is_retryable_status(response.status_code):
+                    # a 2xx, or a 4xx that will fail the same way every time; the API itself is fine
+                    self.breaker.record_success()
+                    return response
+                if response.status_code >= 500:
+                    self.breaker.record_failure()
+                if last_attempt:
+                    bot_metrics.increment(f"retry.{self.name}.gave_up")
+                    return response
+
+                reason = f"HTTP {response.status_code}"
+                delay = retry_after_seconds(response)
+                if delay is None:
+                    delay = self.backoff(attempt)
+                elif delay > self.max_retry_after:
+                    logger.warning(f"{self.name}: {reason}, server asks to retry in {delay:.0f}s; not waiting that long.")
+                    bot_metrics.increment(f"retry.{self.name}.gave_up")
+                    return response
+                # the body of a response we're not going to use (needed for streamed responses)
+                await response.aclose()
+
+            bot_metrics.increment(f"retry.{self.name}.retries")
+            logger.info(f"{self.name}: {reason}, retrying in {delay:.1f}s (attempt {attempt + 1} of {self.max_attempts}).")
+            await asyncio.sleep(delay)
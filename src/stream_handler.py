@@ -0,0 +1,253 @@
+# stream_handler.py
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# github.com/FlyingFathead/TelegramBot-OpenAI-API/
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#
+# Streaming chat completions into Telegram.
+#
+# With `StreamResponses = True` the reply is sent as soon as the first tokens
+# arrive and then progressively edited in place. Edits are throttled
+# (`StreamEditInterval`) to stay under Telegram's edit rate limits, long
+# replies roll over into a new message before the 4096-char limit, and every
+# edit is rendered into valid Telegram HTML.
+
+import re
+import html
+import time
+import asyncio
+import logging
+
+from telegram.constants import ParseMode
+from telegram.error import RetryAfter, BadRequest, TimedOut
+
+logger = logging.getLogger('TelegramBotLogger')
+
+# leave some headroom under Telegram's hard 4096-char limit
+MAX_STREAM_MESSAGE_LENGTH = 4000
+
+# trailing half-received HTML tags / entities, i.e. `<a hre` or `&am`
+INCOMPLETE_TAG_RE = re.compile(r'<[^<>]*$')
+INCOMPLETE_ENTITY_RE = re.compile(r'&#?[a-zA-Z0-9]*$')
+HTML_TAG_RE = re.compile(r'<[^>]+>')
+
+
+def retry_after_seconds(error):
+    # `RetryAfter.retry_after` is an int in older PTB versions and a timedelta in newer ones
+    retry_after = error.retry_after
+    if hasattr(retry_after, 'total_seconds'):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+class TelegramStreamWriter:
+    """
+    Writes a streamed reply into one or more Telegram messages.
+
+    `render` turns raw model text into Telegram HTML (i.e. markdown_to_html + sanitize_html).
+    Call `feed()` with each content delta and `finish()` once the stream has ended.
+    """
+
+    def __init__(self, tg_bot, chat_id, render, edit_interval=1.5, max_length=MAX_STREAM_MESSAGE_LENGTH):
+        self.tg_bot = tg_bot
+        self.chat_id = chat_id
+        self.render = render
+        self.edit_interval = edit_interval
+        self.max_length = max_length
+
+        self.raw_text = ""            # the full reply received so far
+        self.messages_sent = 0
+        self.edits_made = 0
+        self._segment_start = 0       # offset in raw_text where the current message begins
+        self._message_id = None       # Telegram message currently being edited
+        self._last_sent = None        # last text written into that message
+        self._next_edit_at = 0.0
+
+    @property
+    def started(self):
+        """True once at least one message has been delivered to the user."""
+        return self.messages_sent > 0
+
+    async def feed(self, delta):
+        if not delta:
+            return
+        self.raw_text += delta
+        # send the first tokens right away, after that only edit once the throttle allows it
+        if self._message_id is None or time.monotonic() >= self._next_edit_at:
+            await self._flush(final=False)
+
+    async def finish(self):
+        if self.raw_text[self._segment_start:].strip():
+            await self._flush(final=True)
+
+    # ~~~~~~~~~
+    # internals
+    # ~~~~~~~~~
+
+    def _render(self, raw, final):
+        text = raw.strip() if final else raw.rstrip()
+        if not final:
+            # don't show half-received tags/entities mid-stream
+            text = INCOMPLETE_TAG_RE.sub('', text)
+            text = INCOMPLETE_ENTITY_RE.sub('', text)
+        try:
+            return self.render(text)
+        except Exception as e:
+            logger.error(f"Rendering streamed reply failed: {e}")
+            return html.escape(text)
+
+    def _find_split(self, segment):
+        # same preference as `split_message`: newline, then sentence end, then hard cut
+        limit = min(len(segment), self.max_length)
+        while True:
+            split_index = segment.rfind('\n', 0, limit)
+            if split_index <= 0:
+                split_index = segment.rfind('. ', 0, limit)
+                if split_index > 0:
+                    split_index += 1  # keep the period in the first part
+            if split_index <= 0:
+                split_index = limit
+            if len(self._render(segment[:split_index], final=True)) <= self.max_length or split_index <= 1:
+                return split_index
+            # rendered HTML is longer than the raw text; try a shorter cut
+            limit = max(1, int(split_index * 0.8))
+
+    async def _flush(self, final):
+        segment = self.raw_text[self._segment_start:]
+        rendered = self._render(segment, final)
+
+        # roll over into a new message before hitting Telegram's length limit
+        while len(rendered) > self.max_length:
+            split_index = self._find_split(segment)
+            await self._write(self._render(segment[:split_index], final=True), force=True)
+
+            self._segment_start += split_index
+            while self._segment_start < len(self.raw_text) and self.raw_text[self._segment_start].isspace():
+                self._segment_start += 1
+            self._message_id = None
+            self._last_sent = None
+
+            segment = self.raw_text[self._segment_start:]
+            rendered = self._render(segment, final)
+
+        await self._write(rendered, force=final)
+
+    async def _write(self, text, force=False):
+        if not text.strip() or text == self._last_sent:
+            return
+
+        now = time.monotonic()
+        if self._message_id is not None and now < self._next_edit_at:
+            if not force:
+                return
+            # the final edit must land; wait out the throttle
+            await asyncio.sleep(self._next_edit_at - now)
+
+        for attempt in range(2):
+            try:
+                await self._send_or_edit(text, parse_mode=ParseMode.HTML)
+                break
+            except RetryAfter as e:
+                wait = retry_after_seconds(e)
+                logger.warning(f"Telegram rate limit hit while streaming to chat {self.chat_id}; retry after {wait}s.")
+                self._next_edit_at = time.monotonic() + wait
+                if not force or attempt:
+                    return
+                await asyncio.sleep(wait)
+            except BadRequest as e:
+                if "not modified" in str(e).lower():
+                    break
+                if "can't parse entities" in str(e).lower():
+                    # last resort: plain text, so the user still sees the reply
+                    logger.warning(f"Streamed HTML was rejected by Telegram ({e}); falling back to plain text.")
+                    plain = html.unescape(HTML_TAG_RE.sub('', text))
+                    await self._send_or_edit(plain, parse_mode=None)
+                    break
+                raise
+            except TimedOut:
+                logger.warning(f"Timeout while streaming a message edit to chat {self.chat_id}.")
+                if not force or attempt:
+                    return
+
+        self._last_sent = text
+        self._next_edit_at = time.monotonic() + self.edit_interval
+
+    async def _send_or_edit(self, text, parse_mode):
+        if self._message_id is None:
+            message = await self.tg_bot.send_message(chat_id=self.chat_id, text=text, parse_mode=parse_mode)
+            self._message_id = message.message_id
+            self.messages_sent += 1
+        else:
+            await self.tg_bot.edit_message_text(
+                chat_id=self.chat_id,
+                message_id=self._message_id,
+                text=text,
+                parse_mode=parse_mode
+            )
+            self.edits_made += 1
+
+
+async def stream_completion_to_telegram(gateway, payload, writer, timeout=None, chunks=None):
+    """
+    Run a streamed chat completion, passing content deltas to `writer` as they arrive.
+
+    Tool call deltas are accumulated (by their `index`), so the result is shaped exactly
+    like a non-streamed `/chat/completions` response and the normal dispatch logic works on it.
+    `chunks` can be a stream that's already open (i.e. the winner of a hedged request).
+    """
+    content_parts = []
+    tool_calls = {}
+    finish_reason = None
+    usage = None
+    model = payload.get("model")
+
+    if chunks is None:
+        chunks = gateway.stream_chat_completion(payload, timeout=timeout)
+
+    async for chunk in chunks:
+        model = chunk.get("model") or model
+        if chunk.get("usage"):
+            usage = chunk["usage"]  # sent in the final chunk with `include_usage`
+
+        for choice in chunk.get("choices") or []:
+            delta = choice.get("delta") or {}
+
+            content = delta.get("content")
+            if content:
+                content_parts.append(content)
+                await writer.feed(content)
+
+            # the first delta of each tool call carries its id & name, the rest stream the arguments
+            for tool_call_delta in delta.get("tool_calls") or []:
+                tool_call = tool_calls.setdefault(tool_call_delta.get("index", 0), {
+                    "id": None,
+                    "type": "function",
+                    "function": {"name": "", "arguments": ""},
+                })
+                if tool_call_delta.get("id"):
+                    tool_call["id"] = tool_call_delta["id"]
+                function_delta = tool_call_delta.get("function") or {}
+                tool_call["function"]["name"] += function_delta.get("name") or ""
+                tool_call["function"]["arguments"] += function_delta.get("arguments") or ""
+
+            if choice.get("finish_reason"):
+                finish_reason = choice["finish_reason"]
+
+    await writer.finish()
+
+    message = {"role": "assistant", "content": "".join(content_parts) or None}
+    if tool_calls:
+        message["tool_calls"] = [tool_calls[index] for index in sorted(tool_calls)]
+
+    response_json = {
+        "object": "chat.completion",
+        "model": model,
+        "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+    }
+    if usage:
+        response_json["usage"] = usage
+
+    logger.info(
+        f"Streamed completion finished: finish_reason={finish_reason}, "
+        f"{writer.messages_sent} message(s) sent, {writer.edits_made} edit(s)."
+    )
+    return response_json
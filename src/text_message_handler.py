@@ -49,7 +49,7 @@ from config_paths import (
     ELASTICSEARCH_ENABLED, ELASTICSEARCH_HOST, ELASTICSEARCH_PORT,
     ELASTICSEARCH_SCHEME, ELASTICSEARCH_USERNAME, ELASTICSEARCH_PASSWORD
 )
-from custom_functions import custom_functions, observe_chat
+from custom_functions import custom_functions, custom_tools, observe_chat
 from api_get_duckduckgo_search import get_duckduckgo_search
 from api_get_openrouteservice import get_route, get_directions_from_addresses, format_and_translate_directions
 from api_get_openweathermap import get_weather, format_and_translate_weather, format_weather_response
@@ -61,6 +61,12 @@ from calc_module import calculate_expression
 
 # handlers for the custom function calls
 from api_perplexity_search import query_perplexity
+from tool_registry import ToolCallContext, run_tool_turn
+from tool_selector import select_tools, follow_up_tools, tool_parameters
+from tool_prefetch import ToolPrefetcher
+
+# request serialization & payload logging
+from json_serializer import loads, log_payload
 # from perplexity_handler import handle_query_perplexity
 # from api_perplexity_search import query_perplexity, translate_response, translate_response_chunked, smart_chunk, split_message
 # from api_perplexity_search import query_perplexity, smart_chunk, split_message
@@ -68,6 +74,30 @@ from api_perplexity_search import query_perplexity
 # url processing
 from url_handler import process_url_message
 
+# streamed replies
+from stream_handler import TelegramStreamWriter, stream_completion_to_telegram
+
+# local answers for trivial requests
+from fast_path import try_fast_path
+
+# per-user token accounting & daily quotas
+import user_usage
+
+# SLO-driven load shedding
+from load_shedder import LoadShed, BUSY_MESSAGE as LOAD_SHED_BUSY_MESSAGE
+
+# RPM/TPM admission control
+from admission_control import AdmissionRejected, estimate_request_tokens
+
+# API retries & circuit breaker
+from retry_policy import CircuitOpenError, UNAVAILABLE_MESSAGE as RETRY_UNAVAILABLE_MESSAGE
+
+# rolling summaries for long chats
+from history_compactor import schedule_compaction
+
+# prompt assembly (cache-friendly message order)
+from prompt_assembler import assemble_messages, collect_action_messages, record_prompt_cache_usage, system_message
+
 # Get the 'ChatLogger' defined in main.py
 logger = logging.getLogger('ChatLogger')
 
@@ -104,17 +134,15 @@ else:
 # additional check for message length
 MAX_TELEGRAM_MESSAGE_LENGTH = 4000
 
-# Add extra wait time if we're in the middle of i.e. a translation process
-extra_wait_time = 30  # Additional seconds to wait when in translation mode
-
 # --- NEW: Import SQLite utilities ---
 try:
     # Assuming db_utils.py is in the same src/ directory
-    from db_utils import _get_daily_usage_sync, _update_daily_usage_sync, DB_PATH, DB_INITIALIZED_SUCCESSFULLY
+    from db_utils import DB_PATH, DB_INITIALIZED_SUCCESSFULLY
+    # today's usage is counted in memory and written behind to the DB (see usage_counters.py)
+    import usage_counters
 except ImportError:
     logging.critical("Failed to import from db_utils.py! SQLite usage tracking will be disabled.")
-    _get_daily_usage_sync = None
-    _update_daily_usage_sync = None
+    usage_counters = None
     DB_PATH = None
     DB_INITIALIZED_SUCCESSFULLY = False
 # --- End Import ---
@@ -127,19 +155,20 @@ def get_today_usage():
     """
     if not DB_INITIALIZED_SUCCESSFULLY or not DB_PATH:
         return None  # Not ready
-    usage_date = datetime.datetime.utcnow().strftime('%Y-%m-%d')
-    daily_usage = _get_daily_usage_sync(DB_PATH, usage_date)
-    return daily_usage  # daily_usage is (premium_tokens, mini_tokens) or None
+    return usage_counters.today()  # (premium_tokens, mini_tokens)
 
 # model picker auto-switch
+# Returns the model for this turn, or None if both tiers are used up (and `FallbackLimitAction = Deny`).
+# The choice is passed through the turn as a local, never stored on `bot`: with concurrent update
+# processing, another chat's turn may be picking its own model at the same time.
 def pick_model_auto_switch(bot):
     if not config_auto.has_section('ModelAutoSwitch'):
         logging.info("Auto-switch is not configured. Using default model: %s", bot.model)
-        return True
+        return bot.model
 
     if not config_auto['ModelAutoSwitch'].getboolean('Enabled', fallback=False):
         logging.info("ModelAutoSwitch.Enabled = False => skipping auto-switch, using %s", bot.model)
-        return True
+        return bot.model
 
     premium_model = config_auto['ModelAutoSwitch'].get('PremiumModel', 'gpt-4')
     fallback_model = config_auto['ModelAutoSwitch'].get('FallbackModel', 'gpt-3.5-turbo')
@@ -149,14 +178,10 @@ def pick_model_auto_switch(bot):
 
     if not DB_INITIALIZED_SUCCESSFULLY or not DB_PATH:
         logging.warning("DB not initialized or path missing — can't auto-switch, fallback to default model.")
-        return True
+        return bot.model
 
-    usage_date = datetime.datetime.utcnow().strftime('%Y-%m-%d')
-    daily_usage = _get_daily_usage_sync(DB_PATH, usage_date)
-    if not daily_usage:
-        daily_premium_tokens, daily_fallback_tokens = (0, 0)
-    else:
-        daily_premium_tokens, daily_fallback_tokens = daily_usage
+    # an in-memory read; no DB round trip per message
+    daily_premium_tokens, daily_fallback_tokens = usage_counters.today()
 
     # --> NOW WE CAN SAFELY LOG THE USAGE & LIMITS <--
     logging.info(f"Daily premium tokens = {daily_premium_tokens}, daily fallback tokens = {daily_fallback_tokens}")
@@ -164,36 +189,34 @@ def pick_model_auto_switch(bot):
 
     # Decide if we can still use the premium model
     if daily_premium_tokens < premium_limit:
-        bot.model = premium_model
-        logging.info("Using premium model: %s, daily usage = %d", bot.model, daily_premium_tokens)
-        return True
+        logging.info("Using premium model: %s, daily usage = %d", premium_model, daily_premium_tokens)
+        return premium_model
     else:
         # Premium limit exceeded => check fallback usage
         if daily_fallback_tokens < fallback_limit:
-            bot.model = fallback_model
             logging.info("Premium limit reached; using fallback model: %s, fallback usage = %d", 
-                         bot.model, daily_fallback_tokens)
-            return True
+                         fallback_model, daily_fallback_tokens)
+            return fallback_model
         else:
             # Fallback usage also exceeded => check action
             if fallback_action.lower() == 'deny':
                 logging.warning("Fallback limit also reached => Deny further usage.")
-                return False
+                return None
             elif fallback_action.lower() == 'warn':
                 logging.warning("Fallback limit reached but ignoring => 'Warn' => proceed with fallback anyway.")
-                bot.model = fallback_model
-                return True
+                return fallback_model
             else:
                 logging.info("Fallback limit reached => 'Proceed' => continuing anyway with fallback.")
-                bot.model = fallback_model
-                return True
+                return fallback_model
 
 # text message handling logic
-async def handle_message(bot, update: Update, context: CallbackContext, logger) -> None:
+# `user_message_override`: the text to answer instead of the update's own (i.e. several coalesced messages,
+# or a voice message's transcription)
+async def handle_message(bot, update: Update, context: CallbackContext, logger, user_message_override=None) -> None:
 
-    # 1) Auto-switch first if applicable
-    can_proceed = pick_model_auto_switch(bot)
-    if not can_proceed:
+    # 1) Auto-switch first if applicable; `model` is this turn's model from here on
+    model = pick_model_auto_switch(bot)
+    if model is None:
         bot.logger.warning("Denied request because daily usage limits are exceeded for both premium & fallback.")        
         await context.bot.send_message(
             chat_id=update.effective_chat.id,
@@ -201,7 +224,7 @@ async def handle_message(bot, update: Update, context: CallbackContext, logger)
         )
         return
     else:
-        bot.logger.info(f"Proceeding with the request using model '{bot.model}'.")
+        bot.logger.info(f"Proceeding with the request using model '{model}'.")
 
     # Extract chat_id as soon as possible from the update object
     chat_id = update.effective_chat.id
@@ -214,10 +237,54 @@ async def handle_message(bot, update: Update, context: CallbackContext, logger)
         await context.bot.send_message(chat_id=update.message.chat_id, text=bot.bot_disabled_msg)
         return
 
-    # Before anything else, check the global rate limit
-    if bot.check_global_rate_limit():
+    # Trivial requests (the time, "12% of 4500", "list my reminders") are answered locally,
+    # without calling the model at all (opt-in, see fast_path.py)
+    user_message = user_message_override if user_message_override is not None else update.message.text
+    if await try_fast_path(bot, update, context, user_message):
+        return
+
+    # Users over their daily token quota are turned away before any API call (an in-memory lookup, see user_usage.py)
+    if user_usage.over_quota(update.effective_user.id):
+        bot.logger.info(f"User {update.effective_user.id} is over their daily token quota ({user_usage.quota_for(update.effective_user.id)}); not calling the API.")
+        await context.bot.send_message(chat_id=chat_id, text=user_usage.QUOTA_EXCEEDED_MESSAGE)
+        return
+
+    # Before anything expensive: if the API is backed up (slow p95 / full work queue), answer "busy" right away
+    # instead of piling up more work (see load_shedder.py)
+    try:
+        await bot.load_shedder.acquire()
+    except LoadShed:
+        await context.bot.send_message(chat_id=chat_id, text=LOAD_SHED_BUSY_MESSAGE)
+        return
+
+    # ...then wait for our turn under the global RPM/TPM limits (see admission_control.py);
+    # only turned away if the queue is full or the wait gets too long
+    try:
+        estimated_tokens = estimate_request_tokens(
+            context.chat_data,
+            user_message,
+            lambda text: bot.count_tokens(text, model),
+            bot.token_encoding(model)
+        )
+        admission_ticket = await bot.admission_controller.acquire(update.effective_user.id, chat_id, estimated_tokens)
+    except AdmissionRejected:
+        bot.load_shedder.release()
         await context.bot.send_message(chat_id=update.message.chat_id, text="The bot is currently busy. Please try again in a minute.")
         return
+    except BaseException:
+        # (i.e. a tokenizer error, or cancelled while queued) the load shedder slot is only
+        # released by the `finally` below once we're past this; don't leak it
+        bot.load_shedder.release()
+        raise
+
+    # actual usage of this turn, to settle the admission ticket with; `request_sent` stays False
+    # on the paths that return before calling the API (daily limit, cache hit, early errors)
+    turn_tokens = 0
+    turn_requests = 0
+    request_sent = False
+    # the load shedder slot is handed back early on a response cache hit
+    shed_slot_held = True
+    tool_call_context = None
 
     # process a text message
     try:
@@ -228,16 +295,8 @@ async def handle_message(bot, update: Update, context: CallbackContext, logger)
         # Start the typing animation in a background task
         typing_task = asyncio.create_task(send_typing_animation(context.bot, chat_id, stop_typing_event))
 
-        # Check if there is a transcribed text available
-        if 'transcribed_text' in context.user_data:
-            user_message = context.user_data['transcribed_text']
-            # Clear the transcribed text after using it
-            del context.user_data['transcribed_text']
-        else:
-            user_message = update.message.text
-        
         chat_id = update.message.chat_id
-        user_token_count = bot.count_tokens(user_message)
+        user_token_count = bot.count_tokens(user_message, model)
 
         # Debug print to check types
         bot.logger.info(f"[Token counting/debug] user_token_count type: {type(user_token_count)}, value: {user_token_count}")
@@ -250,8 +309,8 @@ async def handle_message(bot, update: Update, context: CallbackContext, logger)
             max_tokens_config = bot.config.getint('GlobalMaxTokenUsagePerDay', 100000)
             is_no_limit = max_tokens_config == 0
             bot.logger.info(f"[Token counting/debug] max_tokens_config type: {type(max_tokens_config)}, value: {max_tokens_config}")
-            # Debug: Print the value read from token_usage.json
-            bot.logger.info(f"[Debug] Total token usage from file: {bot.total_token_usage}")
+            # Debug: today's usage so far (from the usage ledger, see usage_ledger.py)
+            bot.logger.info(f"[Debug] Total token usage today: {bot.total_token_usage}")
 
         except ValueError:
             # Handle the case where the value in config.ini is not a valid integer
@@ -287,14 +346,8 @@ async def handle_message(bot, update: Update, context: CallbackContext, logger)
         #
         current_timestamp_str = f"{english_line}\n{finnish_line}"
 
-        # We'll put that into a system message
-        timestamp_system_msg = {
-            "role": "system",
-            "content": current_timestamp_str
-        }
-
-        # Add the user's tokens to the total usage (JSON style)
-        bot.total_token_usage += user_token_count
+        # We'll put that into a system message (volatile: it goes at the tail of the prompt, see below)
+        timestamp_system_msg = system_message(current_timestamp_str)
 
         # Log the incoming user message
         bot.logger.info(f"Received message from {update.message.from_user.username} ({chat_id}): {user_message}")
@@ -334,37 +387,34 @@ async def handle_message(bot, update: Update, context: CallbackContext, logger)
         context.chat_data['last_message_time'] = current_time
 
         # Log the current chat history
-        bot.logger.debug(f"Current chat history: {context.chat_data.get('chat_history')}")
+        bot.logger.debug("Current chat history: %s", context.chat_data.get('chat_history'))
 
         # Initialize chat_history as an empty list if it doesn't exist
-        chat_history = context.chat_data.get('chat_history', [])
-
-        #  ~~~~~~~~~~~~~~~~~~~~~~~~~~~
-        #  Insert the new system msg
-        #  ~~~~~~~~~~~~~~~~~~~~~~~~~~~
-        # logger info on the appended system message
-        logger.info(f"Inserting timestamp system message: {current_timestamp_str}")
-
-        chat_history.append(timestamp_system_msg)
+        chat_history = context.chat_data.setdefault('chat_history', [])
 
         # Append the new user message to the chat history
         chat_history.append({"role": "user", "content": user_message})
 
-        # Prepare the conversation history to send to the OpenAI API
+        #  ~~~~~~~~~~~~~~~~~~~~~~~~~~~
+        #  Volatile per-turn context
+        #  ~~~~~~~~~~~~~~~~~~~~~~~~~~~
+        # Everything that changes from one request to the next (timestamp, holiday note,
+        # YouTube context, Elasticsearch RAG) is collected here and goes to the *tail* of
+        # the prompt, after the static system message and the history; that keeps the
+        # prompt prefix stable so that OpenAI's prompt caching can hit (see `prompt_assembler`).
+        # None of it is stored in the persistent chat history.
+        logger.info(f"Adding timestamp system message: {current_timestamp_str}")
+        volatile_messages = [timestamp_system_msg]
 
         # # // old method that included the timestamp in the original system message
         # system_timestamp = datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S UTC")
         # system_message = {"role": "system", "content": f"System time+date: {system_timestamp}, {day_of_week}): {bot.system_instructions}"}
 
-        system_message = {"role": "system", "content": f"Instructions: {bot.system_instructions}"}
-
-        chat_history_with_system_message = [system_message] + chat_history
-
         # Trim chat history if it exceeds a specified length or token limit
-        bot.trim_chat_history(chat_history, bot.max_tokens)
+        bot.trim_chat_history(context.chat_data, bot.max_tokens, model)
 
         # Log the incoming user message
-        bot.log_message('User', update.message.from_user.id, update.message.text)
+        bot.log_message('User', update.message.from_user.id, user_message)
 
         # Check if holiday notification is enabled
         if enable_holiday_notification:
@@ -389,7 +439,7 @@ async def handle_message(bot, update: Update, context: CallbackContext, logger)
                 holiday_name = fi_holidays.get(now.date())
                 finnish_name = holiday_replacements.get(holiday_name, holiday_name)
                 holiday_message = f"HUOMIO: Suomessa on tänään juhlapäivä: {finnish_name}. Muista mainita juhlapyhästä käyttäjälle tervehtiessäsi (käytä suomeksi tervehtiessäsi VAIN suomenkielistä juhlapyhän nimeä) ja kysellessä kuulumisia! (esim. hyvää joulua!, hauskaa vappua!, hyvää juhannusta!, iloista uutta vuotta!, jne. \n(In English: Today is a Finnish holiday: {finnish_name}. Include that in your current understanding and mention it, especially if you're talking about anything current.)"
-                chat_history_with_system_message.insert(1, {"role": "system", "content": holiday_message})
+                volatile_messages.append(system_message(holiday_message))
 
 
         # (old) // Show typing animation
@@ -399,18 +449,8 @@ async def handle_message(bot, update: Update, context: CallbackContext, logger)
         youtube_context_messages = await process_url_message(user_message)
         logger.info(f"YouTube context messages: {youtube_context_messages}")
 
-        # # Process YouTube URLs and append data.
-        # for youtube_context in youtube_context_messages:
-        #     chat_history_with_system_message.append({
-        #         "role": "system", 
-        #         "content": youtube_context
-        #     })
-
         for youtube_context in youtube_context_messages:
-            chat_history_with_system_message.append({
-                "role": "system", 
-                "content": youtube_context
-            })
+            volatile_messages.append(system_message(youtube_context))
             logger.info(f"Added YouTube context: {youtube_context}")
 
         # ~~~~~~~~~~~~~~~~~
@@ -418,9 +458,6 @@ async def handle_message(bot, update: Update, context: CallbackContext, logger)
         # ~~~~~~~~~~~~~~~~~
         # es_context = await search_es_for_context(user_message)
 
-        # Initialize chat_history_with_es_context to default value
-        chat_history_with_es_context = chat_history_with_system_message
-
         # Assuming ELASTICSEARCH_ENABLED is true and we have fetched es_context
         if elasticsearch_enabled and search_es_for_context:
             logger.info(f"Elasticsearch is enabled, searching for context for user message: {user_message}")
@@ -437,863 +474,139 @@ async def handle_message(bot, update: Update, context: CallbackContext, logger)
                     if token in es_context:
                         logger.info(f"Action token found: {token}. Executing corresponding function.")
 
-                        # Execute the mapped function
-                        chat_history_with_es_context = await function(context, update, chat_history_with_system_message)
+                        # Execute the mapped function; whatever it adds goes to the volatile tail
+                        volatile_messages.extend(await collect_action_messages(function, context, update))
 
                         action_triggered = True
                         break  # Stop checking after the first match to avoid multiple actions
 
-                # If no action token was found, just add the Elasticsearch context to the chat history
+                # If no action token was found, just add the Elasticsearch context to the prompt
                 if not action_triggered:
-                    chat_history_with_es_context = [{"role": "system", "content": "Elasticsearch RAG data: " + es_context}] + chat_history_with_system_message
+                    volatile_messages.append(system_message("Elasticsearch RAG data: " + es_context))
             else:
                 logger.info("No relevant or non-empty context found via Elasticsearch. Proceeding.")
-                chat_history_with_es_context = chat_history_with_system_message
+
+        # static system message + history + volatile tail
+        prompt_messages = assemble_messages(bot.system_instructions, chat_history, volatile_messages)
+
+        # with `[ToolSelection]` on, only the tools that look relevant to this chat go into the request
+        # (see tool_selector.py); the bot's previous reply counts too, so a plain "yes, do it" keeps the tool it offered
+        previous_reply = next(
+            (message.get('content') for message in reversed(chat_history[:-1]) if message.get('role') == 'assistant'),
+            ''
+        )
+        selected_tools = select_tools(custom_tools, user_message, previous_reply, context.chat_data)
+
+        # an exact repeat of an earlier turn (same question, same context) gets the stored reply
+        # instead of a new completion (opt-in, see response_cache.py); the timestamp isn't part of the key
+        cache_key = bot.response_cache.key_for(
+            model,
+            bot.temperature,
+            bot.system_instructions,
+            chat_history,
+            [message for message in volatile_messages if message is not timestamp_system_msg],
+            chat_id
+        )
+        cached_response = bot.response_cache.get(cache_key)
+
+        if cached_response is None:
+            # Add the user's tokens to today's usage
+            bot.add_token_usage(user_token_count, 'user_message')
         else:
-            chat_history_with_es_context = chat_history_with_system_message
+            # a cached reply costs nothing and sends no request: hand the admission reservation
+            # and the load shedder slot back right away, and charge nothing to the usage ledger
+            bot.admission_controller.release(admission_ticket, tokens_used=0, requests_used=0)
+            bot.load_shedder.release()
+            shed_slot_held = False
+
+        # tools the message clearly asks for (weather in X, a ticker, a URL) may be started right
+        # away, in parallel with the first completion (opt-in, see tool_prefetch.py)
+        tool_call_context = ToolCallContext(bot, update, context, user_message)
+        if cached_response is None:
+            tool_call_context.prefetch = ToolPrefetcher.start(tool_call_context, user_message, selected_tools)
 
         # ~~~~~~~~~~~
         # API request
         # ~~~~~~~~~~~
 
-        for attempt in range(bot.max_retries):
+        # One pass; the API calls themselves are retried by the gateway's retry policy
+        # (backoff, Retry-After, circuit breaker -- see retry_policy.py), so a timeout
+        # that makes it out here has already been retried.
+        while True:
             try:
                 # Prepare the payload for the API request
                 payload = {
-                    "model": bot.model,
+                    "model": model,
                     #"messages": context.chat_data['chat_history'],
                     # "messages": chat_history_with_system_message,  # Updated to include system message
-                    "messages": chat_history_with_es_context,
+                    "messages": prompt_messages,
                     "temperature": bot.temperature,  # Use the TEMPERATURE variable loaded from config.ini
-                    "functions": custom_functions,
-                    "function_call": 'auto'  # Allows the model to dynamically choose the function                        
-                }
-
-                # Make the API request
-                headers = {
-                    "Content-Type": "application/json",
-                    "Authorization": f"Bearer {openai.api_key}"
+                    # 'auto' allows the model to dynamically choose the tool(s) to call
+                    **tool_parameters(selected_tools, 'auto'),
+                    # not sent; lets the serializer reuse this chat's encoded history (see json_serializer.py)
+                    "_chat_id": chat_id
                 }
-                async with httpx.AsyncClient() as client:
-                    response = await client.post("https://api.openai.com/v1/chat/completions",
-                                                data=json.dumps(payload),
-                                                headers=headers,
-                                                timeout=bot.timeout)
 
+                # Make the API request (through the shared, pooled gateway)
+                try:
+                    if cached_response is not None:
+                        response_json, stream_writer = cached_response, None
+                    else:
+                        request_sent = True
+                        response_json, stream_writer = await request_chat_completion(bot, context, chat_id, payload)
+                except httpx.HTTPStatusError as e:
                     # Check if response status is 401 (Unauthorized)
-                    if response.status_code == 401:
-                        bot.logger.error("Received 401 Unauthorized: Invalid OpenAI API key. Please set up your API key correctly.")
-                        await context.bot.send_message(
-                            chat_id=chat_id,
-                            text="😐",  # First message with just the emoji
-                            parse_mode=ParseMode.HTML
-                        )
-                        await context.bot.send_message(
-                            chat_id=chat_id,
-                            text="Error: Invalid OpenAI API key. Please contact the administrator to resolve this issue.",
-                            parse_mode=ParseMode.HTML
-                        )
-                        return  # Stop further execution in case of 401 error
-
-                    response_json = response.json()
-                    bot.logger.info("OpenAI API call succeeded, status code = %d", response.status_code)
+                    if e.response.status_code != 401:
+                        raise
+                    bot.logger.error("Received 401 Unauthorized: Invalid OpenAI API key. Please set up your API key correctly.")
+                    await context.bot.send_message(
+                        chat_id=chat_id,
+                        text="😐",  # First message with just the emoji
+                        parse_mode=ParseMode.HTML
+                    )
+                    await context.bot.send_message(
+                        chat_id=chat_id,
+                        text="Error: Invalid OpenAI API key. Please contact the administrator to resolve this issue.",
+                        parse_mode=ParseMode.HTML
+                    )
+                    return  # Stop further execution in case of 401 error
+
+                bot.logger.info("OpenAI API call succeeded.")
 
                 # ~~~~~ read the usage once we have the `response_json` ~~~~~
-                if "usage" in response_json:
-                    usage_obj = response_json["usage"]
-                    # Log everything we got
-                    bot.logger.info(f"OpenAI usage field => {usage_obj}")
-
-                    # They typically have 'prompt_tokens', 'completion_tokens', and 'total_tokens'
-                    prompt_used = usage_obj.get("prompt_tokens", 0)
-                    completion_used = usage_obj.get("completion_tokens", 0)
-                    total_used = usage_obj.get("total_tokens", 0)
-
-                    bot.logger.info(f"Used {prompt_used} prompt tokens + {completion_used} completion tokens = {total_used} total tokens in this request.")
-
-                    # Figure out if we're “premium” or “mini”
-                    # (If your config has multiple fallback possibilities, do it your own way.
-                    #  For simplicity, we just compare the current `bot.model` to the PremiumModel from config.)
-
-                    premium_model_name = config_auto["ModelAutoSwitch"].get("PremiumModel", "gpt-4")
-                    if bot.model == premium_model_name:
-                        tier = "premium"
-                        bot.logger.info(f"We're using the premium model => usage credited to 'premium_tokens'.")
-                    else:
-                        tier = "mini"
-                        bot.logger.info(f"We're using the fallback model => usage credited to 'mini_tokens'.")
-
-                    # Now actually log it to SQLite
-                    if DB_INITIALIZED_SUCCESSFULLY and DB_PATH:
-                        usage_date = datetime.datetime.utcnow().strftime('%Y-%m-%d')
-                        bot.logger.info(f"Updating DB with {total_used} tokens on {usage_date} for tier='{tier}'.")
-                        _update_daily_usage_sync(DB_PATH, usage_date, tier, total_used)
-                    else:
-                        bot.logger.warning("DB not initialized => can't store usage info in daily_usage table.")
-                else:
-                    bot.logger.warning("No 'usage' field found in the API response. Could not update daily usage stats.")
-
-                # Log the API request payload
-                bot.logger.info(f"API Request Payload: {payload}")
-
-                # ~~~~~~~~~~~~~~~~~~
-                # > function calling
-                # ~~~~~~~~~~~~~~~~~~
-
-                # Check for a 'function_call' in the response
-                if 'function_call' in response_json['choices'][0]['message']:
-                    function_call = response_json['choices'][0]['message']['function_call']
-                    function_name = function_call['name']
-
-                    # ~~~~~~~~~~~~~~~~~~~~~~
-                    # Calculator Function
-                    # ~~~~~~~~~~~~~~~~~~~~~~
-
-                    # calculator module for mathematical equations
-                    if function_name == 'calculate_expression':
-                        arguments = json.loads(function_call.get('arguments', '{}'))
-                        expression = arguments.get('expression', '')
-
-                        if expression:
-                            try:
-                                # Set a timeout of 5 seconds (adjust as needed)
-                                calc_result = await asyncio.wait_for(calculate_expression(expression), timeout=5)
-                                
-                                if calc_result is None or calc_result.strip() == "":
-                                    # Handle the case where the calculation returned None or an empty result
-                                    system_message = "Calculator returned None or an empty result. Please ensure the expression is valid."
-                                    bot.logger.warning(f"Calculator returned None or empty result for expression: '{expression}'")
-                                else:
-                                    # Proper result was returned, log and format it
-                                    # calc_result = f"`{calc_result}`"  # Wrap the result in backticks for code formatting in Markdown.
-                                    calc_result = f"{calc_result}"  # Wrap the result in <code> tags for HTML formatting.
-                                    system_message = (
-                                        f"[Calculator result, explain to the user in their language if needed. "
-                                        "IMPORTANT: Do not translate or simplify the mathematical expressions themselves. "
-                                        "NOTE: Telegram doesn't support LaTeX. Use simple HTML formatting, i.e. <code></code> if need be, note that <pre> or <br> are NOT allowed HTML tags. If the user explicitly asks for LaTeX or mentions LaTeX, use LaTeX formatting; "
-                                        f"otherwise, use plain text or Unicode with simple HTML.] Result:\n{calc_result}\n\n"
-                                        "[NOTE: format your response appropriately, possibly incorporating additional context or user intent, TRANSLATE it to the user's language if needed.]"
-                                    ).format(calc_result=calc_result)  # This ensures the result is inserted correctly
-
-                                    bot.logger.info(f"Calculation result: {calc_result}")
-
-                            except asyncio.TimeoutError:
-                                # Handle the case where the calculation took too long
-                                system_message = "Calculation timed out after 5 seconds. Please try a simpler expression."
-                                bot.logger.error(f"TimeoutError: Calculation for expression '{expression}' exceeded the time limit.")
-                            except Exception as e:
-                                # Handle other exceptions
-                                system_message = f"An error occurred while evaluating the expression: {str(e)}"
-                                bot.logger.error(f"Error evaluating expression '{expression}': {e}")
-                        else:
-                            system_message = "Please provide a valid expression for calculation."
-                            bot.logger.warning("Received an empty expression for calculation.")
-
-                        # Append the calculation result or the error message as a system message
-                        chat_history.append({"role": "system", "content": system_message})
-                        context.chat_data['chat_history'] = chat_history
-
-                        # Debugging: Log the updated chat history
-                        bot.logger.info(f"Updated chat history with calculator result: {chat_history}")
-
-                        # Make an API request using the updated chat history
-                        response_json = await make_api_request(bot, chat_history, bot.timeout)
-
-                        # Extract and handle the content from the API response
-                        bot_reply_content = response_json['choices'][0]['message'].get('content', '')
-                        bot.logger.info(f"Bot's response content: '{bot_reply_content}'")
-
-                        bot_reply = bot_reply_content.strip() if bot_reply_content else ""
-
-                        # Update usage metrics and logs
-                        bot_token_count = bot.count_tokens(bot_reply)
-                        bot.total_token_usage += bot_token_count
-                        bot.write_total_token_usage(bot.total_token_usage)
-                        bot.logger.info(f"Bot's response to {update.message.from_user.username} ({chat_id}): '{bot_reply}'")
-
-                        # Ensure the bot has a substantive response to send
-                        if bot_reply:
-                            # escaped_reply = markdown_to_html(bot_reply)
-                            escaped_reply = bot_reply
-
-                            # Log the bot's response
-                            bot.log_message(
-                                message_type='Bot',
-                                message=bot_reply,
-                                source='Calculator Module'
-                            )
-
-                            await context.bot.send_message(chat_id=chat_id, text=escaped_reply, parse_mode=ParseMode.HTML)
-                        else:
-                            # If no content to send, log and add a system message
-                            bot.logger.error("Attempted to send an empty message.")
-                            system_message = "Calculator returned an empty result or encountered an error, resulting in no response to send."
-                            chat_history.append({"role": "system", "content": system_message})
-                            context.chat_data['chat_history'] = chat_history
-
-                            # Optionally, you can log this as a fallback
-                            bot.logger.info("Added system message indicating an empty result.")
-
-                        # Finalize the function call
-                        stop_typing_event.set()
-                        context.user_data.pop('active_translation', None)
-                        return
-
-                    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-                    # weather via openweathermap api
-                    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-
-                    elif function_name == 'get_weather':
-                        # Fetch the weather data
-                        arguments = json.loads(function_call.get('arguments', '{}'))
-                        city_name = arguments.get('city_name', 'DefaultCity')
-                        country = arguments.get('country', None)  # Fetch the country parameter, defaulting to None if not provided
-
-                        # Now pass the country parameter to your get_weather function
-                        weather_info = await get_weather(city_name, country=country)  # Assuming get_weather is updated to accept country
-
-                        # Add the received weather data as a system message
-                        if weather_info:
-                            system_message = f"[OpenWeatherMap API request returned data, use according to your own discernment as to what include and what format, by default, use emojis (you're in Telegram)]: {weather_info}"
-                        else:
-                            system_message = "[OpenWeatherMap API request failed to retrieve data]"
-
-                        # Append the system message to the chat history
-                        chat_history.append({"role": "system", "content": system_message})
-                        context.chat_data['chat_history'] = chat_history
-
-                        # Prepare the payload for the API request with updated chat history
-                        payload = {
-                            "model": bot.model,
-                            "messages": chat_history,
-                            "temperature": bot.temperature,
-                            "functions": custom_functions,
-                            "function_call": 'auto'  # Allows the model to dynamically choose the function
-                        }
-
-                        # Make the API request
-                        headers = {
-                            "Content-Type": "application/json",
-                            "Authorization": f"Bearer {openai.api_key}"
-                        }
-                        async with httpx.AsyncClient() as client:
-                            response = await client.post("https://api.openai.com/v1/chat/completions",
-                                                        data=json.dumps(payload),
-                                                        headers=headers,
-                                                        timeout=bot.timeout)
-                            response_json = response.json()
-
-                        # Log the API request payload
-                        bot.logger.info(f"API Request Payload: {payload}")
-
-                        # Safely get the content or default to an empty string if not found
-                        bot_reply_content = response_json['choices'][0]['message'].get('content', '')
-
-                        # Only call strip if bot_reply_content is not None
-                        bot_reply = ""  # Default value if no content is found or an empty response is received
-                        if bot_reply_content:
-                            bot_reply = bot_reply_content.strip()
-
-                        # Count tokens in the bot's response
-                        bot_token_count = bot.count_tokens(bot_reply)
-
-                        # Add the bot's tokens to the total usage
-                        bot.total_token_usage += bot_token_count
-
-                        # Update the total token usage file
-                        bot.write_total_token_usage(bot.total_token_usage)
-
-                        # Log the bot's response
-                        bot.logger.info(f"Bot's response to {update.message.from_user.username} ({chat_id}): {bot_reply}")
-
-                        # Append the bot's response to the chat history
-                        chat_history.append({"role": "assistant", "content": bot_reply})
-
-                        # Update the chat history in context with the new messages
-                        context.chat_data['chat_history'] = chat_history
-
-                        # View the output (i.e. for markdown etc formatting debugging)
-                        logger.info(f"[Debug] Reply message before escaping: {bot_reply}")
-
-                        # escaped_reply = markdown_to_html(bot_reply)
-
-                        try:
-                            escaped_reply = markdown_to_html(bot_reply)
-                        except Exception as e:
-                            bot.logger.error(f"markdown_to_html failed: {e}")
-                            escaped_reply = html.escape(bot_reply)  # Safe fallback
-
-                        # escaped_reply = bot_reply
-                        logger.info(f"[Debug] Reply message after escaping: {escaped_reply}")
-
-                        # Log the bot's response
-                        bot.log_message(
-                            message_type='Bot',
-                            message=bot_reply,
-                            source='Weather API'
-                        )
-
-                        await context.bot.send_message(
-                            chat_id=chat_id,
-                            text=escaped_reply,
-                            parse_mode=ParseMode.HTML
-                        )
-
-                        stop_typing_event.set()
-                        context.user_data.pop('active_translation', None)
-
-                        return  # Exit the loop after handling the custom function
-
-                    # ~~~~~~~~~~~~~~~~~
-                    # DuckDuckGo Search
-                    # ~~~~~~~~~~~~~~~~~
-
-                    elif function_name == 'get_duckduckgo_search':
-                        arguments = json.loads(function_call.get('arguments', '{}'))
-                        search_query = arguments.get('search_query', '')
-
-                        if search_query:
-                            search_results = await get_duckduckgo_search(search_query, user_message)
-                            if search_results:
-                                system_message = f"[DuckDuckGo Search Results]: {search_results}\n\n[NOTE: format your response as Telegram-compatible HTML with links. Translate your response to the user's language if necessary (= if the user talked to you in Finnish, respond in Finnish).][Use SIMPLE, Telegram-compliant HTML: Use these HTML tags if needed: <b> for bold, <i> for italics, <u> for underline, <s> for strikethrough, <code> for inline code, <pre> for preformatted blocks, and <a href=...> for hyperlinks.. Do NOT use <pre>, <br>, <ul>, <li> or Markdown in your response!]"
-                            else:
-                                system_message = "No results found for your query."
-                        else:
-                            system_message = "Please provide a search query."
-
-                        # Append the search results or the relevant message as a system message
-                        chat_history.append({"role": "system", "content": system_message})
-                        context.chat_data['chat_history'] = chat_history
-
-                        # Debugging: Log the updated chat history
-                        bot.logger.info(f"Updated chat history: {chat_history}")
-
-                        # Make an API request using the updated chat history
-                        response_json = await make_api_request(bot, chat_history, bot.timeout)
-
-                        # Extract and handle the content from the API response
-                        bot_reply_content = response_json['choices'][0]['message'].get('content', '')
-                        bot.logger.info(f"Bot's response content: '{bot_reply_content}'")
-
-                        bot_reply = bot_reply_content.strip() if bot_reply_content else ""
-
-                        # Update usage metrics and logs
-                        bot_token_count = bot.count_tokens(bot_reply)
-                        bot.total_token_usage += bot_token_count
-                        bot.write_total_token_usage(bot.total_token_usage)
-                        bot.logger.info(f"Bot's response to {update.message.from_user.username} ({chat_id}): '{bot_reply}'")
-
-                        # Ensure the bot has a substantive response to send
-                        if bot_reply:
-                            # Function to clean unsupported tags
-                            # # // old method
-                            # def sanitize_html(content):
-                            #     # Remove unsupported HTML tags
-                            #     for tag in ['<pre>', '</pre>', '<br>', '<br/>', '</br>', '<div>', '</div>', '<span>', '</span>', '<p>', '</p>']:
-                            #         content = content.replace(tag, '')
-                            #     # Optionally: Replace line breaks with "\n" to preserve formatting
-                            #     content = content.replace('<br>', '\n').replace('<br/>', '\n')
-                            #     return content
-
-                            # Convert markdown to HTML
-                            # escaped_reply = markdown_to_html(bot_reply)
-                            try:
-                                escaped_reply = markdown_to_html(bot_reply)
-                            except Exception as e:
-                                bot.logger.error(f"markdown_to_html failed: {e}")
-                                escaped_reply = html.escape(bot_reply)  # Safe fallback
-
-                            # Sanitize the HTML to remove any unsupported tags
-                            escaped_reply = sanitize_html(escaped_reply)
-
-                            # Log the bot's response from DuckDuckGo Search
-                            bot.log_message(
-                                message_type='Bot',
-                                message=bot_reply,
-                                source='DuckDuckGo Search'
-                            )
-
-                            await context.bot.send_message(chat_id=chat_id, text=escaped_reply, parse_mode=ParseMode.HTML)
-                        else:
-                            bot.logger.error("Attempted to send an empty message.")
-                            escaped_reply = "🤔"
-                            await context.bot.send_message(chat_id=chat_id, text=escaped_reply, parse_mode=ParseMode.HTML)
-                            pass
-
-                        # Finalize the function call
-                        stop_typing_event.set()
-                        context.user_data.pop('active_translation', None)
-                        return
-
-                    # ~~~~~~~~~~~~~~~~~~~~~~~
-                    # Website quick peek dump
-                    # ~~~~~~~~~~~~~~~~~~~~~~~
-
-                    elif function_name == 'get_website_dump':
-                        arguments = json.loads(function_call.get('arguments', '{}'))
-                        url = arguments.get('url', '')
-
-                        if url:
-                            webpage_content = await get_website_dump(url)
-                            if webpage_content:
-                                system_message = f"[Webpage Content]: {webpage_content}\n\n[NOTE: format your response as Telegram-compatible HTML with links. Do NOT use <pre> or <br> tags! Translate your response to the user's language if necessary (= if the user talked to you in Finnish, respond in Finnish).]"
-                            else:
-                                system_message = "No content found for the specified URL."
-                        else:
-                            system_message = "URL was invalid. Please provide a valid URL."
-
-                        # Append the webpage content or the relevant message as a system message
-                        chat_history.append({"role": "system", "content": system_message})
-                        context.chat_data['chat_history'] = chat_history
-
-                        # Make an API request using the updated chat history
-                        response_json = await make_api_request(bot, chat_history, bot.timeout)
-
-                        # Extract and handle the content from the API response
-                        bot_reply_content = response_json['choices'][0]['message'].get('content', '')
-                        bot.logger.info(f"Bot's response content: '{bot_reply_content}'")
-
-                        bot_reply = bot_reply_content.strip() if bot_reply_content else ""
-
-                        # Update usage metrics and logs
-                        bot_token_count = bot.count_tokens(bot_reply)
-                        bot.total_token_usage += bot_token_count
-                        bot.write_total_token_usage(bot.total_token_usage)
-                        bot.logger.info(f"Bot's response to {update.message.from_user.username} ({chat_id}): '{bot_reply}'")
-
-                        # Ensure the bot has a substantive response to send
-                        if bot_reply:
-                            # Function to clean unsupported tags
-                            # def sanitize_html(content):
-                            #     # Remove unsupported HTML tags
-                            #     for tag in ['<pre>', '</pre>', '<br>', '<br/>', '</br>', '<div>', '</div>', '<span>', '</span>', '<p>', '</p>']:
-                            #         content = content.replace(tag, '')
-                            #     # Optionally: Replace line breaks with "\n" to preserve formatting
-                            #     content = content.replace('<br>', '\n').replace('<br/>', '\n')
-                            #     return content
-
-                            # Convert markdown to HTML
-                            # escaped_reply = markdown_to_html(bot_reply)
-
-                            try:
-                                escaped_reply = markdown_to_html(bot_reply)
-                            except Exception as e:
-                                bot.logger.error(f"markdown_to_html failed: {e}")
-                                escaped_reply = html.escape(bot_reply)  # Safe fallback
-
-                            # Sanitize the HTML to remove any unsupported tags
-                            escaped_reply = sanitize_html(escaped_reply)
-
-                            # Log the bot's response from DuckDuckGo Search
-                            bot.log_message(
-                                message_type='Bot',
-                                message=bot_reply,
-                                source='Website Dump'
-                            )
-
-                            await context.bot.send_message(chat_id=chat_id, text=escaped_reply, parse_mode=ParseMode.HTML)
-                        else:
-                            bot.logger.error("Attempted to send an empty message.")
-                            escaped_reply = "🤔"
-                            await context.bot.send_message(chat_id=chat_id, text=escaped_reply, parse_mode=ParseMode.HTML)
-                            pass
-
-                        stop_typing_event.set()
-                        context.user_data.pop('active_translation', None)
-                        return
-
-                    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-                    # Alpha Vantage / Yahoo! Finance API
-                    # (depending on your selection)
-                    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-
-                    # Handling the get_stock_price function call
-                    elif function_name == 'get_stock_price':
-                        arguments = json.loads(function_call.get('arguments', '{}'))
-                        symbol = arguments.get('symbol', '')
-                        search = arguments.get('search', '')
-
-                        if symbol:
-                            stock_data = await get_stock_price(symbol)
-                        elif search:
-                            symbol_info = await search_stock_symbol(search)
-                            if isinstance(symbol_info, dict) and '1. symbol' in symbol_info:
-                                symbol = symbol_info['1. symbol']
-                                stock_data = await get_stock_price(symbol)
-                            else:
-                                stock_data = "Could not find a matching stock symbol."
-                        else:
-                            stock_data = "Please provide either a stock symbol or a search keyword."
-
-                        # Append the stock data as a system message
-                        system_message = f"[Stock Data]: {stock_data}"
-                        chat_history.append({"role": "system", "content": system_message})
-                        context.chat_data['chat_history'] = chat_history
-
-                        # Make the API request using the new function
-                        response_json = await make_api_request(bot, chat_history, bot.timeout)
-
-                        # Log the API request payload
-                        bot.logger.info(f"API Request Payload: {payload}")
-
-                        # Safely get the content or default to an empty string if not found
-                        bot_reply_content = response_json['choices'][0]['message'].get('content', '')
-
-                        # Only call strip if bot_reply_content is not None
-                        bot_reply = ""  # Default value if no content is found or an empty response is received
-                        if bot_reply_content:
-                            bot_reply = bot_reply_content.strip()
-
-                        # Count tokens in the bot's response
-                        bot_token_count = bot.count_tokens(bot_reply)
-
-                        # Add the bot's tokens to the total usage
-                        bot.total_token_usage += bot_token_count
-
-                        # Update the total token usage file
-                        bot.write_total_token_usage(bot.total_token_usage)
-
-                        # Log the bot's response
-                        bot.logger.info(f"Bot's response to {update.message.from_user.username} ({chat_id}): {bot_reply}")
-
-                        # Append the bot's response to the chat history
-                        chat_history.append({"role": "assistant", "content": bot_reply})
-
-                        # Update the chat history in context with the new messages
-                        context.chat_data['chat_history'] = chat_history
-
-                        # View the output (i.e. for markdown etc formatting debugging)
-                        logger.info(f"[Debug] Reply message before escaping: {bot_reply}")
-
-                        # escaped_reply = markdown_to_html(bot_reply)
-                        try:
-                            escaped_reply = markdown_to_html(bot_reply)
-                        except Exception as e:
-                            bot.logger.error(f"markdown_to_html failed: {e}")
-                            escaped_reply = html.escape(bot_reply)  # Safe fallback
-
-                        logger.info(f"[Debug] Reply message after escaping: {escaped_reply}")
-
-                        # Log the bot's response
-                        bot.log_message(
-                            message_type='Bot',
-                            message=bot_reply,
-                            source='Alpha Vantage / Yahoo! Finance'
-                        )                        
-
-                        await context.bot.send_message(
-                            chat_id=chat_id,
-                            text=escaped_reply,
-                            parse_mode=ParseMode.HTML
-                        )
-
-                        stop_typing_event.set()
-                        context.user_data.pop('active_translation', None)
-
-                        return  # Exit the loop after handling the custom function
-
-                    # get the map via maptiler
-                    elif function_name == 'get_map':
-                        # Fetch the map data
-                        arguments = json.loads(function_call.get('arguments', '{}'))
-                        address = arguments.get('address', 'DefaultLocation')
-                        
-                        # First, get the coordinates from the address
-                        coords_info = await get_coordinates_from_address(address)
-                        if isinstance(coords_info, dict):
-                            latitude = coords_info['latitude']
-                            longitude = coords_info['longitude']
-                            
-                            # Now, generate the map image with these coordinates
-                            map_image_url = await get_static_map_image(latitude, longitude, zoom=12, width=400, height=300)  # Example parameters
-
-                            # Note about the action taken
-                            action_note = f"[Generated and sent the map for: {address}]"
-
-                            # Append the note and map URL to the chat history
-                            chat_history.append({"role": "assistant", "content": action_note})
-                            context.chat_data['chat_history'] = chat_history
-
-                            # Send the map URL as a reply
-                            reply_message = f"Here's the map you requested: {map_image_url}"
-
-                            # Log the bot's response
-                            bot.log_message(
-                                message_type='Bot',
-                                message=bot_reply,
-                                source='Map Retrieval'
-                            )                        
-
-                            await context.bot.send_message(chat_id=chat_id, text=reply_message, parse_mode=ParseMode.HTML)
-                            return  # Exit the loop after handling the custom function
-
-                    # get directions to an address
-                    elif function_name == 'get_directions_from_addresses':
-                        # Extract arguments for direction fetching
-                        arguments = json.loads(function_call.get('arguments', '{}'))
-                        start_address = arguments.get('start_address')
-                        end_address = arguments.get('end_address')
-                        profile = arguments.get('profile', 'driving-car')  # Use a default value if not specified
-                        
-                        logging.info(f"Received directions request: start_address={start_address}, end_address={end_address}, profile={profile}")
-                        
-                        # Fetch directions based on addresses
-                        directions_info = await get_directions_from_addresses(start_address, end_address, profile)
-                        
-                        if directions_info:
-                            logging.info(f"Received directions info: {directions_info}")
-                        else:
-                            logging.error("Failed to fetch directions info.")
-                        
-                        # Format and potentially translate the directions info
-                        formatted_directions_info = await format_and_translate_directions(bot, user_message, directions_info)
-                        
-                        if formatted_directions_info:
-                            logging.info(f"Formatted directions info for reply: {formatted_directions_info}")
-                        else:
-                            logging.error("Failed to format directions info for reply.")
-                        
-                        # Note about the action taken
-                        action_note = f"[Fetched and sent the following OpenRouteService directions to the user]: {formatted_directions_info}"
-                        
-                        # Append the note and formatted directions information to the chat history
-                        chat_history.append({"role": "assistant", "content": action_note})
-                        context.chat_data['chat_history'] = chat_history
-                        
-                        logging.info("Appended directions info to chat history and sending reply.")
-
-                        # Log the bot's response
-                        bot.log_message(
-                            message_type='Bot',
-                            message=bot_reply,
-                            source='Get Directions'
-                        )                      
-
-                        # Send the formatted directions information as a reply                        
-                        await context.bot.send_message(chat_id=chat_id, text=formatted_directions_info, parse_mode=ParseMode.HTML)
-
-                        logging.info("Reply sent to user.")
-                        
-                        return  # Exit the loop after handling the custom function
-
-                    # ~~~~~~~~~~~~~~
-                    # Perplexity API
-                    # ~~~~~~~~~~~~~~
-                    # Handling the Perplexity API call with automatic translation
-
-                    elif function_name == 'query_perplexity':
-                        arguments = json.loads(function_call.get('arguments', '{}'))
-                        question = arguments.get('question', '')
-
-                        if not question:
-                            logging.warning("No question was provided for the Perplexity query.")
-                            await context.bot.send_message(
-                                chat_id=chat_id,
-                                text="No question was provided for the Perplexity query. Please provide a question.",
-                                parse_mode=ParseMode.HTML
-                            )
-                            return True
-
-                        # Make the asynchronous API call to query Perplexity
-                        perplexity_response = await query_perplexity(context.bot, chat_id, question)
-
-                        # Log the raw Perplexity API response for debugging
-                        logging.info(f"Raw Perplexity API Response: {perplexity_response}")
-
-                        if not perplexity_response:
-                            logging.error("Perplexity API returned an invalid or empty response.")
-                            await context.bot.send_message(
-                                chat_id=chat_id,
-                                text="Error processing the Perplexity query. Please try again later.",
-                                parse_mode=ParseMode.HTML
-                            )
-                            return True
-
-                        # Add Perplexity response to chat history as a system message
-                        # system_message = f"[Perplexity.ai response. Translate to the user's language if needed and use Telegram-compliant HTML in formatting. DO NOT use Markdown!]: {perplexity_response} [USE TELEGRAM HTML IN THE FORMATTING OF YOUR RESPONSE, NOT MARKDOWN, TRANSLATE TO USER'S LANGUAGE IF NEEDED.]"                        
-                        system_message = (
-                            f"[Perplexity.ai response]: {perplexity_response} "
-                            "[Translate to the user's language if needed. "
-                            "Use only Telegram-compatible HTML; keep it simple. CONVERT MARKDOWN TO HTML. NO <br> TAGS!"
-                            "Overall, in HTML formatting, DO NOT USE: <ul>, <li>, <br>, <h1>, <h2>, <h3>, <h4>, <h5>, <h6>, <pre> tags. If you want to use a codeblock, use <code>]. Remember to translate to the user's language, i.e. if they're asking in Finnish instead of English, translate into Finnish!"
-                        )
-                        chat_history.append({"role": "system", "content": system_message})
-                        context.chat_data['chat_history'] = chat_history  # Update the chat data with the new history
-
-                        # Log the updated chat history
-                        bot.logger.info(f"Updated chat history: {chat_history}")
-
-                        # Make an API request using the updated chat history
-                        response_json = await make_api_request(bot, chat_history, bot.timeout)
-
-                        # Extract and handle the content from the API response
-                        bot_reply_content = response_json['choices'][0]['message'].get('content', '')
-                        bot.logger.info(f"Bot's response content: '{bot_reply_content}'")
-
-                        bot_reply = bot_reply_content.strip() if bot_reply_content else ""
-                        bot_reply = strip_disallowed_html_tags(bot_reply)
-
-                        # Update usage metrics and logs
-                        bot_token_count = bot.count_tokens(bot_reply)
-                        bot.total_token_usage += bot_token_count
-                        bot.write_total_token_usage(bot.total_token_usage)
-                        bot.logger.info(f"Bot's response to {update.message.from_user.username} ({chat_id}): '{bot_reply}'")
-
-                        # Ensure the bot has a substantive response to send
-                        if bot_reply:
-                            # escaped_reply = bot_reply
-                            # escaped_reply = markdown_to_html(bot_reply)
-
-                            try:
-                                escaped_reply = markdown_to_html(bot_reply)
-                            except Exception as e:
-                                bot.logger.error(f"markdown_to_html failed: {e}")
-                                escaped_reply = html.escape(bot_reply)  # Safe fallback
-
-                            # Log the bot's response from Perplexity API
-                            bot.log_message(
-                                message_type='Bot',
-                                message=bot_reply,
-                                source='Perplexity API'
-                            )
-
-                            await context.bot.send_message(chat_id=chat_id, text=escaped_reply, parse_mode=ParseMode.HTML)
-                        else:
-                            bot.logger.error("Attempted to send an empty message.")
-                            # Optional fallback message or pass
-                            escaped_reply = "🤔"
-                            await context.bot.send_message(chat_id=chat_id, text=escaped_reply, parse_mode=ParseMode.HTML)
-                            pass
-
-                        # Finalize the function call
-                        context.user_data.pop('active_translation', None)
-                        return True
-
-
-                    # ~~~~~~~~~~~~~~
-                    # User reminders
-                    # ~~~~~~~~~~~~~~
-                    # If enabled, the function calls to add, view, edit or delete user's set reminders
-
-                    elif function_name == 'manage_reminder':
-                        # (A) parse arguments
-                        arguments = json.loads(function_call.get('arguments', '{}'))
-                        action = arguments.get('action')        # "add", "view", "delete", or "edit"
-                        reminder_text = arguments.get('reminder_text', '')
-                        due_time_utc = arguments.get('due_time_utc', '')
-                        reminder_id = arguments.get('reminder_id', None)
-
-                        # (B) check if reminders are enabled
-                        enable_reminders = config.getboolean('Reminders', 'EnableReminders', fallback=False)
-                        if not enable_reminders:
-                            system_message = "Reminders are disabled in config. Sorry!"
-                            chat_history.append({"role": "system", "content": system_message})
-                            context.chat_data['chat_history'] = chat_history
-                            break  # or return
-
-                        user_id = update.effective_user.id
-                        chat_id = update.effective_chat.id
-
-                        # (C) Dispatch based on action
-                        if action == 'add':
-                            if not due_time_utc:
-                                result_msg = "No due_time_utc provided for adding a reminder."
-                            elif not reminder_text:
-                                result_msg = "No reminder_text provided for adding a reminder."
-                            else:
-                                result_msg = await handle_add_reminder(
-                                    user_id, chat_id, reminder_text, due_time_utc
-                                )
-
-                            # If it looks like success, have GPT make a nice user-facing confirmation
-                            if "has been set" in result_msg:
-                                # The snippet below is the new approach:
-                                short_system_msg = (
-                                    f"A new reminder was successfully created for <{due_time_utc}> "
-                                    f"with text: '{reminder_text}'. "
-                                    "Please give the user a concise, friendly confirmation message in the user's own language, "
-                                    "mentioning the date/time but NOT quoting the text verbatim unless it's appropriate to do so. Notice also the time zone. "
-                                    "i.e. Finland observes Eastern European Time (UTC+2) in winter and Eastern European Summer Time (UTC+3) during daylight savings. "
-                                )
-                                chat_history.append({"role": "system", "content": short_system_msg})
-                            else:
-                                # Probably an error or partial success
-                                chat_history.append({"role": "system", "content": result_msg})
-
-                        elif action == 'view':
-                            raw_result = await handle_view_reminders(user_id)
-                            prefix = (
-                                "Here are the user's alerts. Use the user's language when replying and Telegram-compliant "
-                                "HTML tags (NOTE: do NOT use <br>!!). Use simple HTML tags (NO <br>, use regular newlines instead). Do NOT use Markdown! List the reminders without their database id #'s to the user, "
-                                "since the numbers are only for database reference [i.e. to delete/edit, etc]). "
-                                "If the user wasn't asking about past reminders, don't list them. KÄYTÄ VASTAUKSESSA HTML:ÄÄ. ÄLÄ KÄYTÄ MARKDOWNIA.\n\n"
-                            )
-                            final_result = prefix + raw_result
-
-                            # Now store that prefixed message in the chat history
-                            chat_history.append({"role": "system", "content": final_result})
-                            context.chat_data['chat_history'] = chat_history
-
-                        elif action == 'delete':
-                            if not reminder_id:
-                                result_msg = "No reminder_id was provided for delete."
-                            else:
-                                result_msg = await handle_delete_reminder(user_id, reminder_id)
-                            chat_history.append({"role": "system", "content": result_msg})
-
-                        elif action == 'edit':
-                            from reminder_handler import handle_edit_reminder
-                            if not reminder_id:
-                                result_msg = "No reminder_id was provided for edit."
-                            else:
-                                result_msg = await handle_edit_reminder(
-                                    user_id, reminder_id, due_time_utc, reminder_text
-                                )
-                            chat_history.append({"role": "system", "content": result_msg})
-
-                        else:
-                            # unknown action
-                            result_msg = f"Unknown 'action' for manage_reminder: {action}"
-                            chat_history.append({"role": "system", "content": result_msg})
-
-                        # (D) Re-invoke GPT to produce final user-facing text
-                        context.chat_data['chat_history'] = chat_history
-                        response_json = await make_api_request(bot, chat_history, bot.timeout)
-
-                        final_reply_content = response_json['choices'][0]['message'].get('content', '')
-                        final_reply = final_reply_content.strip() if final_reply_content else ""
-
-                        if not final_reply:
-                            # Provide a fallback message to avoid sending an empty string
-                            final_reply = "🤔"
-
-                        # strip <br> tags JIC
-                        final_reply = re.sub(r'<br\s*/?>', '\n', final_reply, flags=re.IGNORECASE)
-
-                        # log & send
-                        bot.log_message(
-                            message_type='Bot',
-                            message=final_reply,
-                            source='manage_reminder'
-                        )
-
-                        message_parts = split_message(final_reply, max_length=4000)
-
-                        for part in message_parts:
-                            await context.bot.send_message(
-                                chat_id=chat_id,
-                                text=part,
-                                parse_mode=ParseMode.HTML
-                            )
-
-                        # await context.bot.send_message(
-                        #     chat_id=chat_id,
-                        #     text=final_reply,
-                        #     parse_mode=ParseMode.HTML
-                        # )
-
-                        stop_typing_event.set()
-                        return
+                turn_tokens += update_usage_from_response(bot, response_json, update.effective_user.id, chat_id, model)
+                turn_requests += 1
+
+                # Log the API request payload (if enabled or sampled; formatting it is costly on long chats)
+                log_payload(bot.logger, payload)
+
+                # ~~~~~~~~~~~~~~
+                # > tool calling
+                # ~~~~~~~~~~~~~~
+                # All tool calls from this model turn are run concurrently (see `tool_registry`),
+                # and their results go back to the model in a single follow-up completion.
+
+                assistant_message = response_json['choices'][0]['message']
+                tools_used = []
+
+                if assistant_message.get('tool_calls'):
+                    tool_results, (response_json, stream_writer) = await run_tool_turn(
+                        tool_call_context,
+                        assistant_message,
+                        payload,
+                        lambda follow_up_payload: request_chat_completion(bot, context, chat_id, follow_up_payload)
+                    )
+                    tools_used = [result['name'] for result in tool_results]
+                    turn_tokens += update_usage_from_response(bot, response_json, update.effective_user.id, chat_id, model)
+                    turn_requests += 1
+
+                    # Keep the tool results in the persistent chat history as system messages
+                    for result in tool_results:
+                        chat_history.append({"role": "system", "content": result['content']})
+                    context.chat_data['chat_history'] = chat_history
+
+                    # Debugging: Log the updated chat history
+                    bot.logger.debug("Updated chat history with tool results: %s", chat_history)
 
                 # Extract the response and send it back to the user
                 # bot_reply = response_json['choices'][0]['message']['content'].strip()
@@ -1311,14 +624,19 @@ async def handle_message(bot, update: Update, context: CallbackContext, logger)
                 else:
                     logging.warn("No response added.")
 
-                # Count tokens in the bot's response
-                bot_token_count = bot.count_tokens(bot_reply)
+                # Tool results (i.e. Perplexity, reminders) tend to bring in <br>'s and lists
+                if tools_used:
+                    bot_reply = strip_disallowed_html_tags(bot_reply)
+
+                if cached_response is None:
+                    bot.response_cache.put(cache_key, bot_reply, model, tools_used)
 
-                # Add the bot's tokens to the total usage
-                bot.total_token_usage += bot_token_count
+                # Count tokens in the bot's response
+                bot_token_count = bot.count_tokens(bot_reply, model)
 
-                # Update the total token usage file
-                bot.write_total_token_usage(bot.total_token_usage)
+                # Add the bot's tokens to today's usage (appended to the usage ledger; not for cached replies)
+                if cached_response is None:
+                    bot.add_token_usage(bot_token_count, 'reply')
 
                 # Log the bot's response
                 bot.logger.info(f"Bot's response to {update.message.from_user.username} ({chat_id}): {bot_reply}")
@@ -1358,11 +676,11 @@ async def handle_message(bot, update: Update, context: CallbackContext, logger)
                     fallback_limit = config_auto["ModelAutoSwitch"].getint("MiniTokenLimit", 0)
 
                     # 3) figure out if current model is 'premium' or 'mini'
-                    if bot.model == premium_model and premium_model:
+                    if model == premium_model and premium_model:
                         tier_str = "premium"
                         used_so_far = premium_used if premium_used is not None else "N/A"
                         limit_str = premium_limit if premium_limit else "N/A"
-                    elif bot.model == fallback_model and fallback_model:
+                    elif model == fallback_model and fallback_model:
                         tier_str = "mini"
                         used_so_far = mini_used if mini_used is not None else "N/A"
                         limit_str = fallback_limit if fallback_limit else "N/A"
@@ -1376,7 +694,7 @@ async def handle_message(bot, update: Update, context: CallbackContext, logger)
                     else:
                         usage_str = f"{used_so_far}/{limit_str}"
 
-                    model_info = f"model={bot.model}, tier={tier_str}, usage={usage_str}"
+                    model_info = f"model={model}, tier={tier_str}, usage={usage_str}"
 
                 except Exception as e:
                     bot.logger.warning(f"Could not build model_info: {e}")
@@ -1388,6 +706,7 @@ async def handle_message(bot, update: Update, context: CallbackContext, logger)
                     message_type='Bot',
                     user_id=update.message.from_user.id,
                     message=bot_reply,
+                    source=', '.join(tools_used) if tools_used else None,
                     model_info=model_info
                 )
 
@@ -1400,53 +719,36 @@ async def handle_message(bot, update: Update, context: CallbackContext, logger)
 
                 escaped_reply = sanitize_html(escaped_reply)
 
-                message_parts = split_message(escaped_reply)
+                # In streaming mode the reply has already been delivered via progressive edits
+                if stream_writer is not None and stream_writer.started:
+                    bot.logger.info("Reply was streamed to the user; skipping the regular send.")
+                else:
+                    message_parts = split_message(escaped_reply)
 
-                for part in message_parts:
-                    await context.bot.send_message(chat_id=chat_id, text=part, parse_mode=ParseMode.HTML)                
+                    for part in message_parts:
+                        await context.bot.send_message(chat_id=chat_id, text=part, parse_mode=ParseMode.HTML)
 
                 stop_typing_event.set()
-                context.user_data.pop('active_translation', None)
+                context.chat_data.pop('active_translation', None)
 
                 break  # Break the loop if successful
 
-            except httpx.ReadTimeout:
+            except CircuitOpenError as e:
+                # OpenAI has been failing for a while; don't add to the pile
+                bot.logger.warning(f"Not calling OpenAI: {e}")
+                await context.bot.send_message(chat_id=chat_id, text=RETRY_UNAVAILABLE_MESSAGE)
+                break
+
+            except httpx.TimeoutException as e:
+                bot.logger.error(f"HTTP request timed out (retries exhausted): {e}")
                 # Check if we're currently waiting on a translation to complete.
-                if 'active_translation' in context.user_data and context.user_data['active_translation']:
-                    logger.info("Handling timeout during active translation.")
-                    if attempt < bot.max_retries - 1:
-                        adjusted_retry_delay = bot.retry_delay + extra_wait_time
-                        logger.info(f"Translation in progress, extending retry delay to {adjusted_retry_delay} seconds. Retrying {attempt + 1} of {bot.max_retries}.")
-                        await asyncio.sleep(adjusted_retry_delay)
-                    else:
-                        logger.error("Max retries reached with active translation. Notifying user of the issue.")
-                        # Instead of calling a separate function, directly manage the fallback response here.
-                        await context.bot.send_message(
-                            chat_id=chat_id,
-                            text="I'm currently experiencing difficulties due to extended processing times. Let's try something else or you can try your request again later.",
-                            parse_mode=ParseMode.HTML
-                        )
-                        stop_typing_event.set()
-                        break  # Important to prevent further retries.
+                if context.chat_data.get('active_translation'):
+                    timeout_message = "I'm currently experiencing difficulties due to extended processing times. Let's try something else or you can try your request again later."
                 else:
-                    # Handle non-translation related timeouts.
-                    if attempt < bot.max_retries - 1:
-                        logger.info(f"Read timeout, retrying in {bot.retry_delay} seconds... (Attempt {attempt + 1} of {bot.max_retries})")
-                        await asyncio.sleep(bot.retry_delay)
-                    else:
-                        logger.error("Max retries reached. Unable to proceed.")
-                        # Directly manage the fallback response here as well.
-                        await context.bot.send_message(
-                            chat_id=chat_id,
-                            text="I'm having trouble processing your request right now due to connectivity issues. Please try again later.",
-                            parse_mode=ParseMode.HTML
-                        )
-                        break  # Ensure no further retries.
+                    timeout_message = "I'm having trouble processing your request right now due to connectivity issues. Please try again later."
+                await context.bot.send_message(chat_id=chat_id, text=timeout_message, parse_mode=ParseMode.HTML)
+                break
 
-            except httpx.TimeoutException as e:
-                bot.logger.error(f"HTTP request timed out: {e}")
-                await context.bot.send_message(chat_id=chat_id, text="Sorry, the request timed out. Please try again later.")
-                # Handle timeout-specific cleanup or logic here                
             except Exception as e:
                 bot.logger.error(f"Error during message processing: {e}")
                 # Check if the exception is related to parsing entities
@@ -1465,16 +767,19 @@ async def handle_message(bot, update: Update, context: CallbackContext, logger)
                     })
                     context.chat_data['chat_history'] = chat_history
                     # Do not break; allow the system to attempt to generate a response
-                    await generate_response_based_on_updated_context(bot, context, chat_id)                    
+                    await generate_response_based_on_updated_context(bot, context, chat_id, model)                    
 
                 return
 
-        # Trim chat history if it exceeds a specified length or token limit
-        bot.trim_chat_history(chat_history, bot.max_tokens)
-
         # Update the chat history in context with the new messages
         context.chat_data['chat_history'] = chat_history
 
+        # Trim chat history if it exceeds a specified length or token limit
+        bot.trim_chat_history(context.chat_data, bot.max_tokens, model)
+
+        # Long chat? Summarize its oldest messages in the background (if `[Compaction]` is enabled)
+        schedule_compaction(bot, context.chat_data, chat_id, model)
+
         # await bot.process_text_message(update, context)
 
     except Exception as e:
@@ -1488,8 +793,21 @@ async def handle_message(bot, update: Update, context: CallbackContext, logger)
             response_sent = True  # Mark response as sent to prevent further attempts
 
     finally:
+        # Cancel any prefetched tool calls the model didn't ask for
+        if tool_call_context is not None and tool_call_context.prefetch is not None:
+            tool_call_context.prefetch.discard()
+
+        # Return unused reserved tokens to the admission buckets (or charge the overrun);
+        # if no request went out, the whole reservation goes back
+        if request_sent:
+            bot.admission_controller.release(admission_ticket, tokens_used=turn_tokens or None, requests_used=max(1, turn_requests))
+        else:
+            bot.admission_controller.release(admission_ticket, tokens_used=0, requests_used=0)
+        if shed_slot_held:
+            bot.load_shedder.release()
+
         # Ensure the flag is always cleared after the operation
-        context.user_data.pop('active_translation', None)
+        context.chat_data.pop('active_translation', None)
 
         # Stop the typing animation once processing is done
         if not stop_typing_event.is_set():
@@ -1510,7 +828,109 @@ async def send_typing_animation(bot, chat_id, stop_event: asyncio.Event):
             logging.warning(f"Timeout while sending typing action to chat {chat_id}")
             await asyncio.sleep(5)  # Continue to wait before the next typing action attempt
 
-async def generate_response_based_on_updated_context(bot, context, chat_id):
+# chat completion request for `handle_message`; streamed to the user if `StreamResponses` is on
+async def request_chat_completion(bot, context, chat_id, payload):
+    """
+    Returns `(response_json, stream_writer)`; `stream_writer` is None when not streaming.
+    Raises `httpx.HTTPStatusError` on a non-2xx response in both modes.
+    """
+    started = time.monotonic()
+    try:
+        return await _request_chat_completion(bot, context, chat_id, payload, started)
+    finally:
+        # failures and timeouts count towards the latency the load shedder watches, too
+        bot.load_shedder.observe_latency(time.monotonic() - started)
+
+async def _request_chat_completion(bot, context, chat_id, payload, started):
+    # premium-model requests may be hedged against a secondary target (see hedged_requests.py)
+    hedged = bot.hedger.applies(payload)
+
+    if not bot.stream_responses:
+        if hedged:
+            response, served_by = await bot.hedger.chat_completion(payload, timeout=bot.timeout)
+        else:
+            response = await bot.openai_gateway.chat_completion(payload, timeout=bot.timeout)
+            response.raise_for_status()
+        response_json = loads(response.content)
+        if hedged:
+            mark_served_by(response_json, served_by)
+        record_prompt_cache_usage(response_json.get("usage") or {}, time.monotonic() - started)
+        return response_json, None
+
+    # Streaming mode: the reply is sent & edited progressively as tokens arrive
+    stream_writer = TelegramStreamWriter(
+        context.bot,
+        chat_id,
+        render=render_reply_html,
+        edit_interval=bot.stream_edit_interval
+    )
+    chunks = None
+    if hedged:
+        chunks, served_by = await bot.hedger.open_stream(payload, timeout=bot.timeout)
+    response_json = await stream_completion_to_telegram(
+        bot.openai_gateway, payload, stream_writer, timeout=bot.timeout, chunks=chunks
+    )
+    if hedged:
+        mark_served_by(response_json, served_by)
+    record_prompt_cache_usage(response_json.get("usage") or {}, time.monotonic() - started)
+    return response_json, stream_writer
+
+# note which model/server actually produced a (hedged) response, for the usage accounting
+def mark_served_by(response_json, target):
+    response_json["_served_by"] = {"model": target.model, "billable": target.billable}
+
+# record the token usage of a chat completion into the daily usage table; returns the total tokens used
+# `user_id` & `chat_id`: who the completion was for, for the per-user accounting & quotas (see user_usage.py);
+# `model`: the model the turn requested (see `pick_model_auto_switch`)
+def update_usage_from_response(bot, response_json, user_id=None, chat_id=None, model=None):
+    if "usage" not in response_json:
+        bot.logger.warning("No 'usage' field found in the API response. Could not update daily usage stats.")
+        return 0
+
+    usage_obj = response_json["usage"]
+    # Log everything we got
+    bot.logger.info(f"OpenAI usage field => {usage_obj}")
+
+    # They typically have 'prompt_tokens', 'completion_tokens', and 'total_tokens'
+    prompt_used = usage_obj.get("prompt_tokens", 0)
+    completion_used = usage_obj.get("completion_tokens", 0)
+    total_used = usage_obj.get("total_tokens", 0)
+
+    bot.logger.info(f"Used {prompt_used} prompt tokens + {completion_used} completion tokens = {total_used} total tokens in this request.")
+
+    # A hedged request is charged to whichever target won the race (the loser was cancelled);
+    # a non-OpenAI secondary server (i.e. a local llama.cpp) or a response cache hit isn't charged at all.
+    served_by = response_json.get("_served_by") or {}
+    if not served_by.get("billable", True):
+        bot.logger.info(f"Response came from {served_by.get('model')} (not the OpenAI API); not counted towards the usage caps.")
+        return 0
+    model_used = served_by.get("model") or model or bot.model
+
+    # Figure out if we're “premium” or “mini”
+    # (If your config has multiple fallback possibilities, do it your own way.
+    #  For simplicity, we just compare the model used to the PremiumModel from config.)
+
+    premium_model_name = config_auto["ModelAutoSwitch"].get("PremiumModel", "gpt-4")
+    if model_used == premium_model_name:
+        tier = "premium"
+        bot.logger.info(f"We're using the premium model => usage credited to 'premium_tokens'.")
+    else:
+        tier = "mini"
+        bot.logger.info(f"We're using the fallback model => usage credited to 'mini_tokens'.")
+
+    # Now actually count it (written to SQLite on the next periodic flush)
+    if DB_INITIALIZED_SUCCESSFULLY and DB_PATH:
+        bot.logger.info(f"Adding {total_used} tokens to today's usage for tier='{tier}'.")
+        usage_counters.add(tier, total_used)
+    else:
+        bot.logger.warning("DB not initialized => can't store usage info in daily_usage table.")
+
+    # ...and to the user's, per chat & model
+    user_usage.record(user_id, chat_id, model_used, prompt_used, completion_used, total_used)
+
+    return total_used
+
+async def generate_response_based_on_updated_context(bot, context, chat_id, model=None):
     # logger.info("Using the `generate_response_based_on_updated_content` function")
     # This function is designed to generate a response leveraging the updated chat history,
     # which includes system messages about the encountered issues, ensuring continuity in user interaction,
@@ -1523,26 +943,15 @@ async def generate_response_based_on_updated_context(bot, context, chat_id):
 
         # Prepare the API request payload with the updated context.
         payload = {
-            "model": bot.model,  # Model configured for the bot
+            "model": model or bot.model,  # the turn's model (or the one configured for the bot)
             "messages": updated_context,  # Updated chat history including system messages
             "temperature": bot.temperature,  # Configured response creativity
             "max_tokens": 1024,  # Adjust based on desired response length
             # Additional parameters like 'top_p', 'frequency_penalty', etc., can be included based on requirements.
         }
 
-        # Headers for the API request, including the authorization token.
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {bot.openai_api_key}"  # Use the bot's stored OpenAI API key
-        }
-
         # Make the asynchronous API call to generate the response based on the updated context.
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                "https://api.openai.com/v1/chat/completions",
-                json=payload,
-                headers=headers
-            )
+        response = await bot.openai_gateway.chat_completion(payload)
 
         response_data = response.json()
 
@@ -1565,25 +974,24 @@ async def generate_response_based_on_updated_context(bot, context, chat_id):
             parse_mode=ParseMode.HTML  # Adjust as necessary
         )
 
-# api requests with retry
+# api requests with retry on blank replies
+# (HTTP errors and timeouts are already retried by the gateway's retry policy, so they're not retried again here)
 async def make_api_request_with_retry(bot, chat_history, retries=3, timeout=30):
-    attempt = 0
-    while attempt < retries:
+    response_json = None
+    for attempt in range(retries):
         try:
             response_json = await make_api_request(bot, chat_history, timeout)
-            # Check if the response content is empty or None
-            bot_reply_content = response_json['choices'][0]['message'].get('content', '')
-            if bot_reply_content and bot_reply_content.strip():
-                return response_json
-            else:
-                bot.logger.warning(f"Attempt {attempt + 1}: Blank response received, retrying...")
-                attempt += 1
-                await asyncio.sleep(2)  # Optional: Add a slight delay between retries
-
         except Exception as e:
             bot.logger.error(f"Attempt {attempt + 1}: Error during API request - {str(e)}")
-            attempt += 1
-            await asyncio.sleep(2)  # Optional: Add a slight delay between retries
+            break
+
+        # Check if the response content is empty or None
+        bot_reply_content = response_json['choices'][0]['message'].get('content', '')
+        if bot_reply_content and bot_reply_content.strip():
+            return response_json
+
+        bot.logger.warning(f"Attempt {attempt + 1}: Blank response received, retrying...")
+        await asyncio.sleep(bot.openai_gateway.retry_policy.backoff(attempt))
 
     bot.logger.error("All retry attempts failed, returning last attempt's response (if any).")
     return response_json  # Return the last response even if blank
@@ -1595,39 +1003,31 @@ async def make_api_request(bot, chat_history, timeout=30):
         "model": bot.model,
         "messages": chat_history,
         "temperature": bot.temperature,
-        "functions": custom_functions,
-        "function_call": 'auto'  # Allows the model to dynamically choose the function
+        # Callers only use the text reply; no tool has run, so (with tool selection on and
+        # `FollowUpTools` = relevant/none) no schemas are sent
+        **tool_parameters(follow_up_tools(custom_tools, set()), 'none')
     }
 
     # Make the API request
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {openai.api_key}"
-    }
+    try:
+        response = await bot.openai_gateway.chat_completion(payload, timeout=timeout)
 
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.post("https://api.openai.com/v1/chat/completions",
-                                         data=json.dumps(payload),
-                                         headers=headers,
-                                         timeout=timeout)
-
-            # Check for 401 Unauthorized error
-            if response.status_code == 401:
-                bot.logger.error("Received 401 Unauthorized: Invalid OpenAI API key. Please check your OpenAI API key validity!")
-                raise Exception("Unauthorized - Invalid OpenAI API key. Please check your environment variables or API key configuration.")
-            
-            response.raise_for_status()  # Raises HTTPError for bad responses (4xx, 5xx)
-            response_json = response.json()
-            return response_json
+        # Check for 401 Unauthorized error
+        if response.status_code == 401:
+            bot.logger.error("Received 401 Unauthorized: Invalid OpenAI API key. Please check your OpenAI API key validity!")
+            raise Exception("Unauthorized - Invalid OpenAI API key. Please check your environment variables or API key configuration.")
 
-        except httpx.HTTPStatusError as e:
-            bot.logger.error(f"HTTP error occurred: {e.response.status_code} - {e.response.text}")
-            raise e  # Optionally re-raise the exception or handle it gracefully
+        response.raise_for_status()  # Raises HTTPError for bad responses (4xx, 5xx)
+        response_json = response.json()
+        return response_json
 
-        except Exception as e:
-            bot.logger.error(f"An error occurred while making the API request: {str(e)}")
-            raise e
+    except httpx.HTTPStatusError as e:
+        bot.logger.error(f"HTTP error occurred: {e.response.status_code} - {e.response.text}")
+        raise e  # Optionally re-raise the exception or handle it gracefully
+
+    except Exception as e:
+        bot.logger.error(f"An error occurred while making the API request: {str(e)}")
+        raise e
 
 # split long messages
 def split_message(message, max_length=4000):
@@ -1661,6 +1061,15 @@ def split_message(message, max_length=4000):
 
     return message_parts
 
+# render the model's raw reply into Telegram-compatible HTML
+def render_reply_html(text):
+    try:
+        rendered = markdown_to_html(text)
+    except Exception as e:
+        logging.error(f"markdown_to_html failed: {e}")
+        rendered = html.escape(text)  # Safe fallback
+    return sanitize_html(rendered)
+
 # sanitize html
 def sanitize_html(content):
     soup = BeautifulSoup(content, 'html.parser')
@@ -0,0 +1,109 @@
+# token_counter.py
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# github.com/FlyingFathead/TelegramBot-OpenAI-API/
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#
+# Model-aware token counting, shared by the whole bot.
+#
+# Picks the tiktoken encoding that matches the model in use (o200k_base for
+# the gpt-4o / gpt-4.1 / o-series families, cl100k_base for gpt-4 /
+# gpt-3.5), loads each encoding lazily once and caches it. If tiktoken is
+# not installed or an encoding can't be loaded, a ~4 characters per token
+# estimate is used instead.
+
+import math
+import logging
+import configparser
+from functools import lru_cache
+
+from config_paths import CONFIG_PATH
+
+try:
+    import tiktoken
+    TIKTOKEN_AVAILABLE = True
+except ImportError:
+    tiktoken = None
+    TIKTOKEN_AVAILABLE = False
+
+logger = logging.getLogger('TelegramBotLogger')
+
+# Load the configuration file
+config = configparser.ConfigParser()
+config.read(CONFIG_PATH)
+
+# used when no model is given
+DEFAULT_MODEL = config.get('DEFAULT', 'Model', fallback='gpt-4o-mini')
+
+# model name prefix => encoding, for models that tiktoken itself doesn't know (yet);
+# checked in order, so longer prefixes go first
+MODEL_ENCODING_PREFIXES = (
+    ('gpt-4.1', 'o200k_base'),
+    ('gpt-4.5', 'o200k_base'),
+    ('gpt-4o', 'o200k_base'),
+    ('gpt-5', 'o200k_base'),
+    ('chatgpt-4o', 'o200k_base'),
+    ('o1', 'o200k_base'),
+    ('o3', 'o200k_base'),
+    ('o4', 'o200k_base'),
+    ('gpt-4', 'cl100k_base'),
+    ('gpt-3.5', 'cl100k_base'),
+)
+DEFAULT_ENCODING = 'o200k_base'
+
+# rough fallback when no encoding is available
+CHARS_PER_TOKEN = 4
+
+
+@lru_cache(maxsize=None)
+def encoding_name_for_model(model):
+    if TIKTOKEN_AVAILABLE:
+        try:
+            return tiktoken.encoding_name_for_model(model)
+        except (KeyError, AttributeError):
+            pass  # unknown to this tiktoken version (or a very old tiktoken); use our own table
+    for prefix, encoding_name in MODEL_ENCODING_PREFIXES:
+        if model.startswith(prefix):
+            return encoding_name
+    return DEFAULT_ENCODING
+
+@lru_cache(maxsize=8)
+def _load_encoding(encoding_name):
+    if not TIKTOKEN_AVAILABLE:
+        logger.warning("tiktoken is not installed; token counts are estimated at ~4 characters per token.")
+        return None
+    try:
+        encoding = tiktoken.get_encoding(encoding_name)
+        logger.info(f"Loaded tiktoken encoding '{encoding_name}'.")
+        return encoding
+    except Exception as e:
+        # i.e. the encoding file couldn't be downloaded; don't retry on every call
+        logger.error(f"Could not load tiktoken encoding '{encoding_name}': {e}. Token counts will be estimated.")
+        return None
+
+def get_encoding(model=None):
+    """The tiktoken encoding for `model` (loaded once), or None if unavailable."""
+    return _load_encoding(encoding_name_for_model(model or DEFAULT_MODEL))
+
+def count_tokens(text, model=None):
+    if not text:
+        return 0
+    encoding = get_encoding(model)
+    if encoding is None:
+        return math.ceil(len(text) / CHARS_PER_TOKEN)
+    return len(encoding.encode(text, disallowed_special=()))
+
+def truncate_to_tokens(text, max_tokens, model=None):
+    """Returns `(text, token_count)`, with `text` cut down to at most `max_tokens` tokens."""
+    if not text:
+        return text, 0
+    encoding = get_encoding(model)
+    if encoding is None:
+        token_count = math.ceil(len(text) / CHARS_PER_TOKEN)
+        if token_count > max_tokens:
+            return text[:max_tokens * CHARS_PER_TOKEN], max_tokens
+        return text, token_count
+
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) > max_tokens:
+        return encoding.decode(tokens[:max_tokens]), max_tokens
+    return text, len(tokens)
@@ -1,13 +1,10 @@
 # token_usage_visualization.py
 
 import matplotlib.pyplot as plt
-import json
 
-def generate_usage_chart(token_usage_file, output_image_file):
+# `data`: {date: tokens}, i.e. the usage ledger's daily totals (see usage_ledger.py)
+def generate_usage_chart(data, output_image_file):
     try:
-        with open(token_usage_file, 'r') as file:
-            data = json.load(file)
-
         dates = list(data.keys())
         usage = list(data.values())
 
@@ -0,0 +1,206 @@
+# tool_calls.py
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# github.com/FlyingFathead/TelegramBot-OpenAI-API/
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#
+# Handlers for the model's tool (function) calls.
+#
+# Every handler takes `(call, arguments)` -- `call` being a
+# `tool_registry.ToolCallContext` -- and returns the result text that the
+# model gets to see; handlers don't send anything to the user. They are
+# registered together with their schemas and limits in `custom_functions.py`
+# and executed by `tool_registry`.
+
+import logging
+import configparser
+
+from config_paths import CONFIG_PATH
+
+from api_get_duckduckgo_search import get_duckduckgo_search
+from api_get_openrouteservice import get_directions_from_addresses, format_and_translate_directions
+from api_get_openweathermap import get_weather
+from api_get_maptiler import get_coordinates_from_address, get_static_map_image
+from api_get_stock_prices_yfinance import get_stock_price, search_stock_symbol
+from api_get_website_dump import get_website_dump
+from api_perplexity_search import query_perplexity
+from calc_module import calculate_expression
+from reminder_handler import handle_add_reminder, handle_delete_reminder, handle_edit_reminder, handle_view_reminders
+
+logger = logging.getLogger('TelegramBotLogger')
+
+# Load the configuration file
+config = configparser.ConfigParser()
+config.read(CONFIG_PATH)
+
+
+# ~~~~~~~~~~~~~
+# tool handlers
+# ~~~~~~~~~~~~~
+
+async def tool_calculate_expression(call, arguments):
+    expression = arguments.get('expression', '')
+    if not expression:
+        logger.warning("Received an empty expression for calculation.")
+        return "Please provide a valid expression for calculation."
+
+    calc_result = await calculate_expression(expression)
+    if calc_result is None or calc_result.strip() == "":
+        logger.warning(f"Calculator returned None or empty result for expression: '{expression}'")
+        return "Calculator returned None or an empty result. Please ensure the expression is valid."
+
+    logger.info(f"Calculation result: {calc_result}")
+    return (
+        f"[Calculator result, explain to the user in their language if needed. "
+        "IMPORTANT: Do not translate or simplify the mathematical expressions themselves. "
+        "NOTE: Telegram doesn't support LaTeX. Use simple HTML formatting, i.e. <code></code> if need be, note that <pre> or <br> are NOT allowed HTML tags. If the user explicitly asks for LaTeX or mentions LaTeX, use LaTeX formatting; "
+        f"otherwise, use plain text or Unicode with simple HTML.] Result:\n{calc_result}\n\n"
+        "[NOTE: format your response appropriately, possibly incorporating additional context or user intent, TRANSLATE it to the user's language if needed.]"
+    )
+
+async def tool_get_weather(call, arguments):
+    city_name = arguments.get('city_name', 'DefaultCity')
+    country = arguments.get('country', None)
+    # set by a speculative prefetch that has already geocoded the city (see tool_prefetch.py)
+    coordinates = arguments.get('_coordinates')
+
+    weather_info = await get_weather(city_name, country=country, coordinates=coordinates)
+    if weather_info:
+        return f"[OpenWeatherMap API request returned data, use according to your own discernment as to what include and what format, by default, use emojis (you're in Telegram)]: {weather_info}"
+    return "[OpenWeatherMap API request failed to retrieve data]"
+
+async def tool_get_duckduckgo_search(call, arguments):
+    search_query = arguments.get('search_query', '')
+    if not search_query:
+        return "Please provide a search query."
+
+    search_results = await get_duckduckgo_search(search_query, call.user_message)
+    if not search_results:
+        return "No results found for your query."
+    return f"[DuckDuckGo Search Results]: {search_results}\n\n[NOTE: format your response as Telegram-compatible HTML with links. Translate your response to the user's language if necessary (= if the user talked to you in Finnish, respond in Finnish).][Use SIMPLE, Telegram-compliant HTML: Use these HTML tags if needed: <b> for bold, <i> for italics, <u> for underline, <s> for strikethrough, <code> for inline code, <pre> for preformatted blocks, and <a href=...> for hyperlinks.. Do NOT use <pre>, <br>, <ul>, <li> or Markdown in your response!]"
+
+async def tool_get_website_dump(call, arguments):
+    url = arguments.get('url', '')
+    if not url:
+        return "URL was invalid. Please provide a valid URL."
+
+    webpage_content = await get_website_dump(url)
+    if not webpage_content:
+        return "No content found for the specified URL."
+    return f"[Webpage Content]: {webpage_content}\n\n[NOTE: format your response as Telegram-compatible HTML with links. Do NOT use <pre> or <br> tags! Translate your response to the user's language if necessary (= if the user talked to you in Finnish, respond in Finnish).]"
+
+async def tool_get_stock_price(call, arguments):
+    symbol = arguments.get('symbol', '')
+    search = arguments.get('search', '')
+
+    if symbol:
+        stock_data = await get_stock_price(symbol)
+    elif search:
+        symbol_info = await search_stock_symbol(search)
+        if isinstance(symbol_info, dict) and '1. symbol' in symbol_info:
+            stock_data = await get_stock_price(symbol_info['1. symbol'])
+        else:
+            stock_data = "Could not find a matching stock symbol."
+    else:
+        stock_data = "Please provide either a stock symbol or a search keyword."
+
+    return f"[Stock Data]: {stock_data}"
+
+async def tool_get_map(call, arguments):
+    address = arguments.get('address', 'DefaultLocation')
+
+    coords_info = await get_coordinates_from_address(address)
+    if not isinstance(coords_info, dict):
+        return f"[Could not resolve the address '{address}' into coordinates for a map.]"
+
+    map_image_url = await get_static_map_image(coords_info['latitude'], coords_info['longitude'], zoom=12, width=400, height=300)
+    return f"[Generated a map for: {address}. Give the user this map link as-is]: {map_image_url}"
+
+async def tool_get_directions_from_addresses(call, arguments):
+    start_address = arguments.get('start_address')
+    end_address = arguments.get('end_address')
+    profile = arguments.get('profile', 'driving-car')  # Use a default value if not specified
+
+    logger.info(f"Received directions request: start_address={start_address}, end_address={end_address}, profile={profile}")
+
+    directions_info = await get_directions_from_addresses(start_address, end_address, profile)
+    if not directions_info:
+        logger.error("Failed to fetch directions info.")
+
+    # Format and potentially translate the directions info
+    formatted_directions_info = await format_and_translate_directions(call.bot, call.user_message, directions_info)
+    if not formatted_directions_info:
+        logger.error("Failed to format directions info for reply.")
+        return "[OpenRouteService directions could not be fetched or formatted.]"
+
+    return f"[OpenRouteService directions, already formatted and translated; relay them to the user as they are]: {formatted_directions_info}"
+
+async def tool_query_perplexity(call, arguments):
+    question = arguments.get('question', '')
+    if not question:
+        logger.warning("No question was provided for the Perplexity query.")
+        return "No question was provided for the Perplexity query."
+
+    perplexity_response = await query_perplexity(call.context.bot, call.chat_id, question)
+    logger.info(f"Raw Perplexity API Response: {perplexity_response}")
+
+    if not perplexity_response:
+        logger.error("Perplexity API returned an invalid or empty response.")
+        return "[Perplexity API returned an invalid or empty response. Tell the user to try again later.]"
+
+    return (
+        f"[Perplexity.ai response]: {perplexity_response} "
+        "[Translate to the user's language if needed. "
+        "Use only Telegram-compatible HTML; keep it simple. CONVERT MARKDOWN TO HTML. NO <br> TAGS!"
+        "Overall, in HTML formatting, DO NOT USE: <ul>, <li>, <br>, <h1>, <h2>, <h3>, <h4>, <h5>, <h6>, <pre> tags. If you want to use a codeblock, use <code>]. Remember to translate to the user's language, i.e. if they're asking in Finnish instead of English, translate into Finnish!"
+    )
+
+async def tool_manage_reminder(call, arguments):
+    action = arguments.get('action')        # "add", "view", "delete", or "edit"
+    reminder_text = arguments.get('reminder_text', '')
+    due_time_utc = arguments.get('due_time_utc', '')
+    reminder_id = arguments.get('reminder_id', None)
+
+    if not config.getboolean('Reminders', 'EnableReminders', fallback=False):
+        return "Reminders are disabled in config. Sorry!"
+
+    if action == 'add':
+        if not due_time_utc:
+            return "No due_time_utc provided for adding a reminder."
+        if not reminder_text:
+            return "No reminder_text provided for adding a reminder."
+
+        result_msg = await handle_add_reminder(call.user_id, call.chat_id, reminder_text, due_time_utc)
+
+        # If it looks like success, have GPT make a nice user-facing confirmation
+        if "has been set" in result_msg:
+            return (
+                f"A new reminder was successfully created for <{due_time_utc}> "
+                f"with text: '{reminder_text}'. "
+                "Please give the user a concise, friendly confirmation message in the user's own language, "
+                "mentioning the date/time but NOT quoting the text verbatim unless it's appropriate to do so. Notice also the time zone. "
+                "i.e. Finland observes Eastern European Time (UTC+2) in winter and Eastern European Summer Time (UTC+3) during daylight savings. "
+            )
+        # Probably an error or partial success
+        return result_msg
+
+    elif action == 'view':
+        raw_result = await handle_view_reminders(call.user_id)
+        prefix = (
+            "Here are the user's alerts. Use the user's language when replying and Telegram-compliant "
+            "HTML tags (NOTE: do NOT use <br>!!). Use simple HTML tags (NO <br>, use regular newlines instead). Do NOT use Markdown! List the reminders without their database id #'s to the user, "
+            "since the numbers are only for database reference [i.e. to delete/edit, etc]). "
+            "If the user wasn't asking about past reminders, don't list them. KÄYTÄ VASTAUKSESSA HTML:ÄÄ. ÄLÄ KÄYTÄ MARKDOWNIA.\n\n"
+        )
+        return prefix + raw_result
+
+    elif action == 'delete':
+        if not reminder_id:
+            return "No reminder_id was provided for delete."
+        return await handle_delete_reminder(call.user_id, reminder_id)
+
+    elif action == 'edit':
+        if not reminder_id:
+            return "No reminder_id was provided for edit."
+        return await handle_edit_reminder(call.user_id, reminder_id, due_time_utc, reminder_text)
+
+    return f"Unknown 'action' for manage_reminder: {action}"
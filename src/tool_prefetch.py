@@ -0,0 +1,239 @@
+# tool_prefetch.py
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# github.com/FlyingFathead/TelegramBot-OpenAI-API/
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#
+# Speculative tool prefetch (opt-in).
+#
+# A tool-using turn is: first completion -> tool call -> tool I/O (geocoding,
+# weather APIs, fetching a page...) -> follow-up completion. For messages
+# that clearly ask for the weather in a city, quote a stock ticker or
+# contain a URL, the tool is started *while* the first completion is still
+# on its way, with the arguments a cheap local detector guessed. If the
+# model then asks for that tool with matching arguments, the registry uses
+# the prefetched result (or waits for the rest of it) instead of starting
+# from scratch -- one network round trip off the critical path. Guesses the
+# model doesn't ask for are cancelled at the end of the turn.
+#
+# Prefetched calls go through the tool's normal concurrency slots, and only
+# tools whose schema is sent with the request are prefetched (see
+# tool_selector.py). A prefetch that fails is never the answer: the model's
+# own call is run instead. Started / used / wasted / failed prefetches and
+# the head start gained are recorded as `tool_prefetch.*` metrics (see
+# `/metrics`).
+# See `[ToolPrefetch]` in config.ini.
+
+import re
+import time
+import asyncio
+import logging
+import configparser
+
+import bot_metrics
+from config_paths import CONFIG_PATH
+from tool_registry import get_tool, run_with_slot
+from api_get_openweathermap import get_coordinates
+
+logger = logging.getLogger('TelegramBotLogger')
+
+# Load the configuration file
+config = configparser.ConfigParser()
+config.read(CONFIG_PATH)
+
+TOOL_PREFETCH_ENABLED = config.getboolean('ToolPrefetch', 'Enabled', fallback=False)
+# which tools may be prefetched (comma-separated); each needs a detector below
+PREFETCH_TOOLS = frozenset(
+    name.strip() for name in config.get('ToolPrefetch', 'Tools', fallback='get_weather, get_stock_price, get_website_dump').split(',') if name.strip()
+)
+
+
+def _same(a, b):
+    return (a or '').strip().casefold() == (b or '').strip().casefold()
+
+
+# ~~~~~~~~~
+# detectors
+# ~~~~~~~~~
+# Each detector returns the guessed tool arguments for a message (or None), and
+# says whether the model's actual arguments are close enough to reuse the result.
+
+class WeatherDetector:
+    """'weather in Helsinki', 'forecast for New York tomorrow' (English phrasing only)."""
+
+    tool = 'get_weather'
+    pattern = re.compile(
+        r"\b(weather|forecast|temperature)\b.*?\b(in|at|for)\s+(?P<city>[A-ZÄÖÅ][\w'-]+(?:\s[A-ZÄÖÅ][\w'-]+)?)"
+    )
+
+    def detect(self, message):
+        match = self.pattern.search(message)
+        return {'city_name': match.group('city')} if match else None
+
+    async def prepare(self, arguments):
+        # the tool wants a country too: take the geocoder's best match for the bare city name,
+        # and hand its coordinates on so that the weather lookup doesn't geocode it again
+        lat, lon, country = await get_coordinates(arguments['city_name'])
+        if lat is None or lon is None or not country:
+            return None
+        return dict(arguments, country=country, _coordinates=(lat, lon, country))
+
+    def matches(self, guessed, requested):
+        if not _same(guessed.get('city_name'), requested.get('city_name')):
+            return False
+        if 'country' not in guessed:
+            return True  # not geocoded yet; checked again once it is
+        # a country code must match; a country name is taken to mean the geocoder's best match
+        requested_country = (requested.get('country') or '').strip()
+        return len(requested_country) != 2 or _same(requested_country, guessed.get('country'))
+
+
+class StockDetector:
+    """'$AAPL', 'NOKIA.HE stock', 'osake TSLA'."""
+
+    tool = 'get_stock_price'
+    pattern = re.compile(
+        r"\$(?P<cashtag>[A-Z]{1,5})\b|"
+        r"\b(?P<before>\^?[A-Z]{2,6}(?:\.[A-Z]{1,2})?)\s+(stock|shares|share price|osake|osakkeen)|"
+        r"\b(stock|share price|osake|osakkeen)\s+(of\s+)?(?P<after>\^?[A-Z]{2,6}(?:\.[A-Z]{1,2})?)\b"
+    )
+
+    def detect(self, message):
+        match = self.pattern.search(message)
+        if not match:
+            return None
+        return {'symbol': match.group('cashtag') or match.group('before') or match.group('after')}
+
+    async def prepare(self, arguments):
+        return arguments
+
+    def matches(self, guessed, requested):
+        return _same(guessed.get('symbol'), requested.get('symbol'))
+
+
+class URLDetector:
+    """The first http(s) URL in the message."""
+
+    tool = 'get_website_dump'
+    pattern = re.compile(r"https?://[^\s<>\"']+")
+
+    def detect(self, message):
+        match = self.pattern.search(message)
+        return {'url': match.group(0).rstrip('.,;:!?)')} if match else None
+
+    async def prepare(self, arguments):
+        return arguments
+
+    def matches(self, guessed, requested):
+        return _same(guessed.get('url', '').rstrip('/'), (requested.get('url') or '').rstrip('/'))
+
+
+DETECTORS = [WeatherDetector(), StockDetector(), URLDetector()]
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~
+# per-turn prefetch state
+# ~~~~~~~~~~~~~~~~~~~~~~~
+
+class Prefetch:
+    """One speculative tool call, started before the model asked for it."""
+
+    def __init__(self, detector, call, arguments):
+        self.detector = detector
+        self.call = call
+        self.arguments = arguments  # the detector's guess; completed by `prepare` once that has run
+        self.started = time.monotonic()
+        self.task = None
+        self.used = False
+
+
+class ToolPrefetcher:
+    """
+    The prefetches of one turn:
+
+        prefetcher = ToolPrefetcher.start(call, user_message, selected_tools)
+        call.prefetch = prefetcher            # tool_registry looks matches up with take()
+        ...
+        prefetcher.discard()                  # at the end of the turn
+    """
+
+    def __init__(self):
+        self.prefetches = []
+
+    @classmethod
+    def start(cls, call, user_message, tools, enabled=TOOL_PREFETCH_ENABLED):
+        prefetcher = cls()
+        if not enabled or not user_message:
+            return prefetcher
+
+        offered = {tool.get('function', {}).get('name') for tool in tools}
+        for detector in DETECTORS:
+            if detector.tool not in PREFETCH_TOOLS or detector.tool not in offered:
+                continue
+            spec = get_tool(detector.tool)
+            guessed = detector.detect(user_message)
+            if spec is None or guessed is None:
+                continue
+            prefetch = Prefetch(detector, call, guessed)
+            prefetch.task = asyncio.ensure_future(cls._run(spec, prefetch))
+            prefetcher.prefetches.append(prefetch)
+            bot_metrics.increment(f"tool_prefetch.{detector.tool}.started")
+            logger.info(f"Tool prefetch: started {detector.tool}({guessed}) alongside the first completion.")
+        return prefetcher
+
+    @staticmethod
+    async def _run(spec, prefetch):
+        arguments = await prefetch.detector.prepare(prefetch.arguments)
+        if arguments is None:
+            raise LookupError(f"nothing to prefetch for {prefetch.arguments}")
+        prefetch.arguments = arguments
+        return await run_with_slot(spec, prefetch.call, arguments, time.monotonic())
+
+    def take(self, name, arguments):
+        """
+        An awaitable with the result of the tool call `name(arguments)` if a matching
+        prefetch is running (or done), else None and the caller runs the tool itself.
+        """
+        for prefetch in self.prefetches:
+            if prefetch.used or prefetch.detector.tool != name:
+                continue
+            if prefetch.task.done() and (prefetch.task.cancelled() or prefetch.task.exception() is not None):
+                continue
+            if not prefetch.detector.matches(prefetch.arguments, arguments):
+                bot_metrics.increment(f"tool_prefetch.{name}.mismatched")
+                continue
+            prefetch.used = True
+            head_start = time.monotonic() - prefetch.started
+            bot_metrics.increment(f"tool_prefetch.{name}.used")
+            bot_metrics.observe("tool_prefetch.head_start", head_start)
+            logger.info(f"Tool prefetch: reusing the {name} call started {head_start:.2f}s earlier.")
+            return self._result(prefetch, arguments)
+        return None
+
+    @staticmethod
+    async def _result(prefetch, arguments):
+        name = prefetch.detector.tool
+        try:
+            content = await prefetch.task
+        except Exception as e:
+            # the guess failed (e.g. the bare city name didn't geocode); the model's own arguments may not
+            logger.info(f"Tool prefetch: the speculative {name} call failed ({e}); running the requested one instead.")
+            bot_metrics.increment(f"tool_prefetch.{name}.failed")
+        else:
+            # a guess that was still being prepared is checked again with the full arguments
+            if prefetch.detector.matches(prefetch.arguments, arguments):
+                return content
+            bot_metrics.increment(f"tool_prefetch.{name}.mismatched")
+        return await run_with_slot(get_tool(name), prefetch.call, arguments, time.monotonic())
+
+    def discard(self):
+        """Cancel the prefetches the model didn't ask for."""
+        for prefetch in self.prefetches:
+            if prefetch.used:
+                continue
+            bot_metrics.increment(f"tool_prefetch.{prefetch.detector.tool}.wasted")
+            if not prefetch.task.done():
+                prefetch.task.cancel()
+            elif not prefetch.task.cancelled():
+                # retrieve a possible exception, so asyncio doesn't warn that it was never read
+                prefetch.task.exception()
+        self.prefetches = []
@@ -0,0 +1,229 @@
+# tool_registry.py
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# github.com/FlyingFathead/TelegramBot-OpenAI-API/
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#
+# Table-driven registry for the model's tools (function calls).
+#
+# Each tool is registered once (see `custom_functions.py`) with:
+#   - its JSON schema (the `custom_functions` / `custom_tools` lists are built from these)
+#   - its async handler (see `tool_calls.py`)
+#   - a max-concurrency limit, so slow tools (lynx, yt-dlp, ...) can't pile up without bound
+#   - a deadline that covers both waiting for a slot and running the tool
+#   - a result-size budget (in characters) for what is fed back to the model
+#
+# The executor runs all tool calls of one model turn concurrently, records
+# per-tool latency/error metrics (`bot_metrics`, viewable with `/metrics`)
+# and requests the follow-up completion with all the results at once.
+
+import time
+import json
+import asyncio
+import logging
+import configparser
+
+import bot_metrics
+from config_paths import CONFIG_PATH
+from tool_selector import follow_up_tools, tool_parameters
+
+logger = logging.getLogger('TelegramBotLogger')
+
+# Load the configuration file
+config = configparser.ConfigParser()
+config.read(CONFIG_PATH)
+
+# Defaults for tools that don't declare their own limits; see `[ToolCalls]` in config.ini
+DEFAULT_TOOL_TIMEOUT = config.getfloat('ToolCalls', 'DefaultTimeout', fallback=45.0)
+DEFAULT_MAX_CONCURRENCY = config.getint('ToolCalls', 'DefaultMaxConcurrency', fallback=4)
+DEFAULT_MAX_RESULT_CHARS = config.getint('ToolCalls', 'DefaultMaxResultChars', fallback=16000)
+
+
+class ToolSpec:
+    """One registered tool: schema, handler and its execution limits."""
+
+    def __init__(self, schema, handler, max_concurrency, deadline, max_result_chars):
+        self.name = schema['name']
+        self.schema = schema
+        self.handler = handler
+        self.max_concurrency = max_concurrency
+        self.deadline = deadline
+        self.max_result_chars = max_result_chars
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.in_flight = 0
+
+
+class ToolCallContext:
+    """What a tool handler may need to know about the message that triggered it."""
+
+    def __init__(self, bot, update, context, user_message):
+        self.bot = bot
+        self.update = update
+        self.context = context
+        self.user_message = user_message
+        self.chat_id = update.effective_chat.id
+        self.user_id = update.effective_user.id
+        # speculative tool calls started for this message, if any (see tool_prefetch.py)
+        self.prefetch = None
+
+
+# ~~~~~~~~~~~~
+# registration
+# ~~~~~~~~~~~~
+
+# name => ToolSpec, in registration order
+TOOL_REGISTRY = {}
+
+def register_tool(schema, handler, max_concurrency=None, deadline=None, max_result_chars=None):
+    spec = ToolSpec(
+        schema,
+        handler,
+        max_concurrency=max_concurrency or DEFAULT_MAX_CONCURRENCY,
+        deadline=deadline or DEFAULT_TOOL_TIMEOUT,
+        max_result_chars=max_result_chars or DEFAULT_MAX_RESULT_CHARS,
+    )
+    if spec.name in TOOL_REGISTRY:
+        logger.warning(f"Tool '{spec.name}' registered twice; the latter registration wins.")
+    TOOL_REGISTRY[spec.name] = spec
+    return spec
+
+def get_tool(name):
+    return TOOL_REGISTRY.get(name)
+
+def get_function_specs():
+    """Schemas in the (legacy) `functions` format."""
+    return [spec.schema for spec in TOOL_REGISTRY.values()]
+
+def get_tool_specs():
+    """Schemas in the `tools` format for the chat completions API."""
+    return [{'type': 'function', 'function': spec.schema} for spec in TOOL_REGISTRY.values()]
+
+
+# ~~~~~~~~~
+# execution
+# ~~~~~~~~~
+
+async def run_with_slot(spec, call, arguments, queued_at):
+    async with spec.semaphore:
+        bot_metrics.observe(f"tool.{spec.name}.queue_wait", time.monotonic() - queued_at)
+        spec.in_flight += 1
+        bot_metrics.set_gauge(f"tool.{spec.name}.in_flight", spec.in_flight)
+        try:
+            return await spec.handler(call, arguments)
+        finally:
+            spec.in_flight -= 1
+            bot_metrics.set_gauge(f"tool.{spec.name}.in_flight", spec.in_flight)
+
+async def run_tool_call(call, tool_call):
+    """Run a single tool call; never raises, errors are returned as the tool result."""
+    function = tool_call.get('function', {})
+    name = function.get('name', '')
+    started = time.monotonic()
+
+    spec = get_tool(name)
+    if spec is None:
+        logger.warning(f"Model requested an unknown tool: '{name}'")
+        bot_metrics.increment("tool.unknown")
+        return _result(tool_call, name, f"[Unknown tool: {name}]", started)
+
+    bot_metrics.increment(f"tool.{name}.calls")
+
+    try:
+        arguments = json.loads(function.get('arguments') or '{}')
+    except json.JSONDecodeError as e:
+        logger.error(f"Invalid JSON arguments for tool '{name}': {e}")
+        bot_metrics.increment(f"tool.{name}.errors")
+        return _result(tool_call, name, f"[The arguments for '{name}' were not valid JSON; the tool was not run.]", started)
+
+    try:
+        # arguments starting with an underscore are internal to the bot (see tool_prefetch.py), never the model's
+        arguments = {key: value for key, value in arguments.items() if not key.startswith('_')}
+        # the deadline covers waiting for a free slot as well as the run itself
+        # a speculative prefetch of this very call may already be under way (see tool_prefetch.py)
+        prefetched = call.prefetch.take(name, arguments) if call.prefetch is not None else None
+        runner = prefetched if prefetched is not None else run_with_slot(spec, call, arguments, started)
+        content = await asyncio.wait_for(runner, timeout=spec.deadline)
+        content = str(content) if content else f"[The tool '{name}' returned no data.]"
+        if len(content) > spec.max_result_chars:
+            logger.info(f"Tool '{name}' result truncated from {len(content)} to {spec.max_result_chars} characters.")
+            bot_metrics.increment(f"tool.{name}.truncated")
+            content = content[:spec.max_result_chars] + "\n[...result truncated]"
+    except asyncio.TimeoutError:
+        logger.error(f"Tool '{name}' missed its {spec.deadline}s deadline.")
+        bot_metrics.increment(f"tool.{name}.timeouts")
+        content = f"[The tool '{name}' timed out after {spec.deadline:g} seconds. Tell the user it didn't respond in time.]"
+    except Exception as e:
+        logger.error(f"Tool '{name}' failed: {e}")
+        bot_metrics.increment(f"tool.{name}.errors")
+        content = f"[The tool '{name}' failed with an error: {e}]"
+
+    result = _result(tool_call, name, content, started)
+    bot_metrics.observe(f"tool.{name}.latency", result['elapsed'])
+    return result
+
+def _result(tool_call, name, content, started):
+    elapsed = time.monotonic() - started
+    logger.info(f"Tool call '{name}' finished in {elapsed:.2f}s")
+    return {
+        "tool_call_id": tool_call.get('id'),
+        "name": name,
+        "content": content,
+        "elapsed": elapsed,
+    }
+
+async def execute_tool_calls(call, tool_calls):
+    """
+    Run every tool call from one model turn concurrently.
+    Returns the results in the same order as `tool_calls`.
+    """
+    names = [tool_call.get('function', {}).get('name') for tool_call in tool_calls]
+    logger.info(f"Executing {len(tool_calls)} tool call(s) in parallel: {names}")
+
+    started = time.monotonic()
+    results = await asyncio.gather(*(run_tool_call(call, tool_call) for tool_call in tool_calls))
+    elapsed = time.monotonic() - started
+
+    bot_metrics.observe("tools.turn_latency", elapsed)
+    bot_metrics.increment("tools.turns")
+    logger.info(f"All {len(results)} tool call(s) done in {elapsed:.2f}s")
+    return list(results)
+
+def build_tool_messages(assistant_message, results):
+    """
+    The messages that go after the conversation in the follow-up request:
+    the assistant's `tool_calls` turn and one `tool` message per result.
+    """
+    messages = [{
+        "role": "assistant",
+        "content": assistant_message.get('content'),
+        "tool_calls": assistant_message['tool_calls'],
+    }]
+    for result in results:
+        messages.append({
+            "role": "tool",
+            "tool_call_id": result['tool_call_id'],
+            "content": result['content'],
+        })
+    return messages
+
+async def run_tool_turn(call, assistant_message, payload, request_completion):
+    """
+    Execute the tool calls of `assistant_message`, then request one follow-up
+    completion with all the results. `payload` is the request that produced
+    `assistant_message`; `request_completion(payload)` performs the API call.
+
+    Returns `(tool_results, <whatever request_completion returned>)`.
+    """
+    results = await execute_tool_calls(call, assistant_message['tool_calls'])
+
+    follow_up_payload = {key: value for key, value in payload.items() if key not in ('tools', 'tool_choice')}
+    follow_up_payload['messages'] = payload['messages'] + build_tool_messages(assistant_message, results)
+    # Answer with the results we have, no further tool rounds; so at most the tools
+    # that were just used are sent along (see tool_selector.py)
+    follow_up_payload.update(tool_parameters(
+        follow_up_tools(payload.get('tools') or [], {result['name'] for result in results}),
+        'none',
+    ))
+
+    with bot_metrics.timer("tools.follow_up_completion"):
+        completion = await request_completion(follow_up_payload)
+    return results, completion
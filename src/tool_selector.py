@@ -0,0 +1,163 @@
+# tool_selector.py
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# github.com/FlyingFathead/TelegramBot-OpenAI-API/
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#
+# Picks the tools (function schemas) worth sending with a request.
+#
+# Every tool schema in `custom_functions.py` goes into the prompt of every
+# completion, follow-ups included; with the long descriptions that's
+# hundreds of prompt tokens per call, mostly for tools that have nothing
+# to do with the message ("thanks!" doesn't need the stock price schema).
+#
+# A cheap local pre-classifier (keyword / regex patterns per tool, English
+# and Finnish) picks the relevant subset for each message; tools without a
+# pattern (i.e. ones you've added yourself) and the `AlwaysInclude` list are
+# always sent. Savings are recorded as `tools.schema_tokens_*` metrics (see
+# `/metrics`).
+#
+# The trade-off: the tools block sits at the very head of the prompt, so a
+# tool list that changes from one request to the next also changes the
+# prompt prefix, and OpenAI's prompt cache (see prompt_assembler.py) misses
+# on everything after it. That's why selection is off by default. With it
+# on, `StickyPerChat` only ever adds tools to a chat's set (a chat's prefix
+# changes once per newly needed tool, not per message), and
+# `FollowUpTools = same` sends the follow-up completion the same tools as
+# the request before it. Compare `openai.prompt_cache_hit_rate` with
+# `tools.schema_tokens_saved` in `/metrics` before turning it on.
+# See `[ToolSelection]` in config.ini.
+
+import re
+import json
+import logging
+import configparser
+
+import bot_metrics
+from config_paths import CONFIG_PATH
+from token_counter import count_tokens
+
+logger = logging.getLogger('TelegramBotLogger')
+
+# Load the configuration file
+config = configparser.ConfigParser()
+config.read(CONFIG_PATH)
+
+TOOL_SELECTION_ENABLED = config.getboolean('ToolSelection', 'Enabled', fallback=False)
+# a chat keeps every tool it has been sent so far, so its prompt prefix stays stable
+STICKY_PER_CHAT = config.getboolean('ToolSelection', 'StickyPerChat', fallback=True)
+# tools sent with every request regardless of the message
+ALWAYS_INCLUDE = frozenset(
+    name.strip() for name in config.get('ToolSelection', 'AlwaysInclude', fallback='query_perplexity').split(',') if name.strip()
+)
+# tools in the follow-up completion after a tool has run: "same" (as the request before it),
+# "relevant" (the ones just called) or "none"
+FOLLOW_UP_TOOLS = config.get('ToolSelection', 'FollowUpTools', fallback='same').strip().lower()
+if FOLLOW_UP_TOOLS not in ('same', 'relevant', 'none'):
+    logger.warning(f"Unknown [ToolSelection] FollowUpTools value '{FOLLOW_UP_TOOLS}'; using 'same'.")
+    FOLLOW_UP_TOOLS = 'same'
+
+# tool name => what in a message suggests the tool might be needed (case-insensitive, matched anywhere)
+TOOL_PATTERNS = {
+    'get_weather': re.compile(
+        r"weather|forecast|temperature|degrees|rain|snow|wind|storm|sunny|cloud|humid|sunrise|sunset|"
+        r"moon|air quality|\buv\b|local time|what time|time in|"
+        r"sää|sata|lämp|pakka|tuul|ennust|myrsk|pilv|aurinko|kuu\b|kuun|kello|paljonko kello",
+        re.IGNORECASE,
+    ),
+    'get_duckduckgo_search': re.compile(
+        r"search|google|duckduckgo|look (it )?up|find|browse|internet|online|"
+        r"hae|etsi|googl|haku|netist|verko",
+        re.IGNORECASE,
+    ),
+    'get_website_dump': re.compile(
+        r"https?://|www\.|\b[\w-]+\.(com|org|net|fi|io|ai|dev|info|co\.uk|de|se)\b|website|web ?page|site|"
+        r"sivu|nettisivu|sivusto",
+        re.IGNORECASE,
+    ),
+    'calculate_expression': re.compile(
+        r"\d\s*[-+*/^%x×÷]\s*\d|\d\s*%|calculat|compute|sqrt|square root|percent|sum of|"
+        r"laske|prosent|neliöjuur|paljonko on|\bplus\b|\bminus\b|times",
+        re.IGNORECASE,
+    ),
+    'get_directions_from_addresses': re.compile(
+        r"direction|route|how (do|can) i get|get (from|to)|drive|driving|walk|cycle|bike|distance|"
+        r"reitti|ajo-ohje|ohjeet|miten pääsee|pääsen|matka|ajaa|kävel|pyöräil|etäisyys",
+        re.IGNORECASE,
+    ),
+    'get_stock_price': re.compile(
+        r"stock|share price|shares|ticker|index|nasdaq|s&p|dow jones|market|crypto|bitcoin|"
+        r"osake|pörssi|kurssi|indeksi|\^[A-Z]{2,}|\$[A-Z]{1,5}\b",
+        re.IGNORECASE,
+    ),
+    'manage_reminder': re.compile(
+        r"remind|reminder|alert|alarm|notify|notification|schedule|"
+        r"muistut|muistuta|muistutus|hälyt|ajast|ilmoita",
+        re.IGNORECASE,
+    ),
+}
+
+# where a chat's sticky tool set is kept (tool names)
+SELECTED_TOOLS_KEY = 'selected_tools'
+
+# tool name => tokens its schema adds to a request (the schemas don't change at runtime)
+_schema_tokens = {}
+
+
+def tool_name(tool):
+    return tool.get('function', {}).get('name', '')
+
+def schema_tokens(tool):
+    name = tool_name(tool)
+    if name not in _schema_tokens:
+        _schema_tokens[name] = count_tokens(json.dumps(tool))
+    return _schema_tokens[name]
+
+def tool_parameters(tools, tool_choice):
+    """
+    The `tools` / `tool_choice` request parameters for `tools`; empty if there
+    are no tools (the API rejects an empty `tools` list, and `tool_choice` without one).
+    """
+    if not tools:
+        return {}
+    return {"tools": tools, "tool_choice": tool_choice}
+
+def select_tools(tools, user_message, context_text="", chat_data=None):
+    """
+    The subset of `tools` relevant to `user_message`; `context_text` (i.e. the
+    bot's previous reply) is matched as well, so "yes, please do" still works.
+    With `StickyPerChat`, the tools the chat (`chat_data`) was sent before are
+    kept, in the same order, so its prompt prefix only changes when it grows.
+    """
+    if not TOOL_SELECTION_ENABLED:
+        return tools
+
+    sticky = chat_data.setdefault(SELECTED_TOOLS_KEY, set()) if STICKY_PER_CHAT and chat_data is not None else set()
+    text = f"{user_message or ''}\n{context_text or ''}"
+    selected = []
+    for tool in tools:
+        name = tool_name(tool)
+        pattern = TOOL_PATTERNS.get(name)
+        if name in ALWAYS_INCLUDE or name in sticky or pattern is None or pattern.search(text):
+            selected.append(tool)
+    if STICKY_PER_CHAT and chat_data is not None:
+        sticky.update(tool_name(tool) for tool in selected)
+
+    _record(tools, selected, "tools.selection")
+    logger.info(f"Tool selection: sending {len(selected)}/{len(tools)} tools: {[tool_name(tool) for tool in selected]}")
+    return selected
+
+def follow_up_tools(tools, used_names):
+    """The tools for the follow-up completion after `used_names` have run."""
+    if not TOOL_SELECTION_ENABLED or FOLLOW_UP_TOOLS == 'same':
+        return tools
+    selected = [] if FOLLOW_UP_TOOLS == 'none' else [tool for tool in tools if tool_name(tool) in used_names]
+    _record(tools, selected, "tools.follow_up")
+    return selected
+
+def _record(tools, selected, metric):
+    offered = sum(schema_tokens(tool) for tool in tools)
+    sent = sum(schema_tokens(tool) for tool in selected)
+    bot_metrics.increment(f"{metric}.requests")
+    bot_metrics.increment(f"{metric}.tools_pruned", len(tools) - len(selected))
+    bot_metrics.increment("tools.schema_tokens_sent", sent)
+    bot_metrics.increment("tools.schema_tokens_saved", offered - sent)
@@ -0,0 +1,122 @@
+# update_processor.py
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# github.com/FlyingFathead/TelegramBot-OpenAI-API/
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#
+# Concurrent update processing with strict per-chat ordering.
+#
+# By default python-telegram-bot handles one update at a time, so a single
+# slow chat (a 60s Perplexity query, a lynx dump, ...) stalls everybody.
+# Plain `concurrent_updates=True` fixes that, but then two messages from
+# the same chat race on `context.chat_data['chat_history']`.
+#
+# `PerChatUpdateProcessor` runs different chats in parallel (up to
+# `MaxConcurrentChats` at once) while updates within one chat go through a
+# per-chat lock, in arrival order. A chat's lock only exists while it has
+# updates running or waiting, so idle chats cost nothing.
+# See `[UpdateProcessing]` in config.ini.
+
+import time
+import asyncio
+import logging
+import configparser
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+import bot_metrics
+from config_paths import CONFIG_PATH
+
+logger = logging.getLogger('TelegramBotLogger')
+
+# Load the configuration file
+config = configparser.ConfigParser()
+config.read(CONFIG_PATH)
+
+CONCURRENT_UPDATES_ENABLED = config.getboolean('UpdateProcessing', 'ConcurrentUpdates', fallback=True)
+MAX_CONCURRENT_CHATS = config.getint('UpdateProcessing', 'MaxConcurrentChats', fallback=16)
+# updates accepted (running + waiting) before the update fetcher itself is held back
+MAX_PENDING_UPDATES = config.getint('UpdateProcessing', 'MaxPendingUpdates', fallback=1024)
+
+
+class _ChatLock:
+    __slots__ = ("lock", "users")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.users = 0  # updates holding or waiting for the lock
+
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """
+    Updates of different chats run concurrently, up to `max_concurrent_chats`
+    at a time; updates of the same chat run one after another, in order.
+    """
+
+    __slots__ = ("_chat_locks", "_running", "_active", "_max_concurrent_chats")
+
+    def __init__(self, max_concurrent_chats=MAX_CONCURRENT_CHATS, max_pending_updates=MAX_PENDING_UPDATES):
+        # PTB's own semaphore only bounds how many updates may be pending at once;
+        # the actual concurrency limit is applied *after* taking the chat lock, so that
+        # a burst from one chat waits in its own line without occupying the slots
+        # the other chats need.
+        super().__init__(max(max_pending_updates, max_concurrent_chats))
+        self._max_concurrent_chats = max_concurrent_chats
+        self._running = asyncio.Semaphore(max_concurrent_chats)
+        self._active = 0
+        self._chat_locks = {}
+
+    @property
+    def max_concurrent_chats(self):
+        return self._max_concurrent_chats
+
+    @staticmethod
+    def chat_key(update):
+        """The key updates are serialized by: the chat, or the user for chat-less updates."""
+        if isinstance(update, Update):
+            if update.effective_chat is not None:
+                return update.effective_chat.id
+            if update.effective_user is not None:
+                return ('user', update.effective_user.id)
+        return None
+
+    async def do_process_update(self, update, coroutine):
+        key = self.chat_key(update)
+        arrived = time.monotonic()
+
+        if key is None:
+            # nothing to keep in order (i.e. poll updates); only the concurrency limit applies
+            async with self._running:
+                await coroutine
+            return
+
+        chat_lock = self._chat_locks.get(key)
+        if chat_lock is None:
+            chat_lock = self._chat_locks[key] = _ChatLock()
+        chat_lock.users += 1
+        try:
+            async with chat_lock.lock:
+                async with self._running:
+                    bot_metrics.observe("updates.queue_wait", time.monotonic() - arrived)
+                    self._active += 1
+                    bot_metrics.set_gauge("updates.active_chats", self._active)
+                    started = time.monotonic()
+                    try:
+                        await coroutine
+                    finally:
+                        self._active -= 1
+                        bot_metrics.set_gauge("updates.active_chats", self._active)
+                        bot_metrics.observe("updates.processing", time.monotonic() - started)
+                        bot_metrics.increment("updates.processed")
+        finally:
+            chat_lock.users -= 1
+            if chat_lock.users == 0 and self._chat_locks.get(key) is chat_lock:
+                # nobody is waiting on this chat any more; let the lock go
+                del self._chat_locks[key]
+            bot_metrics.set_gauge("updates.tracked_chats", len(self._chat_locks))
+
+    async def initialize(self):
+        logger.info(f"Concurrent update processing: up to {self._max_concurrent_chats} chats at once, in order within each chat.")
+
+    async def shutdown(self):
+        self._chat_locks.clear()
@@ -0,0 +1,121 @@
+# usage_counters.py
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# github.com/FlyingFathead/TelegramBot-OpenAI-API/
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#
+# Today's premium & mini token counts, kept in memory (write-behind).
+#
+# The model auto-switch needs today's usage before every message, and
+# every completion adds to it. Instead of a `daily_usage` query for the
+# former and an INSERT + UPDATE for the latter, the counts live here:
+# reading them is a dict lookup, adding to them is an addition. They're
+# seeded from the database at startup (and again at the UTC day
+# rollover), and the tokens added since the last flush are written to
+# `daily_usage` in one transaction every `UsageFlushSeconds`, by the
+# write-behind thread shared with user_usage.py, and on shutdown (see
+# write_behind.py).
+#
+# Usage:
+#   usage_counters.start()                   # at startup
+#   premium, mini = usage_counters.today()
+#   usage_counters.add('premium', 1234)
+#   usage_counters.close()                   # at shutdown: the final flush
+#
+# See `UsageFlushSeconds` under `[Database]` in config.ini.
+
+import atexit
+import logging
+
+import db_utils
+import bot_metrics
+from write_behind import WriteBehindCounts
+
+logger = logging.getLogger('TelegramBotLogger')
+
+TIERS = ('premium', 'mini')
+
+
+def _op_flush(conn, pending):
+    """Adds the pending `(date, tier) => [tokens]` to `daily_usage` (within one transaction)."""
+    for (usage_date, tier), (tokens,) in pending.items():
+        db_utils._op_add_daily_usage(conn, usage_date, tier, tokens)
+    return True
+
+
+class UsageCounters(WriteBehindCounts):
+    """Today's token counts per tier: `seeded` (from the database) + `added` (by this process since)."""
+
+    name = 'usage_counters'
+    label = 'Usage counters'
+    _op_flush = staticmethod(_op_flush)
+
+    def __init__(self):
+        super().__init__()
+        self.seeded = {tier: 0 for tier in TIERS}
+        self.added = {tier: 0 for tier in TIERS}
+
+    def today(self):
+        """`(premium_tokens, mini_tokens)` used today (UTC)."""
+        with self.lock:
+            self._roll_over()
+            return (
+                self.seeded['premium'] + self.added['premium'],
+                self.seeded['mini'] + self.added['mini'],
+            )
+
+    def add(self, tier, tokens):
+        if tokens <= 0:
+            return
+        if tier not in TIERS:
+            logger.warning(f"Unknown model tier '{tier}' provided for usage update. Cannot log.")
+            return
+        with self.lock:
+            self._roll_over()
+            self.added[tier] += tokens
+            self._add_pending((self.day, tier), tokens)
+
+    def periodic(self):
+        super().periodic()
+        premium, mini = self.today()
+        bot_metrics.set_gauge("usage_counters.premium_today", premium)
+        bot_metrics.set_gauge("usage_counters.mini_today", mini)
+
+    # ~~~~~~~~~
+    # internals
+    # ~~~~~~~~~
+
+    def _new_day(self, today):
+        logger.info(f"Usage counters: new UTC day {today} (yesterday: {self.seeded['premium'] + self.added['premium']} premium, {self.seeded['mini'] + self.added['mini']} mini tokens).")
+        self.seeded = {tier: 0 for tier in TIERS}
+        self.added = {tier: 0 for tier in TIERS}
+
+    def _read_seed(self, day):
+        if not db_utils.USAGE_DB_PATH:
+            logger.warning("Usage SQLite DB path not set. Usage counters start from zero.")
+            return (0, 0)
+        return db_utils._get_daily_usage_sync(db_utils.USAGE_DB_PATH, day)
+
+    def _apply_seed(self, day, row):
+        self.seeded = {'premium': row[0], 'mini': row[1]}
+        logger.info(f"Usage counters: seeded {day} from the database: {row[0]} premium, {row[1]} mini tokens.")
+
+
+_counters = UsageCounters()
+
+def start():
+    _counters.start()
+
+def today():
+    return _counters.today()
+
+def add(tier, tokens):
+    _counters.add(tier, tokens)
+
+def flush():
+    return _counters.flush()
+
+def close():
+    _counters.close()
+
+# in case the bot exits without its shutdown hook running
+atexit.register(close)
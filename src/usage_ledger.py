@@ -0,0 +1,183 @@
+# usage_ledger.py
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# github.com/FlyingFathead/TelegramBot-OpenAI-API/
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#
+# The bot's token usage (the `GlobalMaxTokenUsagePerDay` cap, `/usage`,
+# `/usagechart`), as an append-only ledger in the usage database.
+#
+# This used to be `logs/token_usage.json`, read, parsed and rewritten in
+# full after every reply (and by every tool that counted tokens), which
+# grew without bound and raced between concurrent handlers. Now each
+# counted usage is one appended `usage_ledger` row, and the per-day total
+# in `usage_daily_totals` is updated in the same transaction; writes go
+# through async_db's writer thread, batched. Today's total is also kept in
+# memory (seeded from the rollup at startup), so the cap check doesn't
+# touch the database. A reset (`/resetdailytokens`) is a negative entry.
+#
+# The old JSON file is imported once, on the first start, and renamed to
+# `token_usage.json.migrated`. Ledger entries older than
+# `UsageLedgerRetentionDays` are pruned daily; the daily totals are kept.
+# See `[Database]` in config.ini.
+
+import json
+import logging
+import datetime
+import threading
+import configparser
+from pathlib import Path
+
+import db_utils
+import async_db
+from config_paths import CONFIG_PATH
+
+logger = logging.getLogger('TelegramBotLogger')
+
+# Load the configuration file
+config = configparser.ConfigParser()
+config.read(CONFIG_PATH)
+
+# how long the individual ledger entries are kept (the daily totals are kept regardless); 0 = forever
+RETENTION_DAYS = config.getint('Database', 'UsageLedgerRetentionDays', fallback=90)
+
+# the ledger `source` of the entries imported from token_usage.json
+MIGRATED_SOURCE = 'migrated'
+
+
+def utc_date():
+    return datetime.datetime.utcnow().strftime('%Y-%m-%d')
+
+
+def _op_import_legacy_usage(conn, usage_by_date, recorded_at):
+    """Appends a `migrated` entry per date of the old JSON file -- unless that was done already."""
+    already = conn.execute(
+        f"SELECT 1 FROM {db_utils.USAGE_LEDGER_TABLE_NAME} WHERE source = ? LIMIT 1", (MIGRATED_SOURCE,)
+    ).fetchone()
+    if already:
+        return 0
+    for usage_date, tokens in usage_by_date.items():
+        db_utils._op_append_usage(conn, recorded_at, usage_date, MIGRATED_SOURCE, tokens)
+    return len(usage_by_date)
+
+
+class UsageLedger:
+    """Records token usage to the ledger and keeps today's total in memory."""
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.day = utc_date()
+        self.today = 0
+
+    def start(self, legacy_file=None):
+        """Imports the old JSON file (once) and seeds today's total from the ledger."""
+        if self.db_path is None:
+            self.db_path = db_utils.USAGE_DB_PATH
+        if legacy_file:
+            self.migrate(legacy_file)
+        with self.lock:
+            self.day = utc_date()
+            day = self.day
+        total = db_utils.get_usage_total(self.db_path, day) if self.db_path else None
+        if total is None:
+            logger.warning("Usage ledger: couldn't read today's total; starting from zero.")
+            total = 0
+        with self.lock:
+            if self.day == day:
+                self.today += total
+        logger.info(f"Usage ledger: {total} tokens used today ({day}) so far.")
+
+    def today_total(self):
+        """Tokens used today (UTC); an in-memory read."""
+        with self.lock:
+            self._roll_over()
+            return self.today
+
+    def record(self, tokens, source):
+        """Counts `tokens` towards today's usage and appends them to the ledger (not waited for)."""
+        if not tokens:
+            return
+        with self.lock:
+            self._roll_over()
+            self.today += tokens
+            day = self.day
+        if not self.db_path:
+            return
+        recorded_at = datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
+        async_db.submit(self.db_path, db_utils._op_append_usage, recorded_at, day, source, tokens)
+
+    def reset_today(self):
+        """Zeroes today's usage, with a negative `reset` entry (the ledger itself is never rewritten)."""
+        self.record(-self.today_total(), 'reset')
+
+    async def daily_totals(self, days):
+        """`{date: tokens}` for the last `days` days, oldest first."""
+        if not self.db_path:
+            return {}
+        since = (datetime.datetime.utcnow() - datetime.timedelta(days=days)).strftime('%Y-%m-%d')
+        return await async_db.read(db_utils.get_usage_totals, self.db_path, since)
+
+    def prune(self, retention_days=RETENTION_DAYS):
+        """Deletes ledger entries older than `retention_days` (a blocking write; run off the event loop)."""
+        if retention_days <= 0 or not self.db_path:
+            return
+        cutoff = (datetime.datetime.utcnow() - datetime.timedelta(days=retention_days)).strftime('%Y-%m-%d')
+        deleted = db_utils._write(self.db_path, db_utils._op_prune_usage_ledger, cutoff, failure=None)
+        if deleted:
+            logger.info(f"Usage ledger: pruned {deleted} entries from before {cutoff}.")
+
+    def migrate(self, legacy_file):
+        """Imports `token_usage.json` (`{date: tokens}`) into the ledger, once, then renames the file."""
+        legacy_file = Path(legacy_file)
+        if not legacy_file.exists() or not self.db_path:
+            return
+        try:
+            with open(legacy_file, 'r') as file:
+                data = json.load(file)
+            usage_by_date = {
+                date: int(tokens) for date, tokens in data.items()
+                if isinstance(tokens, (int, float)) and tokens
+            }
+        except (OSError, ValueError, AttributeError) as e:
+            logger.error(f"Usage ledger: couldn't read {legacy_file} for migration: {e}")
+            return
+
+        recorded_at = datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
+        imported = db_utils._write(self.db_path, _op_import_legacy_usage, usage_by_date, recorded_at, failure=None)
+        if imported is None:
+            logger.error(f"Usage ledger: migrating {legacy_file} failed; it'll be tried again on the next start.")
+            return
+        if imported:
+            logger.info(f"Usage ledger: imported {imported} days of usage from {legacy_file}.")
+        try:
+            legacy_file.rename(legacy_file.with_name(legacy_file.name + '.migrated'))
+        except OSError as e:
+            logger.warning(f"Usage ledger: couldn't rename {legacy_file} after migrating it: {e}")
+
+    def _roll_over(self):
+        # callers hold `self.lock`
+        today = utc_date()
+        if today != self.day:
+            self.day = today
+            self.today = 0
+
+
+_ledger = UsageLedger()
+
+def start(legacy_file=None):
+    _ledger.start(legacy_file)
+
+def today_total():
+    return _ledger.today_total()
+
+def record(tokens, source):
+    _ledger.record(tokens, source)
+
+def reset_today():
+    _ledger.reset_today()
+
+async def daily_totals(days):
+    return await _ledger.daily_totals(days)
+
+def prune(retention_days=RETENTION_DAYS):
+    _ledger.prune(retention_days)
@@ -0,0 +1,193 @@
+# user_usage.py
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# github.com/FlyingFathead/TelegramBot-OpenAI-API/
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#
+# Token usage per user, chat and model, and per-user daily quotas.
+#
+# Every billable completion (tool follow-ups included) is counted here from
+# its `usage` field: per (day, user, chat, model) in memory, and written to
+# the `usage_by_user_daily` table in one transaction every
+# `UsageFlushSeconds` (by the write-behind thread shared with
+# usage_counters.py, see write_behind.py) and on shutdown. Each user's total
+# for today is kept alongside, seeded from the table at startup (and at the
+# UTC day rollover), so the quota check before a message is a dict lookup
+# rather than a query.
+#
+# The table's primary key leads with the date, so `/topusers` over a date
+# range reads just that range, not the whole table.
+#
+# Usage:
+#   user_usage.start()                                   # at startup
+#   if user_usage.over_quota(user_id): ...               # before calling the API
+#   user_usage.record(user_id, chat_id, model, prompt_tokens, completion_tokens, total_tokens)
+#   rows = await user_usage.top_consumers('2025-01-01', '2025-01-31', 'users')
+#   user_usage.close()                                   # at shutdown: the final flush
+#
+# See `[UserQuotas]` (and `UsageFlushSeconds` under `[Database]`) in config.ini.
+
+import atexit
+import asyncio
+import logging
+import configparser
+
+import db_utils
+import async_db
+import bot_metrics
+from config_paths import CONFIG_PATH
+from write_behind import WriteBehindCounts
+
+logger = logging.getLogger('TelegramBotLogger')
+
+# Load the configuration file
+config = configparser.ConfigParser()
+config.read(CONFIG_PATH)
+
+QUOTAS_ENABLED = config.getboolean('UserQuotas', 'Enabled', fallback=False)
+# tokens per user per UTC day; 0 = unlimited
+DAILY_TOKENS_PER_USER = config.getint('UserQuotas', 'DailyTokensPerUser', fallback=0)
+QUOTA_EXEMPT_OWNER = config.getboolean('UserQuotas', 'ExemptOwner', fallback=True)
+QUOTA_EXCEEDED_MESSAGE = config.get(
+    'UserQuotas', 'QuotaExceededMessage',
+    fallback="You've used up your daily usage quota. Please try again tomorrow!"
+)
+BOT_OWNER_ID = config.get('DEFAULT', 'BotOwnerID', fallback='0')
+
+
+def _parse_overrides(value):
+    """`"12345:500000, 67890:0"` => `{12345: 500000, 67890: 0}`"""
+    overrides = {}
+    for item in (value or '').split(','):
+        item = item.strip()
+        if not item:
+            continue
+        try:
+            user_id, tokens = item.split(':')
+            overrides[int(user_id)] = int(tokens)
+        except ValueError:
+            logger.warning(f"User quotas: ignoring the malformed override '{item}' (expected user_id:tokens).")
+    return overrides
+
+# per-user quotas that differ from the default
+QUOTA_OVERRIDES = _parse_overrides(config.get('UserQuotas', 'UserOverrides', fallback=''))
+
+
+def _op_flush(conn, pending):
+    """Adds the pending `(date, user, chat, model) => [prompt, completion, total, requests]` to the table (within one transaction)."""
+    for (usage_date, user_id, chat_id, model), counts in pending.items():
+        db_utils._op_add_user_usage(conn, usage_date, user_id, chat_id, model, *counts)
+    return True
+
+
+class UserUsage(WriteBehindCounts):
+    """Per-user/chat/model token counts (write-behind) and each user's total for today."""
+
+    name = 'user_usage'
+    label = 'User usage'
+    _op_flush = staticmethod(_op_flush)
+
+    def __init__(self, daily_quota=DAILY_TOKENS_PER_USER, overrides=None, enabled=QUOTAS_ENABLED, exempt_user_ids=()):
+        super().__init__()
+        self.enabled = enabled
+        self.daily_quota = daily_quota
+        self.overrides = dict(overrides or {})
+        self.exempt_user_ids = set(exempt_user_ids)
+        self.today_by_user = {}  # user_id => tokens today (seeded + recorded)
+
+    def start(self):
+        """Seeds today's per-user totals from the database and starts the periodic flush."""
+        super().start()
+        quota = f"{self.daily_quota} tokens/user/day" if self.enabled and self.daily_quota > 0 else "off"
+        logger.info(f"User usage: counted per user/chat/model; daily quota: {quota}.")
+
+    def record(self, user_id, chat_id, model, prompt_tokens, completion_tokens, total_tokens):
+        if user_id is None or total_tokens <= 0:
+            return
+        with self.lock:
+            self._roll_over()
+            self.today_by_user[user_id] = self.today_by_user.get(user_id, 0) + total_tokens
+            key = (self.day, user_id, chat_id if chat_id is not None else 0, model or '')
+            self._add_pending(key, prompt_tokens, completion_tokens, total_tokens, 1)
+
+    def used_today(self, user_id):
+        """Tokens `user_id` has used today (UTC); an in-memory read."""
+        with self.lock:
+            self._roll_over()
+            return self.today_by_user.get(user_id, 0)
+
+    def quota_for(self, user_id):
+        """`user_id`'s daily token quota; 0 = unlimited."""
+        if not self.enabled or user_id in self.exempt_user_ids:
+            return 0
+        return self.overrides.get(user_id, self.daily_quota)
+
+    def over_quota(self, user_id):
+        """True if `user_id` has used up today's quota."""
+        quota = self.quota_for(user_id)
+        if quota <= 0:
+            return False
+        if self.used_today(user_id) < quota:
+            return False
+        bot_metrics.increment("user_usage.quota_denied")
+        return True
+
+    async def top_consumers(self, start_date, end_date, group_by='users', limit=10):
+        """The top consumers between two dates (inclusive); see `db_utils.get_top_consumers`."""
+        if not db_utils.USAGE_DB_PATH:
+            return []
+        # write out what's only in memory so far, so today is included
+        await asyncio.get_running_loop().run_in_executor(None, self.flush)
+        return await async_db.read(db_utils.get_top_consumers, db_utils.USAGE_DB_PATH, start_date, end_date, group_by, limit)
+
+    # ~~~~~~~~~
+    # internals
+    # ~~~~~~~~~
+
+    def _new_day(self, today):
+        self.today_by_user = {}
+
+    def _read_seed(self, day):
+        if not db_utils.USAGE_DB_PATH:
+            logger.warning("Usage SQLite DB path not set. Per-user usage starts from zero.")
+            return {}
+        return db_utils.get_user_usage_totals(db_utils.USAGE_DB_PATH, day)
+
+    def _apply_seed(self, day, totals):
+        # added to, not replaced: what's been recorded since startup is already counted here
+        for user_id, tokens in totals.items():
+            self.today_by_user[user_id] = self.today_by_user.get(user_id, 0) + tokens
+        logger.info(f"User usage: seeded {day} from the database ({len(totals)} users so far).")
+
+
+_exempt = set()
+if QUOTA_EXEMPT_OWNER and BOT_OWNER_ID.isdigit() and BOT_OWNER_ID != '0':
+    _exempt.add(int(BOT_OWNER_ID))
+
+_usage = UserUsage(overrides=QUOTA_OVERRIDES, exempt_user_ids=_exempt)
+
+def start():
+    _usage.start()
+
+def record(user_id, chat_id, model, prompt_tokens, completion_tokens, total_tokens):
+    _usage.record(user_id, chat_id, model, prompt_tokens, completion_tokens, total_tokens)
+
+def used_today(user_id):
+    return _usage.used_today(user_id)
+
+def quota_for(user_id):
+    return _usage.quota_for(user_id)
+
+def over_quota(user_id):
+    return _usage.over_quota(user_id)
+
+def flush():
+    return _usage.flush()
+
+async def top_consumers(start_date, end_date, group_by='users', limit=10):
+    return await _usage.top_consumers(start_date, end_date, group_by, limit)
+
+def close():
+    _usage.close()
+
+# in case the bot exits without its shutdown hook running
+atexit.register(close)
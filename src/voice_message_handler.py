@@ -16,6 +16,7 @@ from telegram.ext import CallbackContext
 from telegram.constants import ParseMode
 # tg-bot stuff
 import utils
+from openai_gateway import get_openai_gateway
 
 # voice message handling logic    
 # async def handle_voice_message(bot, update: Update, context: CallbackContext, data_directory, enable_whisper, max_voice_message_length, logger) -> None:
@@ -93,9 +94,6 @@ async def handle_voice_message(bot, update: Update, context: CallbackContext):
             # Remove HTML bold tags for processing
             transcription_for_model = transcription.replace("<b>", "[Whisper STT transcribed message from the user] ").replace("</b>", " [end]")
             
-            # Store the cleaned transcription in `context.user_data` for further processing
-            context.user_data['transcribed_text'] = transcription_for_model
-
             # Log the transcription
             bot.log_message('Transcription', update.message.from_user.id, transcription_for_model)
 
@@ -104,7 +102,8 @@ async def handle_voice_message(bot, update: Update, context: CallbackContext):
 
             # Now pass the cleaned transcription to the handle_message method
             # which will then use it as part of the conversation with the model
-            await bot.handle_message(update, context)
+            # (as an argument: `user_data` is shared by all of the user's chats, which are handled concurrently)
+            await bot.handle_message(update, context, user_message_override=transcription_for_model)
 
         else:
             # await update.message.reply_text("Voice message transcription failed.")
@@ -121,30 +120,27 @@ async def process_voice_message(file_path: str, enable_whisper, logger):
         try:
             # Whisper API ...
             with open(file_path, "rb") as audio_file:
-                
-                # print out some debugging
-                logger.info(f"Audio file being sent to OpenAI: {audio_file}")
+                audio = audio_file.read()
 
-                transcript_response = await openai.AsyncOpenAI().audio.transcriptions.create(
-                    file=audio_file,
-                    model="whisper-1",
-                    response_format="json"
-                )
-                # Accessing the transcription text directly
-                # return transcript_response['text'] if 'text' in transcript_response else 'No transcription available.'
-                # Accessing the transcription text directly
+            # print out some debugging
+            logger.info(f"Audio file being sent to OpenAI: {file_path} ({len(audio)} bytes)")
 
-                logger.info(f"Transcription Response: {transcript_response}")
+            # through the shared OpenAI gateway: its connection pool, retry policy & circuit breaker
+            response = await get_openai_gateway().transcribe(audio, os.path.basename(file_path), model="whisper-1")
+            response.raise_for_status()
+            transcript_response = response.json()
 
-                transcription_text = transcript_response.text.strip() if hasattr(transcript_response, 'text') else None
+            logger.info(f"Transcription Response: {transcript_response}")
 
-                if transcription_text:
-                    # Add the emojis as Unicode characters to the transcription
-                    transcription_with_emoji = "🎤📝\n<b>" + transcription_text + "</b>"
+            transcription_text = (transcript_response.get('text') or '').strip() or None
 
-                    return transcription_with_emoji
-                else:
-                    return 'No transcription available.'
+            if transcription_text:
+                # Add the emojis as Unicode characters to the transcription
+                transcription_with_emoji = "🎤📝\n<b>" + transcription_text + "</b>"
+
+                return transcription_with_emoji
+            else:
+                return 'No transcription available.'
 
         except FileNotFoundError as e:
             logger.error(f"File not found: {e}")
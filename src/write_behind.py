@@ -0,0 +1,197 @@
+# write_behind.py
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# github.com/FlyingFathead/TelegramBot-OpenAI-API/
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#
+# Write-behind counts for the usage database.
+#
+# Counts that are read before and added to after every message (today's
+# premium/mini tokens in usage_counters.py, the per-user usage in
+# user_usage.py) live in memory. `WriteBehindCounts` keeps the additions
+# not yet in the database as `pending` rows, keyed by `(date, ...)`, and
+# writes them in one transaction per flush; a flush that fails puts them
+# back for the next one. Today's totals are seeded from the database at
+# startup and at the UTC day rollover; until that has happened, today's
+# pending rows are held back, so nothing is counted twice.
+#
+# A single background thread flushes every registered set of counts every
+# `UsageFlushSeconds`; `close()` writes what's left at shutdown.
+#
+# Subclasses provide:
+#   _op_flush(conn, pending)    write `{key: [counts...]}` (a db_utils `_op_*`-style operation)
+#   _read_seed(day)             today's totals from the database, or None if the read failed
+#   _apply_seed(day, seed)      add them to the in-memory totals (called holding `self.lock`)
+#   _new_day(today)             reset the in-memory totals at the rollover (holding `self.lock`)
+#
+# See `UsageFlushSeconds` under `[Database]` in config.ini.
+
+import logging
+import datetime
+import threading
+import configparser
+
+import db_utils
+import bot_metrics
+from config_paths import CONFIG_PATH
+
+logger = logging.getLogger('TelegramBotLogger')
+
+# Load the configuration file
+config = configparser.ConfigParser()
+config.read(CONFIG_PATH)
+
+# how often the counts are written to the database
+FLUSH_INTERVAL_SECONDS = config.getfloat('Database', 'UsageFlushSeconds', fallback=30.0)
+
+
+def utc_date():
+    return datetime.datetime.utcnow().strftime('%Y-%m-%d')
+
+
+class WriteBehindCounts:
+    """In-memory counts for the usage database, flushed in one transaction at a time; see the module header."""
+
+    name = 'write_behind'  # the metrics prefix
+    label = 'Write-behind counts'  # for the logs
+
+    def __init__(self):
+        # added to from the event loop, flushed from the flusher thread
+        self.lock = threading.Lock()
+        self.day = utc_date()
+        self.needs_seed = True
+        self.pending = {}  # (date, ...) => [counts...] not yet in the database
+
+    def start(self):
+        """Seeds today's totals from the database and joins the periodic flush."""
+        self._seed()
+        _flusher.register(self)
+
+    def flush(self, final=False):
+        """Writes the counts added since the last flush in one transaction; returns True if there was nothing to write, or it went in."""
+        with self.lock:
+            self._roll_over()
+            pending, self.pending = self.pending, {}
+            if self.needs_seed and not final:
+                # today's totals haven't been read in yet; writing to them first would count these twice
+                for key in [key for key in pending if key[0] == self.day]:
+                    self.pending[key] = pending.pop(key)
+        if not pending or not db_utils.USAGE_DB_PATH:
+            return True
+
+        if db_utils._write(db_utils.USAGE_DB_PATH, self._op_flush, pending):
+            bot_metrics.increment(f"{self.name}.flushes")
+            logger.debug(f"{self.label}: flushed {len(pending)} rows to the database.")
+            return True
+
+        # put them back, to be retried on the next flush
+        with self.lock:
+            for key, counts in pending.items():
+                self._add_pending(key, *counts)
+        bot_metrics.increment(f"{self.name}.flush_failures")
+        return False
+
+    def close(self):
+        """Leaves the periodic flush and writes what's left."""
+        _flusher.unregister(self)
+        self.flush(final=True)
+
+    def periodic(self):
+        """What the flusher thread does every `UsageFlushSeconds`."""
+        self._seed()
+        self.flush()
+
+    # ~~~~~~~~~
+    # internals
+    # ~~~~~~~~~
+
+    def _add_pending(self, key, *counts):
+        # callers hold `self.lock`
+        current = self.pending.get(key)
+        if current is None:
+            self.pending[key] = list(counts)
+            return
+        for i, value in enumerate(counts):
+            current[i] += value
+
+    def _roll_over(self):
+        # callers hold `self.lock`; the new day is read in by the flusher thread
+        today = utc_date()
+        if today == self.day:
+            return
+        self._new_day(today)
+        self.day = today
+        self.needs_seed = True
+
+    def _seed(self):
+        # what's already in the database for today (i.e. from before a restart); what's been added
+        # in-process since is only flushed after this, so nothing counts twice
+        with self.lock:
+            self._roll_over()
+            if not self.needs_seed:
+                return
+            day = self.day
+        seed = self._read_seed(day)
+        if seed is None:
+            return  # read failed; tried again on the next flush
+        with self.lock:
+            # the day may have rolled over during the read: then the new day still needs its own seed
+            if self.day == day:
+                self._apply_seed(day, seed)
+                self.needs_seed = False
+
+    def _op_flush(self, conn, pending):
+        raise NotImplementedError
+
+    def _read_seed(self, day):
+        raise NotImplementedError
+
+    def _apply_seed(self, day, seed):
+        raise NotImplementedError
+
+    def _new_day(self, today):
+        raise NotImplementedError
+
+
+class Flusher:
+    """The one background thread that flushes every registered `WriteBehindCounts`."""
+
+    def __init__(self, flush_interval=FLUSH_INTERVAL_SECONDS):
+        self.flush_interval = max(1.0, flush_interval)
+        self.lock = threading.Lock()
+        self.registered = []
+        self.stopping = None
+        self.thread = None
+
+    def register(self, counts):
+        with self.lock:
+            if counts not in self.registered:
+                self.registered.append(counts)
+            if self.thread is None:
+                self.stopping = threading.Event()
+                self.thread = threading.Thread(target=self._flush_loop, args=(self.stopping,), name='write_behind-flush', daemon=True)
+                self.thread.start()
+                logger.info(f"Write-behind: usage counts are flushed to the database every {self.flush_interval:g}s.")
+
+    def unregister(self, counts):
+        """Stops flushing `counts`; the thread stops (and is waited for) once nothing is left."""
+        with self.lock:
+            if counts in self.registered:
+                self.registered.remove(counts)
+            if self.registered or self.thread is None:
+                return
+            thread, self.thread = self.thread, None
+            self.stopping.set()
+        thread.join(timeout=10)
+
+    def _flush_loop(self, stopping):
+        while not stopping.wait(self.flush_interval):
+            with self.lock:
+                registered = list(self.registered)
+            for counts in registered:
+                try:
+                    counts.periodic()
+                except Exception as e:
+                    logger.error(f"{counts.label}: periodic flush failed: {e}")
+
+
+_flusher = Flusher()